@@ -63,6 +63,34 @@ const App = () => {
         setMovement(event.target.value); // Capture the selected movement
     };
 
+    // Polls the server until the annotated video has been rendered, backing
+    // off between attempts and giving up after a few minutes
+    const pollVideoUrl = async (path: string) => {
+        const deadline = Date.now() + 5 * 60 * 1000;
+        let delay = 1000;
+        for (let attempt = 0; attempt < 60 && Date.now() < deadline; attempt++) {
+            try {
+                const response = await fetch(`http://127.0.0.1:8000${path}`, {
+                    signal: AbortSignal.timeout(10000),
+                });
+                if (response.status === 200) {
+                    const data = await response.json();
+                    setVideoUrl(data.url);
+                    return;
+                }
+                if (response.status !== 202) {
+                    console.error("Rendering the annotated video failed.");
+                    return;
+                }
+            } catch (error) {
+                console.error("Error polling for the annotated video:", error);
+            }
+            await new Promise((resolve) => setTimeout(resolve, delay));
+            delay = Math.min(delay * 1.5, 5000);
+        }
+        console.error("Timed out waiting for the annotated video.");
+    };
+
     // Handles form submission
     const handleSubmit = async (event: any) => {
         event.preventDefault(); // Prevent default form submission
@@ -88,8 +116,17 @@ const App = () => {
                 const data = await response.json();
                 setWarningFrames(data.warning_frames);
                 setWarningMessages(data.warning_messages);
-                setVideoUrl(data.url);
                 setIsComplete(true);
+                if (data.url) {
+                    setVideoUrl(data.url);
+                } else {
+                    // The annotated video is rendered after the warnings are returned
+                    pollVideoUrl(data.video_url);
+                }
+            } else if (response.status === 422) {
+                // Filmed from an angle this movement can't be checked from
+                const data = await response.json();
+                alert(data.message);
             } else {
                 console.error("Upload failed.");
                 setIsComplete(true);
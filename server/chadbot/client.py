@@ -0,0 +1,193 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
+import httpx
+from django.conf import settings
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MODEL = "@cf/meta/llama-3-8b-instruct"
+SYSTEM_PROMPT = "You are Chadbot, a friendly assistant that answers questions about weightlifting and the importance of achieving proper form when doing heavy lifts. Keep all your answers short and concise."
+
+
+def api_base_url():
+    # CHADBOT_API_BASE_URL points the client elsewhere, e.g. at a mock server
+    return (
+        settings.CHADBOT_API_BASE_URL
+        or f"https://api.cloudflare.com/client/v4/accounts/{os.environ.get('R2_ACCOUNT_ID')}/ai/run/"
+    )
+
+
+def build_input(messages):
+    return {
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            *[{"role": "user", "content": message["content"]} for message in messages],
+        ]
+    }
+
+
+# HTTP clients by event loop, since their connections belong to the loop
+# that opened them. An ASGI worker runs a single loop, so every chat request
+# it serves shares one keep-alive connection pool
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_client():
+    # Retries only connection failures, which happen before the request
+    # reaches the model
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            transport=httpx.AsyncHTTPTransport(
+                retries=2,
+                limits=httpx.Limits(max_connections=settings.CHADBOT_MAX_CONCURRENCY),
+            ),
+            headers={"Authorization": f"Bearer {os.environ.get('AI_API_TOKEN')}"},
+        )
+        _clients[loop] = client
+    return client
+
+
+async def close_client():
+    # Close the running loop's client before the loop itself goes away
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+def timeout():
+    return httpx.Timeout(
+        settings.CHADBOT_READ_TIMEOUT, connect=settings.CHADBOT_CONNECT_TIMEOUT
+    )
+
+
+async def complete(messages):
+    # The model's whole answer as the API's JSON body
+    response = await get_client().post(
+        f"{api_base_url()}{MODEL}", json=build_input(messages), timeout=timeout()
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+async def stream(messages):
+    # Start streaming the model's answer, returning the open response once the
+    # API has accepted the request. The read timeout applies between chunks
+    # rather than to the whole answer
+    client = get_client()
+    request = client.build_request(
+        "POST",
+        f"{api_base_url()}{MODEL}",
+        json={**build_input(messages), "stream": True},
+        timeout=timeout(),
+    )
+    response = await client.send(request, stream=True)
+    try:
+        response.raise_for_status()
+    except httpx.HTTPStatusError:
+        await response.aclose()
+        raise
+    return response
+
+
+def streamed_text(lines):
+    # Reassemble the answer from the "data: {...}" events of a stream
+    text = []
+    for line in lines:
+        if line.startswith(b"data: ") and line != b"data: [DONE]":
+            try:
+                text.append(json.loads(line[6:]).get("response", ""))
+            except ValueError:
+                pass
+    return "".join(text)
+
+
+class ResponseCache:
+    """Answers to recently asked conversations, least recently used first out.
+
+    Entries expire `ttl` seconds after they were stored, so FAQ-style repeats
+    are served without a model call while answers don't go stale forever.
+    """
+
+    def __init__(self, max_entries, ttl, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, messages):
+        # Conversations differing only in case or spacing share an answer
+        contents = [
+            " ".join(message["content"].lower().split()) for message in messages
+        ]
+        return hashlib.sha256(json.dumps(contents).encode()).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > self.clock():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (self.clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+_cache = None
+_limiter = None
+_shared_lock = threading.Lock()
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        with _shared_lock:
+            if _cache is None:
+                _cache = ResponseCache(
+                    settings.CHADBOT_CACHE_SIZE, settings.CHADBOT_CACHE_TTL
+                )
+    return _cache
+
+
+async def acquire(limiter, timeout):
+    # Wait up to `timeout` seconds for a slot without blocking the event loop.
+    # The limiter is a thread semaphore so it also holds across the event
+    # loops of requests served over WSGI
+    deadline = time.monotonic() + timeout
+    while not limiter.acquire(blocking=False):
+        if time.monotonic() >= deadline:
+            return False
+        await asyncio.sleep(0.01)
+    return True
+
+
+def get_limiter():
+    # Caps the model calls in flight so slow answers can't tie up every worker
+    global _limiter
+    if _limiter is None:
+        with _shared_lock:
+            if _limiter is None:
+                _limiter = threading.BoundedSemaphore(settings.CHADBOT_MAX_CONCURRENCY)
+    return _limiter
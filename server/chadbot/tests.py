@@ -1,3 +1,239 @@
-from django.test import TestCase
+import asyncio
+import gc
+import json
+import threading
+import time
+import weakref
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from django.test import SimpleTestCase, override_settings
+from . import client
+from .client import ResponseCache
 
-# Create your tests here.
+
+class MockModelHandler(BaseHTTPRequestHandler):
+    # Answers like the Cloudflare AI API: JSON, or server-sent events when the
+    # request asks to stream. A "slow" prompt sleeps before answering
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.requests.append((self.client_address, body))
+        prompt = body["messages"][-1]["content"]
+        if prompt == "slow":
+            time.sleep(1)
+        if prompt == "broken":
+            self.send_response(500)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        words = ["Keep", " your", " back", " straight"]
+        if body.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            for word in words:
+                self.wfile.write(f"data: {json.dumps({'response': word})}\n\n".encode())
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.close_connection = True
+            return
+
+        data = json.dumps({"result": {"response": "".join(words)}, "success": True})
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data.encode())
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockModelServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # Clients hanging up early (timeouts, abandoned streams) are expected
+        pass
+
+
+class ChatTests(SimpleTestCase):
+    def setUp(self):
+        self.server = MockModelServer(("127.0.0.1", 0), MockModelHandler)
+        self.server.requests = []
+        threading.Thread(
+            target=self.server.serve_forever, args=(0.05,), daemon=True
+        ).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        url = f"http://127.0.0.1:{self.server.server_port}/"
+        overrides = override_settings(
+            CHADBOT_API_BASE_URL=url, CHADBOT_READ_TIMEOUT=0.5
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+        # Fresh shared state for every test
+        for name, value in (
+            ("_clients", weakref.WeakKeyDictionary()),
+            ("_cache", ResponseCache(16, 60)),
+            ("_limiter", threading.BoundedSemaphore(2)),
+        ):
+            patcher = mock.patch.object(client, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def chat(self, content, **data):
+        return await self.async_client.post(
+            "/chat",
+            {"messages": [{"role": "user", "content": content}], **data},
+            content_type="application/json",
+        )
+
+    async def events(self, response):
+        content = b"".join([chunk async for chunk in response.streaming_content])
+        return content.split(b"\n\n")
+
+    async def test_answers_through_a_kept_alive_connection(self):
+        first = await self.chat("How deep should I squat?")
+        second = await self.chat("Should I arch on bench?")
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.json()["result"]["response"], "Keep your back straight")
+        self.assertEqual(second.status_code, 200)
+        addresses = [address for address, _ in self.server.requests]
+        self.assertEqual(len(addresses), 2)
+        self.assertEqual(addresses[0], addresses[1])
+
+        body = self.server.requests[0][1]
+        self.assertEqual(body["messages"][0]["content"], client.SYSTEM_PROMPT)
+        self.assertEqual(body["messages"][1]["content"], "How deep should I squat?")
+
+    @override_settings(CHADBOT_READ_TIMEOUT=5)
+    async def test_waits_on_the_model_without_blocking(self):
+        # Both slow answers are awaited at once on this one thread
+        start = time.monotonic()
+        responses = await asyncio.gather(self.chat("slow"), self.chat("slow"))
+        self.assertEqual([r.status_code for r in responses], [200, 200])
+        self.assertLess(time.monotonic() - start, 1.9)
+
+    def test_answers_over_wsgi(self):
+        # Each WSGI request gets an event loop of its own, so streams are read
+        # in full before responding and the loop's client is closed with it
+        for stream in (False, True):
+            response = self.client.post(
+                "/chat",
+                {
+                    "messages": [{"role": "user", "content": str(stream)}],
+                    "stream": stream,
+                },
+                content_type="application/json",
+            )
+            self.assertEqual(response.status_code, 200)
+        self.assertIn(b"data: [DONE]", b"".join(response.streaming_content))
+        response.close()
+        self.assertEqual(len(client._clients), 0)
+        self.assertEqual(client._limiter._value, 2)
+
+    async def test_repeated_prompts_are_cached(self):
+        await self.chat("What is a deadlift?")
+        cached = await self.chat("  what is a  DEADLIFT? ")
+        await self.chat("What is a squat?")
+
+        self.assertEqual(cached.status_code, 200)
+        self.assertEqual(cached.json()["result"]["response"], "Keep your back straight")
+        self.assertEqual(len(self.server.requests), 2)
+
+    async def test_streams_events_as_they_arrive(self):
+        response = await self.chat("Why brace?", stream=True)
+
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        events = await self.events(response)
+        self.assertEqual(events[0], b'data: {"response": "Keep"}')
+        self.assertEqual(events[-2], b"data: [DONE]")
+        response.close()
+
+        # The finished stream is cached and replayed as events
+        replay = await self.chat("Why brace?", stream=True)
+        events = await self.events(replay)
+        self.assertEqual(events[0], b'data: {"response": "Keep your back straight"}')
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual((await self.chat("Why brace?")).json()["success"], True)
+
+    async def test_stream_releases_its_slot_when_closed_early(self):
+        for _ in range(3):
+            response = await self.chat("Why brace?", stream=True)
+            self.assertEqual(response.status_code, 200)
+            response.close()
+            client.get_cache()._entries.clear()
+
+    async def test_stream_releases_its_slot_when_abandoned(self):
+        # A client hanging up cancels sending the stream, and Django drops the
+        # response without closing it
+        for _ in range(3):
+            response = await self.chat("Why brace?", stream=True)
+            self.assertEqual(response.status_code, 200)
+            stream = aiter(response)
+            await anext(stream)
+            await stream.aclose()
+            del response, stream
+            # The event loop finalises the stream once it's collected
+            gc.collect()
+            await asyncio.sleep(0.05)
+            client.get_cache()._entries.clear()
+
+    async def test_slow_answers_time_out(self):
+        response = await self.chat("slow")
+        self.assertEqual(response.status_code, 504)
+
+    async def test_upstream_errors(self):
+        self.assertEqual((await self.chat("broken")).status_code, 502)
+        self.assertEqual((await self.chat("broken", stream=True)).status_code, 502)
+        self.assertEqual((await self.chat("broken")).status_code, 502)
+        # Failures aren't cached
+        self.assertEqual(len(self.server.requests), 3)
+
+    async def test_rejects_malformed_requests(self):
+        response = await self.async_client.post(
+            "/chat", "not json", content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual((await self.async_client.get("/chat")).status_code, 405)
+
+    @override_settings(CHADBOT_QUEUE_TIMEOUT=0.01)
+    async def test_turns_requests_away_at_the_concurrency_limit(self):
+        limiter = client.get_limiter()
+        limiter.acquire()
+        limiter.acquire()
+        try:
+            response = await self.chat("Is creatine safe?")
+        finally:
+            limiter.release()
+            limiter.release()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "2")
+        self.assertEqual(self.server.requests, [])
+
+
+class ResponseCacheTests(SimpleTestCase):
+    def test_entries_expire(self):
+        now = [0.0]
+        cache = ResponseCache(4, ttl=10, clock=lambda: now[0])
+        cache.put("a", 1)
+        now[0] = 9.9
+        self.assertEqual(cache.get("a"), 1)
+        now[0] = 10.0
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_least_recently_used_is_evicted(self):
+        cache = ResponseCache(2, ttl=60)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), 3)
@@ -1,31 +1,158 @@
-import os, requests
+import asyncio
+import json
+import threading
+from contextlib import suppress
+import httpx
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from rest_framework import status
-from rest_framework.response import Response
-from rest_framework.decorators import api_view
-from dotenv import load_dotenv
-
-load_dotenv()
-
-
-@api_view(["POST"])
-def chat(request):
-    API_BASE_URL = f"https://api.cloudflare.com/client/v4/accounts/{os.environ.get('R2_ACCOUNT_ID')}/ai/run/"
-    headers = {"Authorization": f"Bearer {os.environ.get('AI_API_TOKEN')}"}
-
-    inputs = [
-        {
-            "role": "system",
-            "content": "You are Chadbot, a friendly assistant that answers questions about weightlifting and the importance of achieving proper form when doing heavy lifts. Keep all your answers short and concise.",
-        },
-        *[
-            {"role": "user", "content": message["content"]}
-            for message in request.data["messages"]
-        ],
-    ]
-    input = {"messages": inputs}
-    response = requests.post(
-        f"{API_BASE_URL}@cf/meta/llama-3-8b-instruct", headers=headers, json=input
+from . import client
+
+
+def busy_response():
+    return JsonResponse(
+        {"message": "Chadbot is busy, try again shortly"},
+        status=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={"Retry-After": "2"},
+    )
+
+
+def upstream_error_response(error):
+    if isinstance(error, httpx.TimeoutException):
+        return JsonResponse(
+            {"message": "Chadbot took too long to answer"},
+            status=status.HTTP_504_GATEWAY_TIMEOUT,
+        )
+    return JsonResponse(
+        {"message": "Chadbot is unavailable"}, status=status.HTTP_502_BAD_GATEWAY
     )
-    output = response.json()
 
-    return Response(output, status=status.HTTP_200_OK)
+
+def event_stream_response(events):
+    response = StreamingHttpResponse(events, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    return response
+
+
+async def cached_events(output):
+    # Replay a cached answer in the same event format as a live stream
+    event = {"response": output.get("result", {}).get("response", "")}
+    yield f"data: {json.dumps(event)}\n\n".encode()
+    yield b"data: [DONE]\n\n"
+
+
+class EventStream:
+    """Passes the model's events through as they arrive.
+
+    Holds a concurrency slot until the stream ends or Django closes the
+    response, whether or not the client read it to the end, and caches the
+    answer once it's complete.
+    """
+
+    def __init__(self, response, key, limiter):
+        self.response = response
+        self.key = key
+        self.limiter = limiter
+        self.loop = asyncio.get_running_loop()
+        self.released = False
+        self._lock = threading.Lock()
+
+    async def __aiter__(self):
+        lines = []
+        try:
+            async for line in self.response.aiter_lines():
+                if line:
+                    lines.append(line.encode())
+                    yield lines[-1] + b"\n\n"
+        except httpx.HTTPError:
+            yield b'data: {"error": "Chadbot is unavailable"}\n\n'
+            return
+        finally:
+            # Django doesn't close the response when the client hangs up.
+            # This still runs: straight away if the cancellation lands while
+            # waiting on the model, or once the dropped stream is finalised
+            await self.response.aclose()
+            self.release()
+        client.get_cache().put(
+            self.key,
+            {"result": {"response": client.streamed_text(lines)}, "success": True},
+        )
+
+    def release(self):
+        with self._lock:
+            if self.released:
+                return
+            self.released = True
+        self.limiter.release()
+
+    def close(self):
+        # Called from a thread once Django is done with the response, even if
+        # the stream was never read
+        self.release()
+        if not self.response.is_closed and not self.loop.is_closed():
+            with suppress(RuntimeError):
+                asyncio.run_coroutine_threadsafe(self.response.aclose(), self.loop)
+
+
+@csrf_exempt
+@require_POST
+async def chat(request):
+    # Async so waiting on the model holds no thread when served over ASGI.
+    # Over WSGI each request runs on an event loop of its own, which neither
+    # the model's connection nor its stream can outlive
+    if isinstance(request, ASGIRequest):
+        return await answer(request)
+    try:
+        return await answer(request, buffer=True)
+    finally:
+        await client.close_client()
+
+
+async def answer(request, buffer=False):
+    try:
+        data = json.loads(request.body)
+        messages = data["messages"]
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse(
+            {"message": "Expected a JSON body with messages"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    wants_stream = bool(data.get("stream"))
+
+    cache = client.get_cache()
+    key = cache.key(messages)
+    output = cache.get(key)
+    if output is not None:
+        if wants_stream:
+            return event_stream_response(cached_events(output))
+        return JsonResponse(output, status=status.HTTP_200_OK)
+
+    limiter = client.get_limiter()
+    if not await client.acquire(limiter, settings.CHADBOT_QUEUE_TIMEOUT):
+        return busy_response()
+
+    try:
+        if wants_stream:
+            upstream = await client.stream(messages)
+        else:
+            output = await client.complete(messages)
+    except httpx.HTTPError as e:
+        limiter.release()
+        return upstream_error_response(e)
+    except BaseException:
+        # Cancelled because the client hung up
+        limiter.release()
+        raise
+
+    if wants_stream:
+        events = EventStream(upstream, key, limiter)
+        if buffer:
+            events = [event async for event in events]
+        return event_stream_response(events)
+
+    limiter.release()
+    cache.put(key, output)
+    return JsonResponse(output, status=status.HTTP_200_OK)
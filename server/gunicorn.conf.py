@@ -0,0 +1,115 @@
+# Production server: `gunicorn` from this directory picks this file up.
+#
+# The master loads Django (DJANGO_SETTINGS_MODULE defaults to the production
+# profile) and the pose model weights before forking, so every worker shares
+# them copy-on-write instead of loading its own. Each worker then gets an
+# equal share of the CPUs for torch's intra-op threads, so WEB_CONCURRENCY
+# workers running inference at once don't oversubscribe the machine.
+#
+# Workers serve the ASGI app by default: chat requests wait on the model
+# without holding a thread, live sessions need it, and Django still runs each
+# synchronous view (check-form) on a thread of its own.
+#
+#   WEB_CONCURRENCY        worker processes (default 2)
+#   GUNICORN_WORKER_CLASS  "uvicorn_worker.UvicornWorker" (default), or
+#                          "gthread" to serve the WSGI app, where every
+#                          request holds one of the worker's threads and
+#                          chat answers arrive whole rather than streamed
+#   GUNICORN_THREADS       request threads per gthread worker (default 4)
+#   POSE_INTRA_OP_THREADS  inference threads per worker (default: CPUs split
+#                          between the workers)
+import gc
+import os
+import sys
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "server.production")
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+threads = int(os.environ.get("GUNICORN_THREADS", "4"))
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "uvicorn_worker.UvicornWorker")
+if "uvicorn" in worker_class:
+    wsgi_app = "server.asgi:application"
+else:
+    wsgi_app = "server.wsgi:application"
+# Analysing a long video can take a while
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = 30
+keepalive = 5
+# Recycle workers now and then; forking from the preloaded master is cheap,
+# and worker_exit finishes what a worker holds before it goes
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", "1000"))
+max_requests_jitter = max_requests // 10
+preload_app = True
+accesslog = "-"
+
+
+def available_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def intra_op_threads(cpus, workers):
+    return max(1, cpus // max(1, workers))
+
+
+# Thread pools read these when they start, which is before any hook runs
+pinned = os.environ.setdefault(
+    "POSE_INTRA_OP_THREADS", str(intra_op_threads(available_cpus(), workers))
+)
+for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+    os.environ.setdefault(name, pinned)
+
+
+def when_ready(server):
+    # Runs in the master once the app is loaded, before any worker is forked
+    from django.conf import settings
+    from posedetection.pool import get_pool
+
+    # Only torch weights are loaded here: ONNX Runtime and OpenVINO sessions
+    # own threads that wouldn't survive the fork, so workers load those
+    if settings.POSE_BACKEND == "torch":
+        try:
+            get_pool().warm_up(run_inference=False)
+            server.log.info("Preloaded %s for every worker", settings.POSE_MODEL)
+        except Exception:
+            server.log.exception("Preloading failed, workers load models lazily")
+    # Keep the garbage collector from touching (and so copying) everything
+    # loaded so far in every worker
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    threads = int(os.environ["POSE_INTRA_OP_THREADS"])
+    if "torch" in sys.modules:
+        import torch
+
+        torch.set_num_threads(threads)
+    import cv2
+
+    cv2.setNumThreads(threads)
+
+
+def post_worker_init(worker):
+    # Push a blank frame through each worker's models so its first request
+    # doesn't pay for lazy initialisation
+    from posedetection.pool import get_pool
+
+    try:
+        get_pool().warm_up()
+    except Exception:
+        worker.log.exception("Model warm-up failed")
+
+
+def worker_exit(server, worker):
+    # Jobs, renders and background uploads only live in the worker's memory,
+    # so finish them before it exits, leaving some of the graceful timeout
+    # spare. Jobs that can't finish are failed rather than lost
+    from posedetection.jobs import shutdown
+
+    try:
+        if not shutdown(max(0, worker.cfg.graceful_timeout - 5)):
+            worker.log.warning("Exiting with background work unfinished")
+    except Exception:
+        worker.log.exception("Finishing background work failed")
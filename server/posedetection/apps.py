@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class PosedetectionConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'posedetection'
+
+    def ready(self):
+        if settings.POSE_MODEL_WARMUP:
+            from .pool import get_pool
+
+            get_pool().warm_up()
@@ -0,0 +1,268 @@
+import glob
+import os
+import shutil
+import threading
+import cv2
+import numpy as np
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+# Inference backends for the pose model. "torch" runs the Ultralytics weights
+# as they are; "onnx" and "openvino" export them once into POSE_EXPORT_DIR and
+# run the export directly, with Ultralytics' pre- and post-processing
+# reproduced below so results are interchangeable with the torch backend.
+BACKENDS = ["torch", "onnx", "openvino"]
+
+# Letterbox padding colour and NMS IoU threshold Ultralytics uses for pose
+PAD_COLOR = (114, 114, 114)
+IOU_THRESHOLD = 0.7
+MAX_DETECTIONS = 300
+
+_export_lock = threading.Lock()
+
+
+def read_strided(capture, stride=1):
+    # Decode the next frame the way Ultralytics does for vid_stride: grab
+    # `stride` frames and decode the last, so frames stride - 1, 2 * stride - 1,
+    # ... are read
+    for _ in range(stride):
+        if not capture.grab():
+            return False, None
+    return capture.retrieve()
+
+
+def export_path(model_name, backend, imgsz, int8=False):
+    stem = os.path.splitext(os.path.basename(model_name))[0]
+    name = f"{stem}-{imgsz}{'-int8' if int8 else ''}"
+    # Ultralytics recognises OpenVINO exports by their directory suffix
+    suffix = ".onnx" if backend == "onnx" else "_openvino_model"
+    return os.path.join(settings.POSE_EXPORT_DIR, f"{name}{suffix}")
+
+
+def ultralytics_export(model_name, backend, imgsz, int8=False):
+    from ultralytics import YOLO
+
+    # Dynamic axes let the micro-batcher send batches of any size
+    options = {"format": backend, "imgsz": imgsz, "dynamic": True}
+    if int8 and backend == "openvino":
+        # OpenVINO quantizes statically, calibrating on a small dataset
+        options.update(int8=True, data=settings.POSE_INT8_DATA)
+    return YOLO(model_name).export(**options)
+
+
+def quantize_onnx(source, target):
+    # ONNX Runtime quantizes weights ahead of time and activations on the fly,
+    # so no calibration data is needed
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(source, target, weight_type=QuantType.QUInt8)
+
+
+def export_model(model_name, backend, imgsz, int8=False, exporter=ultralytics_export):
+    # Export once and reuse the cached export on every later load
+    target = export_path(model_name, backend, imgsz, int8)
+    with _export_lock:
+        if os.path.exists(target):
+            return target
+        os.makedirs(settings.POSE_EXPORT_DIR, exist_ok=True)
+        exported = str(exporter(model_name, backend, imgsz, int8))
+        temporary = f"{target}.{os.getpid()}.tmp"
+        if int8 and backend == "onnx":
+            quantize_onnx(exported, temporary)
+        else:
+            shutil.move(exported, temporary)
+        try:
+            os.replace(temporary, target)
+        except OSError:
+            # Another process finished the same export first
+            if not os.path.exists(target):
+                raise
+            shutil.rmtree(temporary, ignore_errors=True)
+    return target
+
+
+class OnnxRunner:
+    def __init__(self, path, threads=0):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = (
+            onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        )
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(
+            path, options, providers=["CPUExecutionProvider"]
+        )
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, batch):
+        return self.session.run(None, {self.input_name: batch})[0]
+
+
+class OpenVinoRunner:
+    def __init__(self, path, threads=0):
+        import openvino
+
+        config = {"PERFORMANCE_HINT": "LATENCY"}
+        if threads:
+            config["INFERENCE_NUM_THREADS"] = threads
+        xml = glob.glob(os.path.join(path, "*.xml"))[0]
+        self.model = openvino.Core().compile_model(xml, "CPU", config)
+        self.output = self.model.output(0)
+
+    def __call__(self, batch):
+        return self.model(batch)[self.output]
+
+
+RUNNERS = {"onnx": OnnxRunner, "openvino": OpenVinoRunner}
+
+
+def letterbox(frame, size):
+    # Resize keeping the aspect ratio and pad to a centred size x size square,
+    # returning the scale and (left, top) padding to map predictions back
+    height, width = frame.shape[:2]
+    scale = min(size / height, size / width)
+    new_width, new_height = round(width * scale), round(height * scale)
+    if (new_width, new_height) != (width, height):
+        frame = cv2.resize(
+            frame, (new_width, new_height), interpolation=cv2.INTER_LINEAR
+        )
+    pad_x, pad_y = (size - new_width) / 2, (size - new_height) / 2
+    left, right = round(pad_x - 0.1), round(pad_x + 0.1)
+    top, bottom = round(pad_y - 0.1), round(pad_y + 0.1)
+    frame = cv2.copyMakeBorder(
+        frame, top, bottom, left, right, cv2.BORDER_CONSTANT, value=PAD_COLOR
+    )
+    return frame, scale, (left, top)
+
+
+def to_input(frames):
+    # BGR HWC uint8 frames to a normalised RGB NCHW float32 batch
+    batch = np.stack(frames)[..., ::-1].transpose(0, 3, 1, 2)
+    return np.ascontiguousarray(batch, dtype=np.float32) / 255
+
+
+def postprocess(prediction, conf, scale, padding, shape):
+    # One image's raw (56, anchors) output, rows being a box centre and size,
+    # the person score and 17 decoded keypoints, to boxes and keypoints in the
+    # original frame, best detection first
+    prediction = prediction.T
+    prediction = prediction[prediction[:, 4] > conf]
+    boxes = np.zeros((0, 6), dtype=np.float32)
+    keypoints = np.zeros((0, 17, 3), dtype=np.float32)
+    if len(prediction):
+        xywh = prediction[:, :4].copy()
+        xywh[:, :2] -= xywh[:, 2:] / 2
+        keep = cv2.dnn.NMSBoxes(
+            xywh.tolist(), prediction[:, 4].tolist(), conf, IOU_THRESHOLD
+        )
+        keep = np.array(keep, dtype=int).reshape(-1)[:MAX_DETECTIONS]
+        prediction, xywh = prediction[keep], xywh[keep]
+
+        height, width = shape
+        offset = np.array(padding, dtype=np.float32)
+        xyxy = np.concatenate([xywh[:, :2], xywh[:, :2] + xywh[:, 2:]], axis=1)
+        xyxy = (xyxy - np.tile(offset, 2)) / scale
+        xyxy[:, [0, 2]] = xyxy[:, [0, 2]].clip(0, width)
+        xyxy[:, [1, 3]] = xyxy[:, [1, 3]].clip(0, height)
+        boxes = np.concatenate(
+            [xyxy, prediction[:, 4:5], np.zeros((len(xyxy), 1))], axis=1
+        ).astype(np.float32)
+
+        keypoints = prediction[:, 5:].reshape(-1, 17, 3).copy()
+        keypoints[..., :2] = (keypoints[..., :2] - offset) / scale
+        keypoints[..., 0] = keypoints[..., 0].clip(0, width)
+        keypoints[..., 1] = keypoints[..., 1].clip(0, height)
+    return boxes, keypoints.astype(np.float32)
+
+
+class ExportedPoseModel:
+    """An exported pose model called like an Ultralytics YOLO model.
+
+    Accepts a frame, a list of frames (run as one batch) or a video path, and
+    returns Ultralytics `Results`, so the rest of the pipeline can't tell it
+    apart from the torch backend.
+    """
+
+    def __init__(self, runner, imgsz=640):
+        self.runner = runner
+        self.imgsz = imgsz
+
+    def _predict(self, frames, conf, imgsz):
+        import torch
+        from ultralytics.engine.results import Results
+
+        letterboxed = [letterbox(frame, imgsz) for frame in frames]
+        output = self.runner(to_input([frame for frame, _, _ in letterboxed]))
+        results = []
+        for frame, prediction, (_, scale, padding) in zip(frames, output, letterboxed):
+            boxes, keypoints = postprocess(
+                prediction, conf, scale, padding, frame.shape[:2]
+            )
+            results.append(
+                Results(
+                    frame,
+                    path="",
+                    names={0: "person"},
+                    boxes=torch.from_numpy(boxes),
+                    keypoints=torch.from_numpy(keypoints),
+                )
+            )
+        return results
+
+    def _stream(self, source, conf, imgsz, vid_stride):
+        capture = cv2.VideoCapture(source)
+        try:
+            while True:
+                ok, frame = read_strided(capture, vid_stride)
+                if not ok:
+                    break
+                yield self._predict([frame], conf, imgsz)[0]
+        finally:
+            capture.release()
+
+    def __call__(
+        self, source=None, stream=False, vid_stride=1, conf=0.25, imgsz=None, **kwargs
+    ):
+        imgsz = imgsz or self.imgsz
+        if isinstance(source, np.ndarray):
+            return self._predict([source], conf, imgsz)
+        if isinstance(source, list):
+            return self._predict(source, conf, imgsz) if source else []
+        results = self._stream(source, conf, imgsz, vid_stride)
+        return results if stream else list(results)
+
+
+def fetch_weights(model_name):
+    # Local path of the model's weights, downloading Ultralytics' released
+    # weights as YOLO() would. None when they can't be had (e.g. offline)
+    from ultralytics.utils.downloads import attempt_download_asset
+
+    try:
+        path = attempt_download_asset(model_name)
+    except OSError:
+        return None
+    return path if os.path.exists(path) else None
+
+
+def load_model(model_name):
+    # Loader for the model pool, picking the backend from settings
+    backend = settings.POSE_BACKEND
+    threads = settings.POSE_INTRA_OP_THREADS
+    if backend == "torch":
+        import torch
+        from ultralytics import YOLO
+
+        if threads:
+            torch.set_num_threads(threads)
+        return YOLO(model_name)
+    if backend not in RUNNERS:
+        raise ImproperlyConfigured(
+            f"POSE_BACKEND must be one of {', '.join(BACKENDS)}, not {backend!r}"
+        )
+
+    imgsz = settings.POSE_MAX_IMGSZ or 640
+    path = export_model(model_name, backend, imgsz, settings.POSE_INT8)
+    return ExportedPoseModel(RUNNERS[backend](path, threads), imgsz)
@@ -0,0 +1,117 @@
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+import cv2
+from django.conf import settings
+from . import metrics, util
+from .backends import read_strided
+from .pool import get_pool
+
+
+class MicroBatcher:
+    """Groups frames from concurrent requests into shared model calls.
+
+    Callers submit single frames and get a future for that frame's compact
+    keypoints. A background thread waits up to `max_wait` seconds after the
+    first queued frame for up to `max_batch` frames, runs them through one
+    pooled model call, and hands each result back to its own future.
+    """
+
+    def __init__(self, pool, max_batch, max_wait, **predict_options):
+        self.pool = pool
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait
+        self.predict_options = predict_options
+        self.batch_sizes = deque(maxlen=1000)
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._loop, name="posedetection-batcher", daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, frame, compact=util.compact_keypoints):
+        # `compact` turns the frame's Results into what the future resolves to
+        future = Future()
+        self._queue.put((frame, future, compact))
+        return future
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            frames = [frame for frame, _, _ in batch]
+            self.batch_sizes.append(len(frames))
+            metrics.observe("posedetection_batch_size", len(frames))
+            try:
+                with self.pool.timed() as model:
+                    results = model(
+                        source=frames,
+                        task="pose",
+                        conf=settings.POSE_CONF,
+                        verbose=False,
+                        **self.predict_options,
+                    )
+                    keypoints = [
+                        compact(result)
+                        for (_, _, compact), result in zip(batch, results)
+                    ]
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future, _), result in zip(batch, keypoints):
+                future.set_result(result)
+
+    def iter_keypoints(self, file, stride=1, compact=util.compact_keypoints):
+        # Decode `file` and yield its keypoints in frame order, keeping only a
+        # couple of batches of frames in flight per video
+        capture = cv2.VideoCapture(file)
+        pending = deque()
+        try:
+            while True:
+                ok, frame = read_strided(capture, stride)
+                if not ok:
+                    break
+                pending.append(self.submit(frame, compact))
+                while len(pending) > self.max_batch * 2:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            capture.release()
+
+
+_batchers = {}
+_batchers_lock = threading.Lock()
+
+
+def get_batcher(imgsz=None):
+    # One batcher per model input size, since a batch must share one size. 0
+    # and None both mean the model's default, and must share a batcher
+    imgsz = imgsz or None
+    with _batchers_lock:
+        batcher = _batchers.get(imgsz)
+        if batcher is None:
+            options = {"imgsz": imgsz} if imgsz else {}
+            batcher = MicroBatcher(
+                get_pool(),
+                settings.POSE_BATCH_MAX_SIZE,
+                settings.POSE_BATCH_MAX_WAIT_MS / 1000,
+                **options,
+            )
+            _batchers[imgsz] = batcher
+    return batcher
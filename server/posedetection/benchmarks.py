@@ -0,0 +1,794 @@
+import json
+import os
+import platform
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+import tracemalloc
+import cv2
+import numpy as np
+from django.conf import settings
+from django.test import override_settings
+from . import features, filters, pipeline, reps, rules, tracking, transcode, util
+from .backends import BACKENDS, fetch_weights, load_model
+from .batching import MicroBatcher
+from .pool import ModelPool, load_yolo
+from .streaming import StreamingChecker
+from .synthetic import (
+    FakePoseModel,
+    add_glitches,
+    make_gym_scene,
+    make_keypoints,
+    write_video,
+)
+
+# Registered benchmarks, run by `python manage.py benchmark`
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+
+    return register
+
+
+def measure(func, repeat=5):
+    # Best-of-`repeat` wall time in seconds, plus the last return value
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def compare_reports(baseline, report, tolerance):
+    # Every "*seconds" value in `report` more than `tolerance` (a fraction)
+    # slower than the same value in `baseline`, as (path, before, after)
+    regressions = []
+
+    def walk(before, after, path):
+        if isinstance(after, dict) and isinstance(before, dict):
+            for key in after:
+                if key in before:
+                    walk(before[key], after[key], f"{path}.{key}" if path else key)
+        elif isinstance(after, list) and isinstance(before, list):
+            for i, (old, new) in enumerate(zip(before, after)):
+                walk(old, new, f"{path}[{i}]")
+        elif path.endswith("seconds") and isinstance(after, (int, float)):
+            if before and after > before * (1 + tolerance):
+                regressions.append((path, before, after))
+
+    walk(baseline, report, "")
+    return regressions
+
+
+def measure_peak_memory(func):
+    # Peak bytes allocated through Python/NumPy while func runs
+    tracemalloc.start()
+    try:
+        result = func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak, result
+
+
+def suppress_nearby_warnings_quadratic(warning_frames, warning_messages, window=25):
+    # The rescanning loop the checkers used before suppress_nearby_warnings
+    warning_frames = list(warning_frames)
+    warning_messages = list(warning_messages)
+    while True:
+        popped = False
+        for i in range(len(warning_frames) - 1):
+            if warning_frames[i + 1] - warning_frames[i] < window:
+                warning_frames.pop(i + 1)
+                warning_messages.pop(i + 1)
+                popped = True
+                break
+
+        if not popped:
+            return warning_frames, warning_messages
+
+
+@benchmark("suppress_warnings")
+def bench_suppress_warnings(sizes=(1000, 5000, 20000), repeat=3):
+    results = []
+    rng = np.random.default_rng(0)
+    for size in sizes:
+        # Dense warnings: almost every frame is flagged, as on a badly-formed set
+        frames = np.flatnonzero(rng.random(size * 10 // 9) < 0.9)[:size].tolist()
+        messages = ["Back too bent"] * len(frames)
+
+        linear, kept = measure(
+            lambda: util.suppress_nearby_warnings(frames, messages, util.DEFAULT_FPS),
+            repeat,
+        )
+        quadratic, reference = measure(
+            lambda: suppress_nearby_warnings_quadratic(frames, messages), repeat
+        )
+        results.append(
+            {
+                "warnings": len(frames),
+                "kept": len(kept[0]),
+                "linear_seconds": linear,
+                "quadratic_seconds": quadratic,
+                "speedup": quadratic / linear if linear else None,
+                "identical": kept == reference,
+            }
+        )
+    return results
+
+
+@benchmark("streaming_memory")
+def bench_streaming_memory(lengths=(150, 600), size=(320, 240)):
+    # Peak memory of materialising every Results object versus streaming compact
+    # keypoints, on synthetic clips of increasing length
+    model = FakePoseModel()
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for frames in lengths:
+            path = write_video(os.path.join(directory, f"{frames}.mp4"), frames, size)
+
+            def materialized():
+                return [result.keypoints for result in model(source=path)]
+
+            def streamed():
+                return util.collect_keypoints(util.iter_keypoints(model, path))
+
+            materialized_peak, _ = measure_peak_memory(materialized)
+            streamed_peak, keypoints = measure_peak_memory(streamed)
+            results.append(
+                {
+                    "frames": frames,
+                    "keypoint_bytes": keypoints.nbytes,
+                    "materialized_peak_bytes": materialized_peak,
+                    "streamed_peak_bytes": streamed_peak,
+                }
+            )
+    return results
+
+
+def warning_agreement(reference, candidate, window):
+    # Fraction of reference warnings with a matching candidate warning (same
+    # message) no more than `window` frames away
+    if not reference[0]:
+        return 1.0
+    matched = 0
+    for frame, message in zip(*reference):
+        matched += any(
+            abs(frame - other) <= window and message == other_message
+            for other, other_message in zip(*candidate)
+        )
+    return matched / len(reference[0])
+
+
+@benchmark("subsampling")
+def bench_subsampling(
+    source_fps=60, frames=3600, target_fps=(30, 15, 10), decode_frames=240
+):
+    # Checker latency and warning agreement of subsampled analysis against
+    # full-rate analysis, plus decode time of a generated clip at each stride
+    keypoints = make_keypoints(frames, reps=20, seed=5)
+    window = util.get_warning_window(source_fps)
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        path = write_video(
+            os.path.join(directory, "clip.mp4"), decode_frames, fps=source_fps
+        )
+        model = FakePoseModel(keypoints)
+
+        for movement in pipeline.MOVEMENTS:
+            full_seconds, full = measure(
+                lambda: pipeline.check_keypoints(keypoints, movement, source_fps)
+            )
+            full_decode, _ = measure(
+                lambda: util.collect_keypoints(util.iter_keypoints(model, path)), 1
+            )
+            for target in target_fps:
+                stride = util.get_analysis_stride(source_fps, target)
+                seconds, subsampled = measure(
+                    lambda: pipeline.check_keypoints(
+                        keypoints[stride - 1 :: stride], movement, source_fps, stride
+                    )
+                )
+                decode, _ = measure(
+                    lambda: util.collect_keypoints(
+                        util.iter_keypoints(model, path, vid_stride=stride)
+                    ),
+                    1,
+                )
+                results.append(
+                    {
+                        "movement": movement,
+                        "target_fps": target,
+                        "stride": stride,
+                        "full_check_seconds": full_seconds,
+                        "subsampled_check_seconds": seconds,
+                        "full_decode_seconds": full_decode,
+                        "subsampled_decode_seconds": decode,
+                        "full_warnings": len(full[0]),
+                        "subsampled_warnings": len(subsampled[0]),
+                        "recall": warning_agreement(full, subsampled, window),
+                        "precision": warning_agreement(subsampled, full, window),
+                    }
+                )
+    return results
+
+
+def upload_stand_in(path, bucket_name="howsmyform"):
+    # Time upload_video against moto's in-process S3 instead of R2
+    try:
+        import boto3
+        from moto import mock_aws
+    except ImportError:
+        return {"skipped": "moto is not installed"}
+
+    with mock_aws():
+        client = boto3.client(
+            "s3",
+            region_name="us-east-1",
+            aws_access_key_id="testing",
+            aws_secret_access_key="testing",
+        )
+        client.create_bucket(Bucket=bucket_name)
+        original = util._s3_client
+        util._s3_client = client
+        try:
+            seconds, _ = measure(lambda: util.upload_video(path, bucket_name), 3)
+        finally:
+            util._s3_client = original
+    return {"seconds": seconds, "bytes": os.path.getsize(path)}
+
+
+@benchmark("pipeline")
+def bench_pipeline(frames=900, video_frames=120, fps=30):
+    # Time each stage of check-form on synthetic inputs, without network access.
+    # Stages that need the real model only run when its weights are on disk
+    keypoints = make_keypoints(frames, reps=8, seed=10)
+    has_weights = os.path.exists(settings.POSE_MODEL)
+    stages = {}
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = write_video(os.path.join(directory, "clip.mp4"), video_frames, fps=fps)
+
+        def decode():
+            capture = cv2.VideoCapture(path)
+            count = 0
+            while capture.read()[0]:
+                count += 1
+            capture.release()
+            return count
+
+        seconds, decoded = measure(decode, 3)
+        stages["decode"] = {
+            "seconds": seconds,
+            "frames": decoded,
+            "fps": decoded / seconds,
+        }
+
+        if has_weights:
+            seconds, model = measure(lambda: load_yolo(settings.POSE_MODEL), 1)
+            stages["model_load"] = {"seconds": seconds}
+            backend = "model"
+        else:
+            model = FakePoseModel(keypoints)
+            stages["model_load"] = {"skipped": f"{settings.POSE_MODEL} not found"}
+            backend = "fake"
+
+        pool = ModelPool(settings.POSE_MODEL, loader=lambda name: model)
+
+        def infer():
+            with pool.timed() as pooled:
+                return util.collect_keypoints(util.iter_keypoints(pooled, path))
+
+        seconds, inferred = measure(infer, 1 if has_weights else 3)
+        stages["inference"] = {
+            "seconds": seconds,
+            "backend": backend,
+            "frames": len(inferred),
+            "fps": len(inferred) / seconds,
+        }
+
+        stages["upload_video"] = upload_stand_in(path)
+
+    xy = features.stack_keypoints(keypoints)
+    seconds, (coords, angles, indiv_coords) = measure(
+        lambda: features.extract_features(xy)
+    )
+    stages["features"] = {"seconds": seconds, "frames": frames}
+
+    for movement in rules.MOVEMENTS:
+        stages[f"rules_{movement}"] = {
+            "seconds": measure(
+                lambda: rules.check(movement, coords, angles, indiv_coords, fps)
+            )[0]
+        }
+    return stages
+
+
+class CostModel(FakePoseModel):
+    # A fake model whose calls sleep like a real one: a fixed cost per call
+    # (dispatch, pre/post-processing) plus a smaller cost per frame
+    def __init__(self, call_seconds=0.004, frame_seconds=0.001):
+        super().__init__()
+        self.call_seconds = call_seconds
+        self.frame_seconds = frame_seconds
+
+    def __call__(self, source=None, **kwargs):
+        frames = len(source) if isinstance(source, list) else 1
+        time.sleep(self.call_seconds + self.frame_seconds * frames)
+        return super().__call__(source, **kwargs)
+
+
+@benchmark("microbatch")
+def bench_microbatch(videos=4, video_frames=60, batch_sizes=(1, 4, 8), max_wait=0.005):
+    # Aggregate frames per second of `videos` clips analysed concurrently on
+    # one pooled model, frame by frame versus micro-batched across clips
+    if os.path.exists(settings.POSE_MODEL):
+        model = load_yolo(settings.POSE_MODEL)
+        backend = "model"
+    else:
+        model = CostModel()
+        backend = "fake"
+    pool = ModelPool(settings.POSE_MODEL, loader=lambda name: model)
+    results = []
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = [
+            write_video(os.path.join(directory, f"clip{i}.mp4"), video_frames)
+            for i in range(videos)
+        ]
+
+        def run(keypoints_for):
+            with ThreadPoolExecutor(max_workers=videos) as executor:
+                return sum(
+                    len(util.collect_keypoints(frames))
+                    for frames in executor.map(keypoints_for, paths)
+                )
+
+        for max_batch in batch_sizes:
+            batcher = MicroBatcher(pool, max_batch, max_wait)
+            seconds, frames = measure(lambda: run(batcher.iter_keypoints), 1)
+            sizes = list(batcher.batch_sizes)
+            results.append(
+                {
+                    "backend": backend,
+                    "max_batch": max_batch,
+                    "seconds": seconds,
+                    "frames": frames,
+                    "fps": frames / seconds,
+                    "mean_batch_size": sum(sizes) / len(sizes),
+                }
+            )
+    return results
+
+
+def backend_available(backend):
+    module = {"torch": "torch", "onnx": "onnxruntime", "openvino": "openvino"}
+    try:
+        __import__(module[backend])
+    except ImportError:
+        return False
+    return True
+
+
+@benchmark("backends")
+def bench_backends(frames=32, threads=(0,), int8=(False, True)):
+    # Pose inference throughput of every available backend on a sample photo
+    # from Ultralytics, plus how far each backend's keypoints are from torch's
+    weights = fetch_weights(settings.POSE_MODEL)
+    if weights is None:
+        return {"skipped": f"{settings.POSE_MODEL} not found"}
+    from ultralytics.utils import ASSETS
+
+    image = cv2.imread(str(ASSETS / "bus.jpg"))
+    results = []
+    reference = None
+    for backend in BACKENDS:
+        for quantized in int8 if backend != "torch" else (False,):
+            for count in threads:
+                row = {"backend": backend, "int8": quantized, "threads": count}
+                results.append(row)
+                if not backend_available(backend):
+                    row["skipped"] = f"{backend} is not installed"
+                    continue
+                with override_settings(
+                    POSE_BACKEND=backend,
+                    POSE_INT8=quantized,
+                    POSE_INTRA_OP_THREADS=count,
+                ):
+                    model = load_model(weights)
+
+                def infer():
+                    return [
+                        util.compact_keypoints(
+                            model(image, conf=settings.POSE_CONF, verbose=False)[0]
+                        )
+                        for _ in range(frames)
+                    ]
+
+                model(image, verbose=False)
+                seconds, keypoints = measure(infer, 1)
+                row.update(seconds=seconds, fps=frames / seconds)
+                if reference is None:
+                    reference = keypoints[0]
+                row["max_pixel_difference"] = float(
+                    np.nanmax(np.abs(keypoints[0][:, :2] - reference[:, :2]))
+                )
+    return results
+
+
+@benchmark("streaming_checkers")
+def bench_streaming_checkers(frames=(900, 9000), fps=30):
+    # Time and peak memory of the online checkers (push every frame, then
+    # finalize) against the batch checkers on the whole clip, and whether
+    # their warnings agree
+    results = []
+    for count in frames:
+        keypoints = make_keypoints(count, reps=max(1, count // 150), seed=6)
+        for movement in pipeline.MOVEMENTS:
+
+            def batch():
+                return pipeline.check_keypoints(keypoints, movement, fps, smooth=False)
+
+            def online():
+                checker = StreamingChecker(movement, fps)
+                for row in keypoints:
+                    checker.push(row)
+                return checker.finalize()
+
+            batch_seconds, expected = measure(batch, 3)
+            online_seconds, actual = measure(online, 1)
+            batch_peak, _ = measure_peak_memory(batch)
+            online_peak, _ = measure_peak_memory(online)
+            results.append(
+                {
+                    "movement": movement,
+                    "frames": count,
+                    "batch_seconds": batch_seconds,
+                    "online_seconds": online_seconds,
+                    "online_us_per_frame": online_seconds / count * 1e6,
+                    "batch_peak_bytes": batch_peak,
+                    "online_peak_bytes": online_peak,
+                    "identical": actual == expected,
+                }
+            )
+    return results
+
+
+@benchmark("smoothing")
+def bench_smoothing(frames=900, fps=30, noise=(2.0, 8.0)):
+    # Cost of gap filling and smoothing per frame, and how many warnings each
+    # checker gives on jittery, glitchy keypoints with and without it. The
+    # clean clip is the same movement without any noise
+    results = []
+    for level in noise:
+        clean = make_keypoints(frames, reps=6, noise=0, seed=3)
+        noisy = add_glitches(make_keypoints(frames, reps=6, noise=level, seed=3))
+        seconds, _ = measure(lambda: filters.smooth_keypoints(noisy, fps))
+        for movement in pipeline.MOVEMENTS:
+            counts = {
+                name: len(
+                    pipeline.check_keypoints(keypoints, movement, fps, smooth=smooth)[0]
+                )
+                for name, keypoints, smooth in (
+                    ("clean", clean, False),
+                    ("noisy", noisy, False),
+                    ("smoothed", noisy, True),
+                )
+            }
+            results.append(
+                {
+                    "movement": movement,
+                    "noise": level,
+                    "smoothing_us_per_frame": seconds / frames * 1e6,
+                    "clean_warnings": counts["clean"],
+                    "noisy_warnings": counts["noisy"],
+                    "smoothed_warnings": counts["smoothed"],
+                }
+            )
+    return results
+
+
+@benchmark("tracking")
+def bench_tracking(frames=(300, 3000), fps=30):
+    # Cost of following everyone in a busy gym clip and picking the lifter,
+    # and how often the analysed person really is the lifter with tracking
+    # and when taking the first detection of every frame
+    results = []
+    for count in frames:
+        people, lifter_slot = make_gym_scene(count, reps=max(1, count // 100))
+        lifter = people[np.arange(count), lifter_slot]
+        seconds, tracked = measure(
+            lambda: tracking.lifter_keypoints(people, fps), repeat=3
+        )
+        results.append(
+            {
+                "frames": count,
+                "people": people.shape[1],
+                "seconds": seconds,
+                "us_per_frame": seconds / count * 1e6,
+                "tracked_lifter_frames": float(
+                    np.mean((tracked == lifter).all(axis=(1, 2)))
+                ),
+                "first_detection_lifter_frames": float(np.mean(lifter_slot == 0)),
+            }
+        )
+    return results
+
+
+@benchmark("reps")
+def bench_reps(frames=(900, 9000), reps_per_clip=10, fps=30):
+    # Cost of finding and summarising reps per frame, and the size of the
+    # warnings part of a check-form response per frame and per rep
+    results = []
+    for count in frames:
+        keypoints = make_keypoints(count, reps=reps_per_clip, noise=6.0, seed=2)
+        coords, angles, indiv_coords = pipeline.keypoint_features(keypoints, fps)
+        warning_frames, warning_messages = pipeline.check_features(
+            "squat", coords, angles, indiv_coords, fps
+        )
+        seconds, summaries = measure(
+            lambda: reps.summarize_reps(
+                "squat", angles, warning_frames, warning_messages, fps
+            )
+        )
+        per_frame = {
+            "warning_frames": warning_frames,
+            "warning_messages": warning_messages,
+        }
+        results.append(
+            {
+                "frames": count,
+                "reps_found": len(summaries),
+                "seconds": seconds,
+                "us_per_frame": seconds / count * 1e6,
+                "warnings": len(warning_frames),
+                "per_frame_bytes": len(json.dumps(per_frame)),
+                "per_rep_bytes": len(json.dumps(summaries)),
+            }
+        )
+    return results
+
+
+@benchmark("transcode")
+def bench_transcode(frames=300, size=(640, 480), fps=30, warnings=5):
+    # Size of the web rendition against OpenCV's mp4v render, how long
+    # encoding and cutting a clip per warning take, and the clips' total size
+    if not transcode.enabled():
+        return {"skipped": "ffmpeg is not installed"}
+    with tempfile.TemporaryDirectory() as directory:
+        source = write_video(f"{directory}/render.mp4", frames, size, fps)
+        web = f"{directory}/web.mp4"
+        encode_seconds, _ = measure(
+            lambda: transcode.transcode(source, web, fps), repeat=1
+        )
+        warning_frames = np.linspace(0, frames - 1, warnings).astype(int).tolist()
+
+        def cut():
+            return [
+                transcode.cut_clip(web, f"{directory}/clip{frame}.mp4", frame, fps)
+                for frame in warning_frames
+            ]
+
+        clip_seconds, clips = measure(cut, repeat=1)
+        return {
+            "frames": frames,
+            "mp4v_bytes": os.path.getsize(source),
+            "web_bytes": os.path.getsize(web),
+            "encode_seconds": encode_seconds,
+            "keyframes": len(transcode.keyframe_index(web, fps)["keyframes"]["frame"]),
+            "clip_seconds_each": clip_seconds / warnings,
+            "clip_bytes_total": sum(os.path.getsize(clip) for clip in clips),
+        }
+
+
+# The per-frame checkers the rule engine replaced, kept as the reference its
+# speed and warnings are measured against
+
+
+def per_frame_squat(coords, angles, fps=util.DEFAULT_FPS):
+    warning_frames = []
+    warning_messages = []
+
+    straight_angle = angles["hip"][0]
+    straight_i = 0
+
+    for i in range(len(angles["hip"])):
+        angle = angles["hip"][i]
+        if 180 - angle < straight_angle:
+            straight_angle = angle
+            straight_i = i
+
+    straight_back_length = np.linalg.norm(
+        [
+            (coords["shoulder"][straight_i][0]) - coords["hip"][straight_i][0],
+            (coords["shoulder"][straight_i][1]) - coords["hip"][straight_i][1],
+        ]
+    )
+
+    for frame_i in range(len(angles["hip"])):
+        hip_angle = angles["hip"][frame_i]
+        knee_angle = angles["knee"][frame_i]
+
+        ratio = knee_angle / hip_angle
+        back_length = np.linalg.norm(
+            [
+                (coords["shoulder"][frame_i][0]) - coords["hip"][frame_i][0],
+                (coords["shoulder"][frame_i][1]) - coords["hip"][frame_i][1],
+            ]
+        )
+        if ratio > 1:
+            warning_messages.append("Knees too far forward")
+            warning_frames.append(frame_i)
+        elif back_length < straight_back_length * 0.7:
+            warning_messages.append("Back too bent")
+            warning_frames.append(frame_i)
+
+    # Remove warning frames within 0.5 seconds of one another
+    return util.suppress_nearby_warnings(warning_frames, warning_messages, fps)
+
+
+def per_frame_bench(angles, coords, indiv_coords, fps=util.DEFAULT_FPS):
+    warning_frames = []
+    warning_messages = []
+
+    start_angle = angles["arm"][0]
+    start_index = 0
+
+    frame = 0
+    for i in range(len(angles["arm"])):
+        angle = angles["arm"][i]
+        if 180 - angle < start_angle:
+            start_angle = angle
+            start_index = i
+            frame = i
+
+    shoulder_width = abs(
+        indiv_coords["right_shoulder"][start_index][0]
+        - indiv_coords["left_shoulder"][start_index][0]
+    )
+
+    frames = []
+    for i in range(len(coords["elbow"])):
+        if coords["elbow"][i][1] >= coords["shoulder"][i][1]:
+            frames.append(i)
+
+    for frame in frames:
+        if abs(
+            indiv_coords["left_shoulder"][frame][0]
+            - indiv_coords["left_elbow"][frame][0]
+        ) > shoulder_width * 0.8 or (
+            abs(
+                indiv_coords["right_shoulder"][frame][0]
+                - indiv_coords["right_elbow"][frame][0]
+            )
+            > shoulder_width * 0.8
+        ):
+            warning_messages.append(
+                "Elbows too far from body, try keeping them 45 degrees from torso"
+            )
+            warning_frames.append(frame)
+
+    # Remove warning frames within 0.5 seconds of one another
+    return util.suppress_nearby_warnings(warning_frames, warning_messages, fps)
+
+
+def per_frame_deadlift(coords, angles, fps=util.DEFAULT_FPS):
+    warning_frames = []
+    warning_messages = []
+
+    straight_angle = angles["hip"][0]
+    straight_i = 0
+
+    for i in range(len(angles["hip"])):
+        angle = angles["hip"][i]
+        if 180 - angle < straight_angle:
+            straight_angle = angle
+            straight_i = i
+
+    initial_back_length = np.linalg.norm(
+        [
+            coords["shoulder"][straight_i][0] - coords["hip"][straight_i][0],
+            coords["shoulder"][straight_i][1] - coords["hip"][straight_i][1],
+        ]
+    )
+
+    # Determine facing direction of user
+    facing_left = 0
+    if coords["knee"][straight_i][0] < coords["ankle"][straight_i][0]:
+        facing_left = 1
+
+    for frame in range(len(angles["hip"])):
+        hip_angle = angles["hip"][frame]
+        knee_angle = angles["knee"][frame]
+
+        ratio = knee_angle / hip_angle
+
+        back_length = np.linalg.norm(
+            [
+                coords["shoulder"][frame][0] - coords["hip"][frame][0],
+                coords["shoulder"][frame][1] - coords["hip"][frame][1],
+            ]
+        )
+
+        margin_error = back_length / 5
+        if back_length < initial_back_length * 0.7:
+            warning_messages.append("Make sure to keep your back straight")
+            warning_frames.append(frame)
+        elif (ratio > 3 or ratio < 0.7) and coords["hip"][frame][1] < coords["knee"][
+            frame
+        ][1] - margin_error:
+            warning_messages.append(
+                "Lift with your entire body, not just your legs or back"
+            )
+            warning_frames.append(frame)
+        elif (
+            coords["shoulder"][frame][0] < (coords["hip"][frame][0] - margin_error)
+            and facing_left == 0
+            or coords["shoulder"][frame][0] > (coords["hip"][frame][0] + margin_error)
+            and facing_left == 1
+        ):
+            warning_messages.append("Make sure not to lean back too much")
+            warning_frames.append(frame)
+
+    # Remove warning frames within 0.5 seconds of one another
+    return util.suppress_nearby_warnings(warning_frames, warning_messages, fps)
+
+
+# Their arguments in each one's order
+PER_FRAME_CHECKERS = {
+    "squat": lambda coords, angles, indiv_coords, fps: per_frame_squat(
+        coords, angles, fps
+    ),
+    "bench": lambda coords, angles, indiv_coords, fps: per_frame_bench(
+        angles, coords, indiv_coords, fps
+    ),
+    "deadlift": lambda coords, angles, indiv_coords, fps: per_frame_deadlift(
+        coords, angles, fps
+    ),
+}
+
+
+@benchmark("rules")
+def bench_rules(frames=(900, 9000), fps=30):
+    # Time of the rule engine against the per-frame checkers on the same
+    # features, and whether their warnings agree
+    results = []
+    for count in frames:
+        keypoints = make_keypoints(count, reps=max(1, count // 150), noise=8.0, seed=9)
+        coords, angles, indiv_coords = features.extract_features(keypoints[..., :2])
+        for movement in pipeline.MOVEMENTS:
+            per_frame_seconds, expected = measure(
+                lambda: PER_FRAME_CHECKERS[movement](coords, angles, indiv_coords, fps),
+                3,
+            )
+            rules_seconds, actual = measure(
+                lambda: rules.check(movement, coords, angles, indiv_coords, fps)
+            )
+            results.append(
+                {
+                    "movement": movement,
+                    "frames": count,
+                    "per_frame_seconds": per_frame_seconds,
+                    "rules_seconds": rules_seconds,
+                    "speedup": per_frame_seconds / rules_seconds,
+                    "warnings": len(actual[0]),
+                    "identical": actual == expected,
+                }
+            )
+    return results
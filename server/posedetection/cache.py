@@ -0,0 +1,126 @@
+import hashlib
+import os
+import threading
+from django.conf import settings
+from .tracks import read_track, write_track, write_track_meta
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class PoseCache:
+    """Content-addressed store of pose estimation results.
+
+    Entries are keyed by the upload's hash plus everything that changes the
+    model output. Each one is a keypoint track (see tracks.py) whose metadata
+    also holds the annotated video URL. The directory is kept under
+    `max_bytes` by evicting the least recently used entries.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = str(directory)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def key(self, digest, *options):
+        # Everything that affects the model output must be part of the key
+        parts = ":".join(str(option) for option in (digest, *options))
+        return hashlib.sha256(parts.encode()).hexdigest()
+
+    def _base(self, key):
+        return os.path.join(self.directory, key)
+
+    def _paths(self, key):
+        base = self._base(key)
+        return f"{base}.npy", f"{base}.json"
+
+    def _count(self, stat):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def get(self, key):
+        array_path, _ = self._paths(key)
+        try:
+            keypoints, meta = read_track(self._base(key))
+            # Touch the entry so eviction sees it as recently used. Another
+            # thread or worker may have evicted it since it was read
+            os.utime(array_path)
+        except (OSError, ValueError):
+            self._count("misses")
+            return None
+
+        self._count("hits")
+        return keypoints, meta
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def put(self, key, keypoints, meta):
+        if not self.enabled:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        write_track(self._base(key), keypoints, meta)
+        self.evict()
+
+    def update_meta(self, key, meta):
+        # Replace the metadata of an existing entry, e.g. once a video is rendered
+        array_path, _ = self._paths(key)
+        if not self.enabled or not os.path.exists(array_path):
+            return
+        write_track_meta(self._base(key), meta)
+
+    def evict(self):
+        entries = {}
+        for entry in os.scandir(self.directory):
+            key, extension = os.path.splitext(entry.name)
+            if extension not in (".npy", ".json"):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                # Evicted by another thread or worker while scanning
+                continue
+            size, used = entries.get(key, (0, 0))
+            if extension == ".npy":
+                used = stat.st_mtime
+            entries[key] = (size + stat.st_size, used)
+
+        total = sum(size for size, _ in entries.values())
+        for key, (size, _) in sorted(entries.items(), key=lambda item: item[1][1]):
+            if total <= self.max_bytes:
+                break
+            for path in self._paths(key):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total -= size
+            self._count("evictions")
+
+    def metrics(self):
+        with self._lock:
+            return dict(self.stats)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = PoseCache(
+                    settings.POSE_CACHE_DIR, settings.POSE_CACHE_MAX_BYTES
+                )
+    return _cache
@@ -0,0 +1,76 @@
+import numpy as np
+from django.conf import settings
+from .headers import *
+
+# Where a clip was filmed from, relative to the lifter. Seen side-on, the left
+# and right shoulders (and hips) overlap; facing the camera they're nearly as
+# far apart as the torso is long. Their distance over the torso length tells
+# the views apart from keypoints alone, whichever way the lifter is lying or
+# bending
+VIEWS = ("side", "front", "oblique")
+VIEW_NAMES = {"side": "the side", "front": "the front", "oblique": "an angle"}
+# Width to torso length ratios below which a clip is side-on and above which
+# it faces the camera, with oblique views in between. Facing the camera the
+# ratio is around 0.75 and it grows with the sine of the angle turned from
+# side-on, so these split at roughly 20 and 60 degrees
+SIDE_MAX_WIDTH = 0.25
+FRONT_MIN_WIDTH = 0.65
+
+
+class UnsupportedView(ValueError):
+    # Raised for clips filmed from where none of a movement's rules apply
+    def __init__(self, movement, view, supported):
+        self.movement = movement
+        self.view = view
+        self.supported = [name for name in VIEWS if name in supported]
+        names = " or ".join(VIEW_NAMES[name] for name in self.supported)
+        super().__init__(
+            f"A {movement} can't be checked when filmed from {VIEW_NAMES[view]}, "
+            f"try filming from {names}"
+        )
+
+
+def width_ratio(keypoints, min_confidence=0.5):
+    """Mean shoulder and hip width over torso length for (frames, 17, 3)
+    keypoints, NaN if no frame shows all four joints confidently.
+
+    Bending forward shortens the torso on screen, so widths (their median over
+    the frames) are compared with the torso at its longest (a high percentile,
+    to ignore glitches).
+    """
+    keypoints = np.asarray(keypoints, dtype=np.float64)
+    joints = [LEFT_SHOULDER, RIGHT_SHOULDER, LEFT_HIP, RIGHT_HIP]
+    confident = (keypoints[:, joints, 2] >= min_confidence).all(axis=1)
+    xy = keypoints[confident][:, joints, :2]
+    if not len(xy):
+        return np.nan
+
+    shoulder_width = np.linalg.norm(xy[:, 0] - xy[:, 1], axis=1)
+    hip_width = np.linalg.norm(xy[:, 2] - xy[:, 3], axis=1)
+    torso = np.linalg.norm((xy[:, 0] + xy[:, 1] - xy[:, 2] - xy[:, 3]) / 2, axis=1)
+    longest = np.percentile(torso, 90)
+    if not longest > 0:
+        return np.nan
+    return np.median(shoulder_width + hip_width) / 2 / longest
+
+
+def classify_view(keypoints, min_confidence=0.5):
+    # "side", "front" or "oblique" for (frames, 17, 3) keypoints, or None when
+    # no frame shows the shoulders and hips confidently
+    ratio = width_ratio(keypoints, min_confidence)
+    if np.isnan(ratio):
+        return None
+    if ratio < SIDE_MAX_WIDTH:
+        return "side"
+    if ratio > FRONT_MIN_WIDTH:
+        return "front"
+    return "oblique"
+
+
+def view_frames(fps):
+    return max(1, round(settings.POSE_VIEW_SECONDS * fps))
+
+
+def detect_view(keypoints, fps):
+    # The view of a clip from its first POSE_VIEW_SECONDS
+    return classify_view(keypoints[: view_frames(fps)], settings.POSE_MIN_KEYPOINT_CONF)
@@ -0,0 +1,62 @@
+import numpy as np
+from .headers import *
+
+
+def stack_keypoints(keypoints):
+    # Stack the first detected person of every frame into one (frames, 17, 2) array
+    if isinstance(keypoints, np.ndarray):
+        return keypoints[..., :2]
+    frames = [np.asarray(keypoint.xy[0].cpu().numpy()) for keypoint in keypoints]
+    if not frames:
+        return np.empty((0, 17, 2), dtype=np.float32)
+    return np.stack(frames)
+
+
+def get_average_xy(a, b):
+    return (a + b) / 2
+
+
+def calculate_angles(a, b, c):
+    # Angle ABC in degrees for every row of the (frames, 2) arrays a, b and c
+    AB = a - b
+    BC = c - b
+
+    dot_product = AB[:, 0] * BC[:, 0] + AB[:, 1] * BC[:, 1]
+    magnitude_AB = np.sqrt(AB[:, 0] ** 2 + AB[:, 1] ** 2)
+    magnitude_BC = np.sqrt(BC[:, 0] ** 2 + BC[:, 1] ** 2)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cosine = dot_product / (magnitude_AB * magnitude_BC)
+    return np.degrees(np.arccos(np.clip(cosine, -1.0, 1.0)))
+
+
+def extract_features(xy):
+    xy = np.asarray(xy, dtype=np.float64)
+
+    indiv_coords = {
+        "left_shoulder": xy[:, LEFT_SHOULDER],
+        "right_shoulder": xy[:, RIGHT_SHOULDER],
+        "left_elbow": xy[:, LEFT_ELBOW],
+        "right_elbow": xy[:, RIGHT_ELBOW],
+    }
+
+    coords = {
+        "shoulder": get_average_xy(xy[:, LEFT_SHOULDER], xy[:, RIGHT_SHOULDER]),
+        "elbow": get_average_xy(xy[:, LEFT_ELBOW], xy[:, RIGHT_ELBOW]),
+        "wrist": get_average_xy(xy[:, LEFT_WRIST], xy[:, RIGHT_WRIST]),
+        "hip": get_average_xy(xy[:, LEFT_HIP], xy[:, RIGHT_HIP]),
+        "knee": get_average_xy(xy[:, LEFT_KNEE], xy[:, RIGHT_KNEE]),
+        # Only the right ankle is used, matching the original per-frame loop
+        "ankle": get_average_xy(xy[:, RIGHT_ANKLE], xy[:, RIGHT_ANKLE]),
+    }
+
+    angles = {
+        "hip": calculate_angles(coords["shoulder"], coords["hip"], coords["knee"]),
+        "shoulder": calculate_angles(
+            coords["hip"], coords["shoulder"], coords["elbow"]
+        ),
+        "knee": calculate_angles(coords["hip"], coords["knee"], coords["ankle"]),
+        "arm": calculate_angles(coords["shoulder"], coords["elbow"], coords["wrist"]),
+    }
+
+    return coords, angles, indiv_coords
@@ -0,0 +1,96 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from django.conf import settings
+
+# Degree of the polynomial fitted over each smoothing window
+SMOOTHING_POLYORDER = 2
+
+
+def fill_gaps(keypoints, min_confidence=0.5, max_gap=None):
+    """Interpolate missing and low-confidence keypoints from their neighbours.
+
+    Works on a (frames, 17, 3) array of x, y and confidence. A keypoint is
+    missing in a frame when nobody was detected (NaN) or its confidence is
+    below `min_confidence`. Missing runs of at most `max_gap` frames between
+    two confident detections are filled by linear interpolation; detections
+    that are merely unsure are blended with the interpolation in proportion
+    to their confidence. Runs at either end of the clip are left alone.
+    """
+    keypoints = np.array(keypoints, dtype=np.float32)
+    frames = len(keypoints)
+    if frames == 0:
+        return keypoints
+
+    confidence = keypoints[..., 2]
+    observed = ~np.isnan(keypoints[..., :2]).any(axis=2)
+    valid = observed & (confidence >= min_confidence)
+
+    # Nearest confident frame before and after every (frame, joint)
+    index = np.arange(frames)[:, None]
+    previous = np.maximum.accumulate(np.where(valid, index, -1), axis=0)
+    following = np.minimum.accumulate(np.where(valid, index, frames)[::-1], axis=0)[
+        ::-1
+    ]
+    fill = ~valid & (previous >= 0) & (following < frames)
+    if max_gap is not None:
+        fill &= following - previous - 1 <= max_gap
+
+    frame, joint = np.nonzero(fill)
+    before = keypoints[previous[fill], joint]
+    after = keypoints[following[fill], joint]
+    progress = ((frame - previous[fill]) / (following[fill] - previous[fill]))[:, None]
+    interpolated = before[:, :2] + (after[:, :2] - before[:, :2]) * progress
+
+    # Unsure detections still count for as much as their confidence earns
+    weight = np.where(observed[fill], confidence[fill] / min_confidence, 0)[:, None]
+    current = np.nan_to_num(keypoints[frame, joint, :2])
+    keypoints[frame, joint, :2] = weight * current + (1 - weight) * interpolated
+    keypoints[frame, joint, 2] = np.minimum(before[:, 2], after[:, 2])
+    return keypoints
+
+
+def savgol_coefficients(window, polyorder=SMOOTHING_POLYORDER):
+    # Weights giving the centre value of a least-squares polynomial fit
+    half = window // 2
+    offsets = np.arange(-half, half + 1)
+    return np.linalg.pinv(np.vander(offsets, polyorder + 1, increasing=True))[0]
+
+
+def savgol_smooth(values, window, polyorder=SMOOTHING_POLYORDER):
+    """Savitzky–Golay filter along the first (time) axis of `values`.
+
+    Each output is one dot product over a sliding window, so the cost is
+    O(frames * window) for every series at once. Ends are padded with the
+    first and last values, and outputs whose window touches a NaN keep their
+    original value.
+    """
+    values = np.asarray(values)
+    window = min(window, len(values) - (len(values) + 1) % 2)
+    if window <= polyorder + 1:
+        return values.copy()
+
+    half = window // 2
+    padding = [(half, half)] + [(0, 0)] * (values.ndim - 1)
+    windows = sliding_window_view(np.pad(values, padding, mode="edge"), window, axis=0)
+    smoothed = (windows @ savgol_coefficients(window, polyorder)).astype(values.dtype)
+    unsmoothed = np.isnan(smoothed)
+    smoothed[unsmoothed] = values[unsmoothed]
+    return smoothed
+
+
+def smoothing_window(fps):
+    # An odd number of frames spanning about POSE_SMOOTHING_WINDOW_SECONDS
+    frames = round(settings.POSE_SMOOTHING_WINDOW_SECONDS * fps)
+    return frames + 1 - frames % 2
+
+
+def smooth_keypoints(keypoints, fps):
+    # Fill short gaps, then smooth the jitter that makes the checkers' angle
+    # and length thresholds flicker
+    filled = fill_gaps(
+        keypoints,
+        settings.POSE_MIN_KEYPOINT_CONF,
+        round(settings.POSE_MAX_GAP_SECONDS * fps),
+    )
+    filled[..., :2] = savgol_smooth(filled[..., :2], smoothing_window(fps))
+    return filled
@@ -0,0 +1,186 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+from . import metrics, pipeline, render, util
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+STALE_ERROR = "The server restarted before this job finished, please try again"
+
+
+def fail_stale_jobs(jobs=None):
+    """Fail unfinished jobs (of `jobs`, or all of them) whose heartbeat stopped.
+
+    Jobs are only held in the memory of the process that accepted them, so
+    once it exits nothing will ever finish them.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.POSE_JOB_STALE_SECONDS)
+    jobs = Job.objects.all() if jobs is None else jobs
+    return jobs.filter(
+        status__in=[Job.QUEUED, Job.RUNNING], heartbeat_at__lt=cutoff
+    ).update(status=Job.FAILED, error=STALE_ERROR, finished_at=timezone.now())
+
+
+class JobQueue:
+    """Runs check-form jobs on a bounded pool of worker threads.
+
+    At most `capacity` jobs may be queued or running at once; `submit` refuses
+    anything beyond that so callers can push back on clients instead of
+    buffering uploads until the process runs out of memory. Inference itself
+    is serialised by the model pool, so threads are enough here.
+
+    With a `heartbeat` interval, a background thread keeps the jobs this
+    process holds alive in the database and fails those other processes
+    dropped.
+    """
+
+    def __init__(self, workers, capacity, run=None, executor=None, heartbeat=0):
+        self.capacity = max(workers, capacity)
+        self.run = run or pipeline.analyze_video
+        self.executor = executor or ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="posedetection-job"
+        )
+        self._pending = 0
+        self._held = set()
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._stopped = threading.Event()
+        if heartbeat:
+            threading.Thread(
+                target=self._heartbeat,
+                args=(heartbeat,),
+                name="posedetection-job-heartbeat",
+                daemon=True,
+            ).start()
+
+    def pending(self):
+        with self._lock:
+            return self._pending
+
+    def full(self):
+        return self.pending() >= self.capacity
+
+    def submit(self, job):
+        with self._lock:
+            if self._pending >= self.capacity:
+                return False
+            self._pending += 1
+            self._held.add(job.pk)
+        try:
+            self.executor.submit(self._run, job.pk)
+        except Exception:
+            self._release(job.pk)
+            raise
+        return True
+
+    def _release(self, job_id):
+        with self._lock:
+            self._pending -= 1
+            self._held.discard(job_id)
+            self._idle.notify_all()
+
+    def shutdown(self, timeout=None):
+        """Wait up to `timeout` seconds for the jobs held to finish.
+
+        Jobs that don't are failed, and those still queued cancelled, so
+        clients polling them find out now rather than once they go stale.
+        Returns whether every job finished.
+        """
+        with self._idle:
+            finished = self._idle.wait_for(lambda: not self._pending, timeout)
+            held = list(self._held)
+        self._stopped.set()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        if held:
+            Job.objects.filter(
+                pk__in=held, status__in=[Job.QUEUED, Job.RUNNING]
+            ).update(status=Job.FAILED, error=STALE_ERROR, finished_at=timezone.now())
+        return finished
+
+    def beat(self):
+        with self._lock:
+            held = list(self._held)
+        if held:
+            Job.objects.filter(pk__in=held).update(heartbeat_at=timezone.now())
+        fail_stale_jobs()
+
+    def _heartbeat(self, interval):
+        while not self._stopped.wait(interval):
+            try:
+                self.beat()
+            except Exception:
+                logger.exception("Job heartbeat failed")
+            finally:
+                close_old_connections()
+
+    def _run(self, job_id):
+        try:
+            started = Job.objects.filter(pk=job_id, status=Job.QUEUED).update(
+                status=Job.RUNNING, started_at=timezone.now()
+            )
+            if not started:
+                # Given up on as stale while it waited
+                return
+            job = Job.objects.get(pk=job_id)
+            metrics.observe(
+                "posedetection_job_queue_wait_seconds",
+                (job.started_at - job.created_at).total_seconds(),
+            )
+            try:
+                result = self.run(job.upload, job.movement)
+            except Exception as e:
+                Job.objects.filter(pk=job_id).update(
+                    status=Job.FAILED, error=str(e), finished_at=timezone.now()
+                )
+            else:
+                Job.objects.filter(pk=job_id).update(
+                    status=Job.DONE, result=result, finished_at=timezone.now()
+                )
+        finally:
+            # Worker threads aren't request threads, so tidy up their connection
+            close_old_connections()
+            self._release(job_id)
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = JobQueue(
+                    settings.POSE_JOB_WORKERS,
+                    settings.POSE_JOB_QUEUE_SIZE,
+                    heartbeat=settings.POSE_JOB_HEARTBEAT_SECONDS,
+                )
+    return _queue
+
+
+def pending_jobs():
+    # Jobs queued or running in this process, without starting a queue (and
+    # its heartbeat) just to ask
+    return 0 if _queue is None else _queue.pending()
+
+
+def shutdown(timeout):
+    """Finish this process's jobs, then its renders and background uploads,
+    within `timeout` seconds in all. Returns whether everything finished.
+
+    Jobs only live in memory, so this is the last chance to finish them
+    before the process exits.
+    """
+    deadline = time.monotonic() + timeout
+    finished = True
+    for pool in (_queue, render._renderer):
+        if pool is not None:
+            finished &= pool.shutdown(max(0, deadline - time.monotonic()))
+    return util.shutdown_uploads(max(0, deadline - time.monotonic())) and finished
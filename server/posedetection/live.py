@@ -0,0 +1,163 @@
+import asyncio
+import json
+from urllib.parse import parse_qs
+import cv2
+import numpy as np
+from django.conf import settings
+from . import camera, pipeline, util
+from .batching import get_batcher
+from .streaming import StreamingChecker
+
+# Live analysis over a WebSocket at /ws/check-form?movement=squat&fps=15.
+#
+# The client sends each frame as an encoded image (JPEG or PNG) in a binary
+# message and gets {"type": "frame", "frame": i, "warnings": [...]} back for
+# every one, which doubles as flow control. Sending {"type": "end"} as text
+# returns {"type": "summary", ...} with the warnings check-form would give for
+# the whole set with POSE_SMOOTHING off, then closes the socket. Live frames
+# aren't smoothed, since that would hold each warning back for later frames.
+#
+# As with check-form, the camera view is told from the first
+# POSE_VIEW_SECONDS, after which rules that don't apply to it are skipped. A
+# view none of the movement's rules apply to closes the socket.
+
+PATH = "/ws/check-form"
+
+# Close codes for requests the server won't serve
+INVALID_REQUEST = 4400
+FRAME_TOO_LARGE = 4413
+UNSUPPORTED_VIEW = 4422
+
+
+class LiveSession:
+    def __init__(self, movement, fps):
+        self.movement = movement
+        self.fps = fps
+        self.checker = StreamingChecker(movement, fps)
+        # Keypoints of the first frames, kept until they've told the view
+        self.start = [] if settings.POSE_VIEW_DETECTION else None
+
+    def push(self, keypoints):
+        # Raises UnsupportedView once the view turns out not to be checkable
+        if self.start is not None:
+            self.start.append(keypoints)
+            if len(self.start) >= camera.view_frames(self.fps):
+                self.detect_view()
+        return [
+            {"frame": frame, "message": message}
+            for frame, message in self.checker.push(keypoints)
+        ]
+
+    def detect_view(self):
+        start, self.start = self.start, None
+        self.checker.view = pipeline.check_view(
+            self.movement, np.asarray(start), self.fps
+        )
+
+    def summary(self):
+        # Matches rules.check without the session keeping its keypoints. Sets
+        # shorter than POSE_VIEW_SECONDS are told their view from every frame
+        if self.start:
+            self.detect_view()
+        warning_frames, warning_messages = self.checker.finalize()
+        return {
+            "type": "summary",
+            "frames": self.checker.frames,
+            "view": self.checker.view,
+            "warning_frames": warning_frames,
+            "warning_messages": warning_messages,
+        }
+
+
+def session_from_query(query_string):
+    params = parse_qs(query_string.decode())
+    movement = params.get("movement", [""])[0]
+    if movement not in pipeline.MOVEMENTS:
+        return None
+    try:
+        fps = float(params.get("fps", [util.DEFAULT_FPS])[0])
+    except ValueError:
+        return None
+    if not fps > 0:
+        return None
+    return LiveSession(movement, fps)
+
+
+async def send_json(send, data):
+    await send({"type": "websocket.send", "text": json.dumps(data)})
+
+
+async def close_unsupported(send, error):
+    await send_json(
+        send,
+        {
+            "type": "error",
+            "message": str(error),
+            "view": error.view,
+            "supported_views": error.supported,
+        },
+    )
+    await send({"type": "websocket.close", "code": UNSUPPORTED_VIEW})
+
+
+async def websocket_application(scope, receive, send):
+    event = await receive()
+    if event["type"] != "websocket.connect":
+        return
+
+    session = session_from_query(scope.get("query_string", b""))
+    if session is None:
+        await send({"type": "websocket.close", "code": INVALID_REQUEST})
+        return
+    await send({"type": "websocket.accept"})
+
+    # Frames share model calls with uploads and other live sessions
+    batcher = get_batcher(settings.POSE_MAX_IMGSZ)
+    while True:
+        event = await receive()
+        if event["type"] == "websocket.disconnect":
+            return
+
+        if event.get("bytes") is not None:
+            data = event["bytes"]
+            if len(data) > settings.POSE_LIVE_MAX_FRAME_BYTES:
+                await send({"type": "websocket.close", "code": FRAME_TOO_LARGE})
+                return
+            # Decoding a JPEG takes milliseconds, which would stall every other
+            # socket on this worker if done on the event loop
+            frame = await asyncio.to_thread(
+                cv2.imdecode, np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR
+            )
+            if frame is None:
+                await send_json(send, {"type": "error", "message": "Invalid frame"})
+                continue
+            keypoints = await asyncio.wrap_future(batcher.submit(frame))
+            try:
+                warnings = session.push(keypoints)
+            except camera.UnsupportedView as e:
+                await close_unsupported(send, e)
+                return
+            await send_json(
+                send,
+                {
+                    "type": "frame",
+                    "frame": session.checker.frames - 1,
+                    "warnings": warnings,
+                },
+            )
+            continue
+
+        try:
+            message = json.loads(event.get("text") or "")
+        except ValueError:
+            message = None
+        if isinstance(message, dict) and message.get("type") == "end":
+            try:
+                summary = session.summary()
+            except camera.UnsupportedView as e:
+                await close_unsupported(send, e)
+                return
+            await send_json(send, summary)
+            await send({"type": "websocket.close", "code": 1000})
+            return
+        await send_json(send, {"type": "error", "message": "Unknown message"})
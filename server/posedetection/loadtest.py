@@ -0,0 +1,117 @@
+import os
+import secrets
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import requests
+from django.conf import settings
+
+# Load tests against a running server: `python manage.py loadtest` posts the
+# same video to /check-form from many clients at once and reports throughput
+# and latency percentiles, or starts gunicorn itself for each worker/thread
+# combination to compare them.
+
+
+def post_video(session, url, video, movement, salt):
+    # Trailing bytes after the MP4's last box are ignored by decoders but give
+    # every upload its own digest, so none is answered from the result cache
+    start = time.perf_counter()
+    response = session.post(
+        url,
+        files={"video-upload": ("load.mp4", video + salt, "video/mp4")},
+        data={"movement": movement},
+        timeout=600,
+    )
+    return time.perf_counter() - start, response.status_code
+
+
+def run_load(url, video_path, movement="squat", concurrency=4, requests_count=16):
+    with open(video_path, "rb") as f:
+        video = f.read()
+    run_id = os.urandom(8)
+
+    def send(i):
+        with requests.Session() as session:
+            return post_video(
+                session, url, video, movement, run_id + i.to_bytes(4, "big")
+            )
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(send, range(requests_count)))
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array([latency for latency, _ in results])
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        "concurrency": concurrency,
+        "requests": requests_count,
+        "errors": sum(code != 200 for _, code in results),
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(requests_count / elapsed, 3),
+        "latency": {
+            "p50": round(float(p50), 3),
+            "p95": round(float(p95), 3),
+            "p99": round(float(p99), 3),
+            "max": round(float(latencies.max()), 3),
+        },
+    }
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, process, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with code {process.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), 0.5).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise TimeoutError(f"gunicorn didn't start listening on port {port}")
+
+
+def serve(workers, threads, env=None, log=None):
+    """Start gunicorn with gunicorn.conf.py and wait until it's listening.
+
+    It runs the production settings, with a throwaway SECRET_KEY, even though
+    manage.py has already set DJANGO_SETTINGS_MODULE. Workers are gthread
+    ones, whose request threads `threads` sets, unless `env` picks another
+    GUNICORN_WORKER_CLASS. Its output goes to the console, or to `log` (a
+    file) if given. Returns the process and the base URL. Worker warm-up
+    happens after the port opens, so callers should send a request before
+    measuring.
+    """
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn"],
+        cwd=settings.BASE_DIR,
+        env={
+            **os.environ,
+            "DJANGO_SETTINGS_MODULE": "server.production",
+            "SECRET_KEY": secrets.token_urlsafe(50),
+            "PORT": str(port),
+            "WEB_CONCURRENCY": str(workers),
+            "GUNICORN_WORKER_CLASS": "gthread",
+            "GUNICORN_THREADS": str(threads),
+            **(env or {}),
+        },
+        stdout=log,
+        stderr=log,
+    )
+    try:
+        wait_for_port(port, process)
+    except Exception:
+        process.terminate()
+        process.wait()
+        raise
+    return process, f"http://127.0.0.1:{port}"
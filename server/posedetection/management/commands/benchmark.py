@@ -0,0 +1,48 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from posedetection.benchmarks import BENCHMARKS, compare_reports, environment
+
+
+class Command(BaseCommand):
+    help = "Run the posedetection benchmarks and print the results as JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "names",
+            nargs="*",
+            help=f"Benchmarks to run (default: all of {', '.join(BENCHMARKS)})",
+        )
+        parser.add_argument("--output", help="Write the JSON report to this file")
+        parser.add_argument(
+            "--compare",
+            help="Fail if any timing is slower than in this earlier JSON report",
+        )
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.25,
+            help="Allowed slowdown against --compare as a fraction (default: 0.25)",
+        )
+
+    def handle(self, *args, **options):
+        names = options["names"] or list(BENCHMARKS)
+        unknown = [name for name in names if name not in BENCHMARKS]
+        if unknown:
+            raise CommandError(f"Unknown benchmark(s): {', '.join(unknown)}")
+
+        report = {"environment": environment()}
+        report.update((name, BENCHMARKS[name]()) for name in names)
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output)
+        self.stdout.write(output)
+
+        if options["compare"]:
+            with open(options["compare"]) as f:
+                baseline = json.load(f)
+            regressions = compare_reports(baseline, report, options["tolerance"])
+            for path, before, after in regressions:
+                self.stderr.write(f"{path}: {before:.6f}s -> {after:.6f}s")
+            if regressions:
+                raise CommandError(f"{len(regressions)} timing(s) regressed")
@@ -0,0 +1,72 @@
+import json
+import os
+import tempfile
+from django.core.management.base import BaseCommand, CommandError
+from posedetection.loadtest import run_load, serve
+from posedetection.pipeline import MOVEMENTS
+from posedetection.synthetic import write_video
+
+
+class Command(BaseCommand):
+    help = (
+        "Post videos to /check-form concurrently and print throughput and "
+        "latency as JSON"
+    )
+
+    def add_arguments(self, parser):
+        target = parser.add_mutually_exclusive_group(required=True)
+        target.add_argument("--url", help="Base URL of a server that's already running")
+        target.add_argument(
+            "--matrix",
+            help=(
+                "Start gunicorn with gthread workers for each comma-separated "
+                "WORKERSxTHREADS combination, e.g. 1x4,2x2,4x1"
+            ),
+        )
+        parser.add_argument(
+            "--video", help="Video to upload (default: a synthetic 3 second clip)"
+        )
+        parser.add_argument("--movement", default="squat", choices=MOVEMENTS)
+        parser.add_argument("--concurrency", type=int, default=4)
+        parser.add_argument("--requests", type=int, default=16)
+
+    def handle(self, *args, **options):
+        combinations = []
+        if options["matrix"]:
+            try:
+                combinations = [
+                    tuple(int(n) for n in combination.split("x"))
+                    for combination in options["matrix"].split(",")
+                ]
+            except ValueError:
+                raise CommandError("--matrix takes WORKERSxTHREADS,... e.g. 2x4")
+
+        with tempfile.TemporaryDirectory() as tmp:
+            video = options["video"]
+            if not video:
+                video = write_video(os.path.join(tmp, "load.mp4"), 90)
+
+            def load(url):
+                # One request first so lazy start-up isn't counted
+                run_load(f"{url}/check-form", video, options["movement"], 1, 1)
+                return run_load(
+                    f"{url}/check-form",
+                    video,
+                    options["movement"],
+                    options["concurrency"],
+                    options["requests"],
+                )
+
+            if options["url"]:
+                report = load(options["url"].rstrip("/"))
+            else:
+                report = []
+                for workers, threads in combinations:
+                    process, url = serve(workers, threads)
+                    try:
+                        result = load(url)
+                    finally:
+                        process.terminate()
+                        process.wait()
+                    report.append({"workers": workers, "threads": threads, **result})
+        self.stdout.write(json.dumps(report, indent=2))
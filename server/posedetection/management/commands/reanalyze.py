@@ -0,0 +1,99 @@
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from posedetection.camera import UnsupportedView
+from posedetection.pipeline import MOVEMENTS, check_keypoints, check_view
+from posedetection.tracks import find_tracks, read_track
+from posedetection.views import unsupported_view_data
+
+
+def check_track(base_path, movements):
+    # Runs in a worker process; the track is memory-mapped rather than copied.
+    # The view is checked as check-form does, and a movement that can't be
+    # checked from it is reported the way the batch endpoint does
+    keypoints, meta = read_track(base_path, mmap_mode="r")
+    fps, stride = meta["fps"], meta.get("stride", 1)
+    results = []
+    for movement in movements:
+        result = {"track": os.path.basename(base_path), "movement": movement}
+        try:
+            view = None
+            if settings.POSE_VIEW_DETECTION:
+                view = check_view(movement, keypoints, fps / stride)
+        except UnsupportedView as e:
+            result.update(unsupported_view_data(e))
+        else:
+            warning_frames, warning_messages = check_keypoints(
+                keypoints, movement, fps, stride, view=view
+            )
+            result.update(
+                view=view,
+                warning_frames=warning_frames,
+                warning_messages=warning_messages,
+            )
+        results.append(result)
+    return results
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-run the lift checkers over stored keypoint tracks in parallel and "
+        "print one JSON line per track and movement"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "directories",
+            nargs="*",
+            help="Directories of tracks (default: POSE_TRACK_DIR)",
+        )
+        parser.add_argument(
+            "--movement",
+            action="append",
+            choices=MOVEMENTS,
+            help="Movement to check, may be repeated (default: all)",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count(),
+            help="Worker processes (default: one per core)",
+        )
+        parser.add_argument("--output", help="Write the JSON lines to this file")
+
+    def handle(self, *args, **options):
+        directories = options["directories"] or [settings.POSE_TRACK_DIR]
+        movements = options["movement"] or MOVEMENTS
+        tracks = []
+        for directory in directories:
+            if not os.path.isdir(directory):
+                raise CommandError(f"{directory} is not a directory")
+            tracks.extend(find_tracks(directory))
+
+        workers = max(1, options["workers"])
+        output = open(options["output"], "w") if options["output"] else self.stdout
+        start = time.perf_counter()
+        try:
+            # Workers set Django up themselves in case they're spawned, not forked
+            with ProcessPoolExecutor(
+                max_workers=workers, initializer=django.setup
+            ) as executor:
+                chunksize = max(1, len(tracks) // (workers * 4))
+                for results in executor.map(
+                    check_track,
+                    tracks,
+                    [movements] * len(tracks),
+                    chunksize=chunksize,
+                ):
+                    for result in results:
+                        output.write(json.dumps(result) + "\n")
+        finally:
+            if options["output"]:
+                output.close()
+
+        elapsed = time.perf_counter() - start
+        self.stderr.write(f"Checked {len(tracks)} track(s) in {elapsed:.2f}s")
@@ -0,0 +1,117 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# Process-wide metrics, rendered in the Prometheus text format by /metrics.
+# Updates only take a lock around a dict lookup, so spans are cheap enough to
+# leave on in the hot path.
+
+HELP = {
+    "posedetection_stage_seconds": "Time spent in each check-form stage",
+    "posedetection_inference_fps": "Frames per second achieved by pose inference",
+    "posedetection_uploaded_bytes_total": "Bytes of annotated video uploaded to R2",
+    "posedetection_job_queue_wait_seconds": "Time jobs spent queued before running",
+    "posedetection_model_wait_seconds": "Time spent waiting for a pooled model",
+    "posedetection_batch_size": "Frames per micro-batched model call",
+}
+
+_lock = threading.Lock()
+# (name, labels) -> [count, sum, max]
+_summaries = {}
+# (name, labels) -> value
+_counters = {}
+
+# Stages timed during the current request, for the Server-Timing header
+_timings = contextvars.ContextVar("posedetection_timings", default=None)
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def observe(name, value, **labels):
+    key = _key(name, labels)
+    with _lock:
+        summary = _summaries.get(key)
+        if summary is None:
+            _summaries[key] = [1, value, value]
+        else:
+            summary[0] += 1
+            summary[1] += value
+            summary[2] = max(summary[2], value)
+
+
+def inc(name, value=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+@contextmanager
+def span(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        observe("posedetection_stage_seconds", elapsed, stage=stage)
+        timings = _timings.get()
+        if timings is not None:
+            timings.append((stage, elapsed))
+
+
+def start_request():
+    return _timings.set([])
+
+
+def finish_request(token):
+    timings = _timings.get()
+    _timings.reset(token)
+    return timings or []
+
+
+def reset():
+    with _lock:
+        _summaries.clear()
+        _counters.clear()
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in labels)
+    return "{" + pairs + "}"
+
+
+def _header(lines, name, kind, seen):
+    if name in seen:
+        return
+    seen.add(name)
+    if name in HELP:
+        lines.append(f"# HELP {name} {HELP[name]}")
+    lines.append(f"# TYPE {name} {kind}")
+
+
+def render(extra=()):
+    # `extra` holds (name, kind, labels dict, value) samples from other sources
+    with _lock:
+        summaries = sorted(_summaries.items())
+        counters = sorted(_counters.items())
+
+    lines = []
+    seen = set()
+    for (name, labels), (count, total, maximum) in summaries:
+        _header(lines, name, "summary", seen)
+        lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+    for (name, labels), (count, total, maximum) in summaries:
+        _header(lines, f"{name}_max", "gauge", seen)
+        lines.append(f"{name}_max{_format_labels(labels)} {maximum}")
+    for (name, labels), value in counters:
+        _header(lines, name, "counter", seen)
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+    for name, kind, labels, value in extra:
+        _header(lines, name, kind, seen)
+        lines.append(f"{name}{_format_labels(sorted(labels.items()))} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,116 @@
+import cProfile
+import json
+import os
+import random
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from . import metrics
+
+
+class ServerTimingMiddleware:
+    """Collects the stage timings recorded during a request.
+
+    With POSE_SERVER_TIMING on, they are returned in a `Server-Timing` header.
+    A POSE_PROFILE_SAMPLE_RATE fraction of requests also run under cProfile,
+    with the stats dumped to POSE_PROFILE_DIR for later inspection.
+
+    Under ASGI it stays async so async views don't get pushed onto a thread.
+    cProfile only follows one thread, so those requests aren't profiled.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        token = metrics.start_request()
+        try:
+            if random.random() < settings.POSE_PROFILE_SAMPLE_RATE:
+                response = self.profile(request)
+            else:
+                response = self.get_response(request)
+        finally:
+            timings = metrics.finish_request(token)
+        return self.add_header(response, timings)
+
+    async def __acall__(self, request):
+        token = metrics.start_request()
+        try:
+            response = await self.get_response(request)
+        finally:
+            timings = metrics.finish_request(token)
+        return self.add_header(response, timings)
+
+    def add_header(self, response, timings):
+        if settings.POSE_SERVER_TIMING and timings:
+            response["Server-Timing"] = ", ".join(
+                f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings
+            )
+        return response
+
+    def profile(self, request):
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(self.get_response, request)
+        finally:
+            os.makedirs(settings.POSE_PROFILE_DIR, exist_ok=True)
+            name = request.path.strip("/").replace("/", "_") or "root"
+            profiler.dump_stats(
+                os.path.join(
+                    settings.POSE_PROFILE_DIR,
+                    f"{time.time_ns()}-{os.getpid()}-{name}.prof",
+                )
+            )
+
+
+class RequestBodyLimit:
+    """ASGI wrapper answering 413 once a request body passes
+    POSE_MAX_UPLOAD_BYTES.
+
+    Django's ASGI handler spools the whole body to a temporary file before
+    any view or upload handler sees it, so a chunked upload would otherwise
+    be written out in full first.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        received = 0
+        refused = False
+
+        async def limited_receive():
+            nonlocal received, refused
+            if refused:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            received += len(message.get("body", b""))
+            if received <= settings.POSE_MAX_UPLOAD_BYTES:
+                return message
+            refused = True
+            body = json.dumps({"message": "Video is too large"}).encode()
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": 413,
+                    "headers": [
+                        (b"content-type", b"application/json"),
+                        (b"content-length", str(len(body)).encode()),
+                    ],
+                }
+            )
+            await send({"type": "http.response.body", "body": body})
+            # Django gives up on the request without responding
+            return {"type": "http.disconnect"}
+
+        return await self.app(scope, limited_receive, send)
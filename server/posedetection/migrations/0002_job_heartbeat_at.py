@@ -0,0 +1,19 @@
+# Generated by Django 5.1.1 on 2026-10-18 14:18
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("posedetection", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="job",
+            name="heartbeat_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
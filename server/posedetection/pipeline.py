@@ -0,0 +1,176 @@
+from django.conf import settings
+import numpy as np
+from django.urls import reverse
+from . import camera, features, filters, metrics, render, reps, rules, transcode, util
+from .cache import get_cache, hash_file
+
+# Every lift rules.py can check
+MOVEMENTS = list(rules.MOVEMENTS)
+
+
+def run_checker(movement, coords, angles, indiv_coords, fps, view=None):
+    return rules.check(movement, coords, angles, indiv_coords, fps, view)
+
+
+def check_view(movement, keypoints, fps):
+    # The clip's camera view, raising UnsupportedView if none of the
+    # movement's rules can be checked from it
+    view = camera.detect_view(keypoints, fps)
+    supported = rules.MOVEMENTS[movement].views
+    if view is not None and view not in supported:
+        raise camera.UnsupportedView(movement, view, supported)
+    return view
+
+
+def estimate_pose(file_path, digest=None, batched=None, movement=None):
+    fps = util.get_video_fps(file_path)
+    stride = util.get_analysis_stride(fps, settings.POSE_TARGET_FPS)
+    imgsz = settings.POSE_MAX_IMGSZ
+
+    # Re-uploads of the same clip skip inference and the R2 upload entirely
+    cache = get_cache()
+    if digest is None:
+        with metrics.span("hash"):
+            digest = hash_file(file_path)
+    key = cache.key(
+        digest,
+        settings.POSE_MODEL,
+        settings.POSE_BACKEND,
+        settings.POSE_INT8,
+        settings.POSE_CONF,
+        stride,
+        imgsz,
+        # The lifter's keypoints are cached after tracking, so whatever picks
+        # their track is part of the key too
+        settings.POSE_TRACKING,
+        settings.POSE_MAX_PEOPLE,
+        settings.POSE_TRACK_IOU,
+        settings.POSE_TRACK_MAX_AGE_SECONDS,
+        settings.POSE_MIN_KEYPOINT_CONF,
+    )
+    entry = cache.get(key)
+    if entry is not None:
+        return key, *entry
+
+    if batched is None:
+        batched = settings.POSE_MICROBATCH
+    options = {}
+    # Check the view as soon as the first seconds have been analysed, so a
+    # clip filmed from where `movement` can't be checked is turned away
+    # without analysing the rest
+    if movement is not None and settings.POSE_VIEW_DETECTION:
+        options = {
+            "check_start": lambda start: check_view(movement, start, fps / stride),
+            "start_frames": camera.view_frames(fps / stride),
+        }
+    keypoints = util.get_pose_estimation(
+        file_path, stride, imgsz, batched, name=digest, **options
+    )
+    # The annotated video's URL is filled in once it has been rendered
+    meta = {"url": None, "fps": fps, "stride": stride, "source": file_path}
+    cache.put(key, keypoints, meta)
+    return key, keypoints, meta
+
+
+def keypoints_json(keypoints):
+    # (frames, 17, 3) keypoints as nested lists, with missing values as null
+    rounded = np.round(keypoints.astype(np.float64), 2)
+    return np.where(np.isnan(rounded), None, rounded).tolist()
+
+
+def keypoint_features(keypoints, fps, smooth=None):
+    # Midpoints and joint angles of every analysed frame, `fps` being the rate
+    # of the keypoints themselves
+    if smooth is None:
+        smooth = settings.POSE_SMOOTHING
+    if smooth:
+        with metrics.span("smooth"):
+            keypoints = filters.smooth_keypoints(keypoints, fps)
+
+    # Compute every midpoint and joint angle for the whole clip at once
+    with metrics.span("features"):
+        xy = features.stack_keypoints(keypoints)
+        return features.extract_features(xy)
+
+
+def check_features(movement, coords, angles, indiv_coords, fps, stride=1, view=None):
+    # Keypoints only cover every `stride`-th frame (see util.source_frame), so
+    # the checkers see a lower frame rate and their warnings are mapped back
+    # to source frames
+    with metrics.span("checks"):
+        warning_frames, warning_messages = run_checker(
+            movement, coords, angles, indiv_coords, fps / stride, view
+        )
+    warning_frames = [util.source_frame(frame, stride) for frame in warning_frames]
+    return warning_frames, warning_messages
+
+
+def check_keypoints(keypoints, movement, fps, stride=1, smooth=None, view=None):
+    coords, angles, indiv_coords = keypoint_features(keypoints, fps / stride, smooth)
+    return check_features(movement, coords, angles, indiv_coords, fps, stride, view)
+
+
+def analyze_video(
+    file_path,
+    movement,
+    digest=None,
+    include_keypoints=False,
+    batched=None,
+    per_rep=False,
+):
+    key, keypoints, meta = estimate_pose(file_path, digest, batched, movement)
+
+    fps, stride = meta["fps"], meta.get("stride", 1)
+    # Cached keypoints skip the probe, so the view is checked again here
+    view = None
+    if settings.POSE_VIEW_DETECTION:
+        view = check_view(movement, keypoints, fps / stride)
+    coords, angles, indiv_coords = keypoint_features(keypoints, fps / stride)
+    warning_frames, warning_messages = check_features(
+        movement, coords, angles, indiv_coords, fps, stride, view
+    )
+    with metrics.span("reps"):
+        rep_summaries = reps.summarize_reps(
+            movement, angles, warning_frames, warning_messages, fps, stride
+        )
+
+    # Uploading a clip again gives a failed render or clips another try
+    failures = [meta.pop(name, None) for name in ("render_failed", "failed_clips")]
+    if any(failures):
+        get_cache().update_meta(key, meta)
+
+    # Clips around the warnings are cut along with the web rendition, or on
+    # the render pool straight away if the video was already rendered
+    if transcode.enabled() and render.add_clip_frames(key, meta, warning_frames):
+        if meta["url"] is not None and get_cache().enabled:
+            render.get_renderer().request(key)
+
+    # Warnings don't wait for the annotated video: the render pool renders it
+    # when first requested from video_url, or straight away if eager rendering
+    # is configured. With no cache entry to render from later, the response
+    # waits for the pool instead
+    url = meta["url"]
+    if url is None and not get_cache().enabled:
+        future = render.get_renderer().request(
+            key, (keypoints, meta), settings.R2_UPLOAD_IN_BACKGROUND
+        )
+        url = future.result()
+    elif url is None and settings.POSE_RENDER_EAGER:
+        render.get_renderer().request(key)
+
+    data = {
+        "url": url,
+        "video_url": reverse("check-form-video", args=[key]),
+        "fps": meta["fps"],
+        "stride": meta.get("stride", 1),
+        "view": view,
+        "warning_frames": warning_frames,
+        "warning_messages": warning_messages,
+        "reps": rep_summaries,
+    }
+    # Clients paging through reps can skip the per-frame warnings
+    if per_rep:
+        del data["warning_frames"], data["warning_messages"]
+    if include_keypoints:
+        data["keypoints"] = keypoints_json(keypoints)
+    return data
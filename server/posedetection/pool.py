@@ -0,0 +1,165 @@
+import queue
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+from django.conf import settings
+from . import metrics
+from .backends import load_model
+
+
+def load_yolo(model_name):
+    # Imported lazily so the pool can be used without loading torch up front
+    from ultralytics import YOLO
+
+    return YOLO(model_name)
+
+
+class ModelPool:
+    """A fixed-size pool of pose models shared by every request in the process."""
+
+    def __init__(self, model_name, size=1, loader=load_yolo):
+        self.model_name = model_name
+        self.size = max(1, size)
+        self.loader = loader
+
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            "loads": 0,
+            "load_seconds_total": 0.0,
+            "load_seconds_last": 0.0,
+            "inferences": 0,
+            "inference_seconds_total": 0.0,
+            "inference_seconds_max": 0.0,
+            "wait_seconds_total": 0.0,
+        }
+
+    def _load(self):
+        start = time.perf_counter()
+        model = self.loader(self.model_name)
+        elapsed = time.perf_counter() - start
+
+        with self._stats_lock:
+            self.stats["loads"] += 1
+            self.stats["load_seconds_total"] += elapsed
+            self.stats["load_seconds_last"] = elapsed
+        return model
+
+    def _get(self):
+        # Reuse an idle model, lazily create one while under capacity, or wait
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            create = self._created < self.size
+            if create:
+                self._created += 1
+        if create:
+            try:
+                return self._load()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        return self._idle.get()
+
+    @contextmanager
+    def acquire(self):
+        start = time.perf_counter()
+        model = self._get()
+        waited = time.perf_counter() - start
+        metrics.observe("posedetection_model_wait_seconds", waited)
+        with self._stats_lock:
+            self.stats["wait_seconds_total"] += waited
+        try:
+            yield model
+        finally:
+            self._idle.put(model)
+
+    def record_inference(self, seconds):
+        with self._stats_lock:
+            self.stats["inferences"] += 1
+            self.stats["inference_seconds_total"] += seconds
+            self.stats["inference_seconds_max"] = max(
+                self.stats["inference_seconds_max"], seconds
+            )
+
+    @contextmanager
+    def timed(self):
+        # Acquire a model and record how long the caller spends using it
+        with self.acquire() as model:
+            start = time.perf_counter()
+            try:
+                yield model
+            finally:
+                self.record_inference(time.perf_counter() - start)
+
+    def warm_up(self, run_inference=True):
+        # Load every instance up front, optionally pushing a blank frame through
+        # each one so the first real request doesn't pay for lazy initialisation
+        models = []
+        try:
+            for _ in range(self.size):
+                models.append(self._get())
+            if run_inference:
+                frame = np.zeros((64, 64, 3), dtype=np.uint8)
+                for model in models:
+                    model(frame, verbose=False)
+        finally:
+            for model in models:
+                self._idle.put(model)
+
+    def metrics(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        with self._lock:
+            stats["instances"] = self._created
+        stats["size"] = self.size
+        stats["idle"] = self._idle.qsize()
+        return stats
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ModelPool(
+                    settings.POSE_MODEL,
+                    size=settings.POSE_MODEL_POOL_SIZE,
+                    loader=load_model,
+                )
+    return _pool
+
+
+def pool_samples(pool):
+    # The pool's counters as extra samples for metrics.render
+    stats = pool.metrics()
+    return [
+        ("posedetection_model_loads_total", "counter", {}, stats["loads"]),
+        (
+            "posedetection_model_load_seconds_total",
+            "counter",
+            {},
+            stats["load_seconds_total"],
+        ),
+        ("posedetection_model_inferences_total", "counter", {}, stats["inferences"]),
+        (
+            "posedetection_model_inference_seconds_total",
+            "counter",
+            {},
+            stats["inference_seconds_total"],
+        ),
+        ("posedetection_model_instances", "gauge", {}, stats["instances"]),
+        ("posedetection_model_idle", "gauge", {}, stats["idle"]),
+    ]
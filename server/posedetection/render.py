@@ -0,0 +1,261 @@
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+import cv2
+import numpy as np
+from django.conf import settings
+from . import metrics, transcode, util
+from .cache import get_cache
+
+logger = logging.getLogger(__name__)
+
+# COCO keypoint pairs joined when drawing the skeleton
+SKELETON = [
+    (15, 13),
+    (13, 11),
+    (16, 14),
+    (14, 12),
+    (11, 12),
+    (5, 11),
+    (6, 12),
+    (5, 6),
+    (5, 7),
+    (6, 8),
+    (7, 9),
+    (8, 10),
+    (1, 2),
+    (0, 1),
+    (0, 2),
+    (1, 3),
+    (2, 4),
+    (3, 5),
+    (4, 6),
+]
+
+# Keypoints below this confidence aren't drawn
+MIN_CONFIDENCE = 0.5
+
+
+def draw_pose(frame, keypoints):
+    visible = ~np.isnan(keypoints[:, 0]) & (keypoints[:, 2] >= MIN_CONFIDENCE)
+    points = np.nan_to_num(keypoints[:, :2]).round().astype(int)
+    for a, b in SKELETON:
+        if visible[a] and visible[b]:
+            cv2.line(frame, tuple(points[a]), tuple(points[b]), (255, 144, 30), 2)
+    for i in np.flatnonzero(visible):
+        cv2.circle(frame, tuple(points[i]), 4, (0, 255, 255), -1)
+    return frame
+
+
+def render_video(source_path, keypoints, output_path, stride=1):
+    # Draw stored keypoints over the original video. With a stride, frames that
+    # weren't analysed reuse the pose of the last analysed frame, and the few
+    # before the first one that of the first
+    capture = cv2.VideoCapture(source_path)
+    fps = capture.get(cv2.CAP_PROP_FPS) or util.DEFAULT_FPS
+    size = (
+        int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+    )
+    writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+    i = 0
+    try:
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            index = min(max(util.analysed_index(i, stride), 0), len(keypoints) - 1)
+            if index >= 0:
+                draw_pose(frame, keypoints[index])
+            writer.write(frame)
+            i += 1
+    finally:
+        capture.release()
+        writer.release()
+    return output_path
+
+
+def render_and_upload(key, entry=None, background=False):
+    # `entry` is the keypoints and metadata to render when they aren't cached
+    if entry is None:
+        entry = get_cache().get(key)
+    if entry is None:
+        return None
+    keypoints, meta = entry
+    # Already rendered, so only clips for newly analysed warnings are missing
+    if meta.get("url"):
+        cut_and_upload_clips(key, meta)
+        save_meta(key, meta)
+        return meta["url"]
+    return render_and_upload_keypoints(key, keypoints, meta, background)
+
+
+def render_and_upload_keypoints(key, keypoints, meta, background=False):
+    os.makedirs(settings.POSE_RENDER_DIR, exist_ok=True)
+    output_path = os.path.join(settings.POSE_RENDER_DIR, f"{key}.mp4")
+    with metrics.span("render"):
+        render_video(meta["source"], keypoints, output_path, meta.get("stride", 1))
+
+    if transcode.enabled():
+        with metrics.span("transcode"):
+            web_path = os.path.join(settings.POSE_RENDER_DIR, f"{key}.web.mp4")
+            transcode.transcode(output_path, web_path, meta["fps"])
+            os.replace(web_path, output_path)
+            index = transcode.keyframe_index(output_path, meta["fps"])
+            index_path = transcode.index_path(settings.POSE_RENDER_DIR, key)
+            with open(index_path, "w") as f:
+                json.dump(index, f)
+        with metrics.span("r2_upload"):
+            meta["index_url"] = util.upload_video(
+                index_path,
+                "howsmyform",
+                background=background,
+                content_type="application/json",
+            )
+
+    with metrics.span("r2_upload"):
+        meta["url"] = util.upload_video(
+            output_path, "howsmyform", background=background
+        )
+    # The video plays without its clips, so it's saved before they're cut
+    save_meta(key, meta)
+    cut_and_upload_clips(key, meta, background)
+    save_meta(key, meta)
+    return meta["url"]
+
+
+def add_clip_frames(key, meta, frames):
+    # Remember the warning frames of an analysis so clips get cut around them,
+    # returning whether any were new
+    known = set(meta.get("clip_frames", []))
+    if known.issuperset(frames):
+        return False
+    meta["clip_frames"] = sorted(known.union(frames))
+    get_cache().update_meta(key, meta)
+    return True
+
+
+def missing_clips(meta):
+    # Clips that failed aren't missing until the video is uploaded again
+    clips = meta.get("clips", {})
+    failed = set(meta.get("failed_clips", []))
+    return [
+        frame
+        for frame in meta.get("clip_frames", [])
+        if str(frame) not in clips and frame not in failed
+    ]
+
+
+def cut_and_upload_clips(key, meta, background=False):
+    # A short clip of the web rendition around every warning frame so far
+    if not meta.get("index_url") or not transcode.enabled():
+        return
+    source_path = os.path.join(settings.POSE_RENDER_DIR, f"{key}.mp4")
+    clips = meta.setdefault("clips", {})
+    for frame in missing_clips(meta):
+        try:
+            with metrics.span("transcode"):
+                path = transcode.cut_clip(
+                    source_path,
+                    transcode.clip_path(settings.POSE_RENDER_DIR, key, frame),
+                    frame,
+                    meta["fps"],
+                )
+            with metrics.span("r2_upload"):
+                clips[str(frame)] = util.upload_video(
+                    path, "howsmyform", background=background
+                )
+        except Exception:
+            logger.exception("Cutting clip at frame %s of %s failed", frame, key)
+            meta.setdefault("failed_clips", []).append(frame)
+
+
+def save_meta(key, meta):
+    # Keep clip frames another analysis recorded while this one was running
+    entry = get_cache().get(key)
+    if entry is not None:
+        frames = set(meta.get("clip_frames", []))
+        meta["clip_frames"] = sorted(frames.union(entry[1].get("clip_frames", [])))
+    get_cache().update_meta(key, meta)
+
+
+def record_render_failure(key):
+    # Mark an unrendered entry as failed so polls stop starting it again
+    entry = get_cache().get(key)
+    if entry is not None and not entry[1].get("url"):
+        meta = entry[1]
+        meta["render_failed"] = True
+        get_cache().update_meta(key, meta)
+
+
+def media_data(key, meta):
+    # Everything a client needs to play a rendered video: its URL and, for
+    # web renditions, the keyframe sidecar, warning clips and seek points
+    data = {"url": meta["url"]}
+    if meta.get("index_url"):
+        data["index_url"] = meta["index_url"]
+        data["clips"] = meta.get("clips", {})
+        index_path = transcode.index_path(settings.POSE_RENDER_DIR, key)
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                index = json.load(f)
+            data["seek"] = transcode.seek_points(index, meta.get("clip_frames", []))
+    return data
+
+
+class Renderer:
+    """Renders annotated videos on a small background pool, once per key."""
+
+    def __init__(self, workers, executor=None):
+        self.executor = executor or ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="posedetection-render"
+        )
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def request(self, key, entry=None, background=False):
+        # See render_and_upload for `entry` and upload_video for `background`
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is None:
+                future = self.executor.submit(self._render, key, entry, background)
+                self._in_flight[key] = future
+        return future
+
+    def shutdown(self, timeout=None):
+        # Wait up to `timeout` seconds for the renders in flight, returning
+        # whether they all finished. Unfinished ones are started again by the
+        # next poll, in whichever process gets it
+        with self._lock:
+            futures = list(self._in_flight.values())
+        _, not_done = wait(futures, timeout)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        if not_done:
+            logger.warning("%d renders were unfinished at shutdown", len(not_done))
+        return not not_done
+
+    def _render(self, key, entry=None, background=False):
+        try:
+            return render_and_upload(key, entry, background)
+        except Exception:
+            logger.exception("Rendering annotated video %s failed", key)
+            record_render_failure(key)
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+
+_renderer = None
+_renderer_lock = threading.Lock()
+
+
+def get_renderer():
+    global _renderer
+    if _renderer is None:
+        with _renderer_lock:
+            if _renderer is None:
+                _renderer = Renderer(settings.POSE_RENDER_WORKERS)
+    return _renderer
@@ -0,0 +1,134 @@
+import numpy as np
+from . import util
+
+# Joint angle that closes and opens again over each rep of a movement, and
+# whether the lifter rests with it open (1) or closed (-1) between reps
+REP_ANGLES = {
+    "squat": ("hip", 1),
+    "bench": ("arm", 1),
+    "deadlift": ("hip", -1),
+}
+# Clips whose angle moves less than this (between its 5th and 95th
+# percentiles) contain no reps
+MIN_REP_DEGREES = 20
+# A rep starts when the angle falls below the lower fraction of its range and
+# ends when it climbs back above the upper one, so jitter in between is ignored
+REP_THRESHOLDS = (0.3, 0.7)
+
+
+def segment_argmin(values, starts, ends):
+    # Index of the smallest value in each [start, end) segment. Segments must
+    # be non-empty, sorted and non-overlapping
+    if not len(starts):
+        return np.empty(0, dtype=int)
+    padded = np.append(values, np.inf)
+    minima = np.minimum.reduceat(padded, np.column_stack([starts, ends]).ravel())[::2]
+    edges = np.zeros(len(padded), dtype=int)
+    np.add.at(edges, starts, 1)
+    np.add.at(edges, ends, -1)
+    inside = np.cumsum(edges)[:-1] > 0
+    segment = np.cumsum(np.isin(np.arange(len(values)), starts)) - 1
+    hits = np.flatnonzero(inside & (values == minima[segment]))
+    return hits[np.searchsorted(hits, starts)]
+
+
+def find_reps(angle):
+    """Split a clip into reps using one joint angle per frame.
+
+    The angle should be largest while resting between reps. Returns the
+    (start, peak, end) frame index arrays of every rep, where the peak is the
+    frame furthest from rest and ends are exclusive. Reps cover the whole clip,
+    each running from the highest point of the rest before it; a clip without
+    a full rep is returned as a single one.
+    """
+    angle = np.asarray(angle, dtype=np.float64)
+    frames = len(angle)
+    if frames == 0:
+        return (np.empty(0, dtype=int),) * 3
+    missing = np.isnan(angle)
+    filled = np.where(missing, np.inf, angle)
+    single = (np.array([0]), segment_argmin(filled, [0], [frames]), np.array([frames]))
+    if missing.all():
+        return single
+    low, high = np.nanpercentile(angle, [5, 95])
+    if high - low < MIN_REP_DEGREES:
+        return single
+
+    # Resting above `upper`, working below `lower`, and in between (or where
+    # the angle is missing) still doing whatever the last decided frame did
+    lower, upper = low + (high - low) * np.array(REP_THRESHOLDS)
+    decided = (angle >= upper) | (angle <= lower)
+    last = np.maximum.accumulate(np.where(decided, np.arange(frames), -1))
+    resting = np.where(last >= 0, angle[last] >= upper, True)
+
+    change = np.diff(resting.astype(np.int8), prepend=1, append=1)
+    work_starts = np.flatnonzero(change == -1)
+    work_ends = np.flatnonzero(change == 1)
+    if not len(work_starts):
+        return single
+
+    peaks = segment_argmin(filled, work_starts, work_ends)
+    # Reps meet at the highest point of the rest between two working phases
+    tops = segment_argmin(
+        np.where(missing, np.inf, -angle), work_ends[:-1], work_starts[1:]
+    )
+    starts = np.concatenate([[0], tops])
+    ends = np.concatenate([tops, [frames]])
+    return starts, peaks, ends
+
+
+def summarize_reps(movement, angles, warning_frames, warning_messages, fps, stride=1):
+    """One summary per rep of the clip, with the warnings given during it.
+
+    `angles` are the analysed frames' joint angles and `warning_frames` are on
+    the source timeline, like check_keypoints returns them.
+    """
+    name, direction = REP_ANGLES[movement]
+    angle = np.asarray(angles[name], dtype=np.float64)
+    starts, peaks, ends = find_reps(angle * direction)
+    if not len(starts):
+        return []
+
+    # Range of motion of every rep at once; fmin and fmax skip missing angles
+    padded = np.append(angle, np.nan)
+    bounds = np.column_stack([starts, ends]).ravel()
+    highest = np.fmax.reduceat(padded, bounds)[::2]
+    lowest = np.fmin.reduceat(padded, bounds)[::2]
+    peak_angles = angle[peaks]
+
+    # Warnings are sorted, so each rep's are one slice of them
+    rep_of_warning = np.searchsorted(
+        util.source_frame(ends, stride), warning_frames, side="right"
+    )
+    splits = np.searchsorted(rep_of_warning, np.arange(1, len(starts)))
+    warning_slices = zip(
+        np.split(np.asarray(warning_frames, dtype=int), splits),
+        np.split(np.asarray(warning_messages, dtype=object), splits),
+    )
+
+    summaries = []
+    for i, (frames, messages) in enumerate(warning_slices):
+        warnings = {}
+        for frame, message in zip(frames.tolist(), messages.tolist()):
+            entry = warnings.setdefault(
+                message, {"message": message, "count": 0, "first_frame": frame}
+            )
+            entry["count"] += 1
+        summaries.append(
+            {
+                "rep": i + 1,
+                "start_frame": util.source_frame(int(starts[i]), stride),
+                "peak_frame": util.source_frame(int(peaks[i]), stride),
+                "end_frame": util.source_frame(int(ends[i] - 1), stride),
+                "seconds": round(float(ends[i] - starts[i]) * stride / fps, 2),
+                "peak_angle": none_if_nan(peak_angles[i]),
+                "range_of_motion": none_if_nan(highest[i] - lowest[i]),
+                "warning_count": len(frames),
+                "warnings": list(warnings.values()),
+            }
+        )
+    return summaries
+
+
+def none_if_nan(value):
+    return None if np.isnan(value) else round(float(value), 1)
@@ -0,0 +1,308 @@
+import numpy as np
+from . import util
+from .camera import VIEWS
+
+# Lift checks as data. A movement is the joint angle that picks its reference
+# frame plus an ordered list of rules, each a message and a predicate built
+# from named measurements, like
+#
+#   Rule("Back too bent", Measure("back_length") < Reference("back_length") * 0.7)
+#
+# Predicates evaluate to boolean masks over the whole clip, so checking a lift
+# costs a handful of array operations however many frames it has. A frame
+# gets the message of the first rule it breaks. Rules measured in the image
+# plane only hold from some camera views, and are skipped for the others.
+# streaming.py evaluates the same rules one frame at a time for live sets.
+
+
+class Expr:
+    """A value computed from measurements, on every frame or as a scalar.
+
+    Arithmetic, comparisons, `&`, `|`, `~` and `abs` build larger expressions
+    that apply the matching numpy operation when evaluated.
+    """
+
+    def __init__(self, func, *operands):
+        self.func = func
+        self.operands = operands
+
+    def evaluate(self, context):
+        return self.func(*(evaluate(operand, context) for operand in self.operands))
+
+    def __add__(self, other):
+        return Expr(np.add, self, other)
+
+    def __sub__(self, other):
+        return Expr(np.subtract, self, other)
+
+    def __mul__(self, other):
+        return Expr(np.multiply, self, other)
+
+    def __rmul__(self, other):
+        return Expr(np.multiply, other, self)
+
+    def __truediv__(self, other):
+        return Expr(np.divide, self, other)
+
+    def __abs__(self):
+        return Expr(np.abs, self)
+
+    def __lt__(self, other):
+        return Expr(np.less, self, other)
+
+    def __le__(self, other):
+        return Expr(np.less_equal, self, other)
+
+    def __gt__(self, other):
+        return Expr(np.greater, self, other)
+
+    def __ge__(self, other):
+        return Expr(np.greater_equal, self, other)
+
+    def __and__(self, other):
+        return Expr(np.logical_and, self, other)
+
+    def __or__(self, other):
+        return Expr(np.logical_or, self, other)
+
+    def __invert__(self):
+        return Expr(np.logical_not, self)
+
+
+def evaluate(value, context):
+    return value.evaluate(context) if isinstance(value, Expr) else value
+
+
+class Measure(Expr):
+    # A measurement's value on every frame
+    def __init__(self, name):
+        self.name = name
+
+    def evaluate(self, context):
+        return context.measure(self.name)
+
+
+class Reference(Measure):
+    # A measurement's value on the movement's reference frame
+    def evaluate(self, context):
+        return context.reference_value(self.name)
+
+
+def measurement_names(value):
+    # Every measurement an expression reads
+    if isinstance(value, Measure):
+        return {value.name}
+    if isinstance(value, Expr):
+        return set().union(*(measurement_names(operand) for operand in value.operands))
+    return set()
+
+
+# Derived measurements, each computed at most once per clip. Joint angles
+# ("hip_angle") and keypoint coordinates ("hip_x", "left_elbow_y") need no
+# entry here
+MEASUREMENTS = {}
+
+
+def measurement(name):
+    def register(func):
+        MEASUREMENTS[name] = func
+        return func
+
+    return register
+
+
+@measurement("back_length")
+def back_length(context):
+    # The per-frame checkers' np.linalg.norm, which uses the same dot kernel
+    back = context.point("shoulder") - context.point("hip")
+    return np.sqrt(np.vecdot(back, back))
+
+
+@measurement("shoulder_width")
+def shoulder_width(context):
+    return np.abs(
+        context.measure("right_shoulder_x") - context.measure("left_shoulder_x")
+    )
+
+
+class Context:
+    # One clip's features, and the measurements taken from them so far
+    def __init__(self, coords, angles, indiv_coords):
+        self.coords = coords
+        self.angles = angles
+        self.indiv_coords = indiv_coords
+        self.values = {}
+        self.reference = 0
+
+    def point(self, name):
+        return self.coords[name] if name in self.coords else self.indiv_coords[name]
+
+    def measure(self, name):
+        if name not in self.values:
+            if name in MEASUREMENTS:
+                value = MEASUREMENTS[name](self)
+            elif name.endswith("_angle"):
+                value = self.angles[name[: -len("_angle")]]
+            elif name.endswith(("_x", "_y")):
+                value = self.point(name[:-2])[:, "xy".index(name[-1])]
+            else:
+                raise KeyError(f"Unknown measurement: {name}")
+            self.values[name] = value
+        return self.values[name]
+
+    def reference_value(self, name):
+        return self.measure(name)[self.reference]
+
+
+def reference_frame(angle):
+    # The frame the original checkers compare against: a running angle that
+    # moves to any frame whose angle exceeds its supplement. The recurrence is
+    # sequential, but a loop over Python floats keeps it cheap
+    reference = 0
+    current = None
+    for i, value in enumerate(angle.tolist()):
+        if current is None:
+            current = value
+        if 180 - value < current:
+            current = value
+            reference = i
+    return reference
+
+
+class Rule:
+    def __init__(self, message, when, views=VIEWS):
+        self.message = message
+        self.when = when
+        self.views = views
+
+
+def pick(conditions, messages):
+    # Frames where any condition holds, each with the first matching message
+    codes = np.select(conditions, np.arange(1, len(messages) + 1), 0)
+    frames = np.flatnonzero(codes)
+    return frames.tolist(), [messages[code - 1] for code in codes[frames]]
+
+
+class Movement:
+    def __init__(self, reference, rules):
+        # `reference` names the angle measurement that picks the frame
+        # Reference() values are taken from
+        self.reference = reference
+        self.rules = rules
+
+    @property
+    def views(self):
+        # Camera views at least one rule can be checked from
+        return {view for rule in self.rules for view in rule.views}
+
+    @property
+    def measurements(self):
+        # Every measurement the rules read, on every frame or the reference
+        return set().union(*(measurement_names(rule.when) for rule in self.rules))
+
+    def applicable(self, view=None):
+        # Rules that don't apply to `view` are skipped; None runs them all
+        return [rule for rule in self.rules if view is None or view in rule.views]
+
+    def check(self, coords, angles, indiv_coords, fps=util.DEFAULT_FPS, view=None):
+        context = Context(coords, angles, indiv_coords)
+        frames = len(context.measure(self.reference))
+        if frames:
+            context.reference = reference_frame(context.measure(self.reference))
+        return self.evaluate(context, frames, fps, view)
+
+    def evaluate(self, context, frames, fps=util.DEFAULT_FPS, view=None):
+        # Warnings for `frames` frames of measurements, with the reference
+        # frame already picked
+        rules = self.applicable(view)
+        if not frames or not rules:
+            return [], []
+        with np.errstate(divide="ignore", invalid="ignore"):
+            masks = [
+                np.broadcast_to(rule.when.evaluate(context), frames) for rule in rules
+            ]
+        warning_frames, warning_messages = pick(masks, [rule.message for rule in rules])
+        # Remove warning frames within 0.5 seconds of one another
+        return util.suppress_nearby_warnings(warning_frames, warning_messages, fps)
+
+
+# Share of the reference back length below which the back counts as bent
+BACK_BEND_RATIO = 0.7
+# Share of the reference shoulder width the elbows may flare out by
+ELBOW_FLARE_RATIO = 0.8
+# Knee to hip angle ratios outside which the legs and back aren't working
+# together
+UNEVEN_LIFT_RATIOS = (0.7, 3)
+# Hip and shoulder offsets are judged with a margin of the back length over
+# this
+MARGIN_DIVISOR = 5
+
+# Joint angles and back length are only true to life in the image when the
+# lifter is side-on or close to it, and elbow flare against shoulder width
+# only when they face the camera or close to it. Which way the lifter faces
+# (to judge leaning back) is only clear side-on
+PROFILE_VIEWS = ("side", "oblique")
+FACING_VIEWS = ("front", "oblique")
+
+knee_hip_ratio = Measure("knee_angle") / Measure("hip_angle")
+back_bent = Measure("back_length") < Reference("back_length") * BACK_BEND_RATIO
+margin = Measure("back_length") / MARGIN_DIVISOR
+facing_left = Reference("knee_x") < Reference("ankle_x")
+flare_limit = Reference("shoulder_width") * ELBOW_FLARE_RATIO
+
+MOVEMENTS = {
+    "squat": Movement(
+        "hip_angle",
+        [
+            Rule("Knees too far forward", knee_hip_ratio > 1, PROFILE_VIEWS),
+            Rule("Back too bent", back_bent, PROFILE_VIEWS),
+        ],
+    ),
+    "bench": Movement(
+        "arm_angle",
+        [
+            Rule(
+                "Elbows too far from body, try keeping them 45 degrees from torso",
+                (Measure("elbow_y") >= Measure("shoulder_y"))
+                & (
+                    (
+                        abs(Measure("left_shoulder_x") - Measure("left_elbow_x"))
+                        > flare_limit
+                    )
+                    | (
+                        abs(Measure("right_shoulder_x") - Measure("right_elbow_x"))
+                        > flare_limit
+                    )
+                ),
+                FACING_VIEWS,
+            ),
+        ],
+    ),
+    "deadlift": Movement(
+        "hip_angle",
+        [
+            Rule("Make sure to keep your back straight", back_bent, PROFILE_VIEWS),
+            Rule(
+                "Lift with your entire body, not just your legs or back",
+                (
+                    (knee_hip_ratio > UNEVEN_LIFT_RATIOS[1])
+                    | (knee_hip_ratio < UNEVEN_LIFT_RATIOS[0])
+                )
+                & (Measure("hip_y") < Measure("knee_y") - margin),
+                PROFILE_VIEWS,
+            ),
+            Rule(
+                "Make sure not to lean back too much",
+                (~facing_left & (Measure("shoulder_x") < Measure("hip_x") - margin))
+                | (facing_left & (Measure("shoulder_x") > Measure("hip_x") + margin)),
+                ("side",),
+            ),
+        ],
+    ),
+}
+
+
+def check(movement, coords, angles, indiv_coords, fps=util.DEFAULT_FPS, view=None):
+    if movement not in MOVEMENTS:
+        raise ValueError(f"Invalid movement type: {movement}")
+    return MOVEMENTS[movement].check(coords, angles, indiv_coords, fps, view)
@@ -0,0 +1,98 @@
+from array import array
+import numpy as np
+from . import features, rules, util
+
+
+class FrameContext(rules.Context):
+    # One frame's measurements, with Reference() values taken from another
+    # frame's (NaN before there is one)
+    def __init__(self, values, reference_values):
+        super().__init__({}, {}, {})
+        self.values = values
+        self.reference_values = reference_values
+
+    def reference_value(self, name):
+        return self.reference_values.get(name, np.nan)
+
+
+class StreamingChecker:
+    """Evaluates a movement's rules (see rules.py) frame by frame as keypoints
+    arrive.
+
+    `push` judges each new frame against the straightest frame so far and
+    returns provisional warnings straight away.
+
+    `finalize` returns exactly what rules.check would for every frame pushed.
+    The reference frame is picked with a recurrence over the whole clip, so
+    it's only known at the end; rather than buffering keypoints, each push
+    keeps just the measurements the rules read.
+
+    Rules that don't apply to `view` are skipped, as in rules.check. It can
+    be set once the view is known, since every measurement is kept anyway.
+    """
+
+    def __init__(self, movement, fps=util.DEFAULT_FPS, view=None):
+        if movement not in rules.MOVEMENTS:
+            raise ValueError(f"Invalid movement type: {movement}")
+        self.movement = rules.MOVEMENTS[movement]
+        self.fps = fps
+        self.view = view
+        self.window = util.get_warning_window(fps)
+        self.frames = 0
+        self.last_warning = None
+        self.values = {name: array("d") for name in sorted(self.movement.measurements)}
+        # Running reference of the batch recurrence, seeded by the first frame
+        self.reference = 0
+        self.reference_angle = None
+        # What provisional warnings are measured against
+        self.straightest_angle = -np.inf
+        self.straightest = {}
+
+    def push(self, keypoints):
+        # Check one frame's (17, 2+) keypoints, returning any new provisional
+        # (frame, message) warnings
+        xy = features.stack_keypoints(np.asarray(keypoints)[None])
+        context = rules.Context(*features.extract_features(xy))
+        values = {name: context.measure(name)[0] for name in self.values}
+        for name, value in values.items():
+            self.values[name].append(value)
+        frame = self.frames
+        self.frames += 1
+
+        # rules.reference_frame, one frame at a time
+        angle = context.measure(self.movement.reference)[0]
+        if self.reference_angle is None:
+            self.reference_angle = angle
+        if 180 - angle < self.reference_angle:
+            self.reference_angle = angle
+            self.reference = frame
+        if angle > self.straightest_angle:
+            self.straightest_angle = angle
+            self.straightest = values
+
+        message = self.check(FrameContext(values, self.straightest))
+        # Same de-duplication as suppress_nearby_warnings, one frame at a time
+        if message is None or (
+            self.last_warning is not None and frame - self.last_warning < self.window
+        ):
+            return []
+        self.last_warning = frame
+        return [(frame, message)]
+
+    def check(self, context):
+        # The message of the first rule the frame breaks, if any
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for rule in self.movement.applicable(self.view):
+                if rule.when.evaluate(context):
+                    return rule.message
+        return None
+
+    def finalize(self):
+        # rules.check's (warning_frames, warning_messages) for every frame
+        # pushed so far
+        context = rules.Context({}, {}, {})
+        context.values = {
+            name: np.frombuffer(values) for name, values in self.values.items()
+        }
+        context.reference = self.reference
+        return self.movement.evaluate(context, self.frames, self.fps, self.view)
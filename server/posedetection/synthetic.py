@@ -0,0 +1,204 @@
+import numpy as np
+from .headers import *
+
+# Side-on standing pose in pixels, roughly a lifter filmed on a 640x640 frame
+STANDING_POSE = {
+    0: (330, 100),
+    1: (335, 95),
+    2: (325, 95),
+    3: (340, 100),
+    4: (320, 100),
+    LEFT_SHOULDER: (335, 160),
+    RIGHT_SHOULDER: (325, 160),
+    LEFT_ELBOW: (340, 230),
+    RIGHT_ELBOW: (330, 230),
+    LEFT_WRIST: (345, 290),
+    RIGHT_WRIST: (335, 290),
+    LEFT_HIP: (322, 320),
+    RIGHT_HIP: (318, 320),
+    LEFT_KNEE: (335, 430),
+    RIGHT_KNEE: (330, 430),
+    LEFT_ANKLE: (325, 540),
+    RIGHT_ANKLE: (320, 540),
+}
+
+
+def make_keypoints(frames, reps=5, noise=2.0, seed=0):
+    """Synthetic (frames, 17, 3) keypoints of someone squatting `reps` times.
+
+    The last column holds per-keypoint confidence, like Ultralytics' `data`.
+    """
+    rng = np.random.default_rng(seed)
+    base = np.array([STANDING_POSE[i] for i in range(17)], dtype=np.float64)
+
+    # Depth of the movement: 0 when standing, 1 at the bottom of each rep
+    t = np.arange(frames)
+    depth = (1 - np.cos(2 * np.pi * reps * t / max(frames, 1))) / 2
+
+    xy = np.broadcast_to(base, (frames, 17, 2)).copy()
+    upper = [0, 1, 2, 3, 4, LEFT_SHOULDER, RIGHT_SHOULDER, LEFT_ELBOW]
+    upper += [RIGHT_ELBOW, LEFT_WRIST, RIGHT_WRIST]
+    # Hips drop and move back, knees travel forward, the torso folds over
+    xy[:, [LEFT_HIP, RIGHT_HIP], 0] -= 60 * depth[:, None]
+    xy[:, [LEFT_HIP, RIGHT_HIP], 1] += 130 * depth[:, None]
+    xy[:, [LEFT_KNEE, RIGHT_KNEE], 0] += 50 * depth[:, None]
+    xy[:, [LEFT_KNEE, RIGHT_KNEE], 1] += 30 * depth[:, None]
+    xy[:, upper, 0] -= 50 * depth[:, None]
+    xy[:, upper, 1] += 185 * depth[:, None]
+
+    xy += rng.normal(0, noise, size=xy.shape)
+    conf = rng.uniform(0.8, 1.0, size=(frames, 17, 1))
+    return np.concatenate([xy, conf], axis=2).astype(np.float32)
+
+
+# Half the distance between each left and right keypoint of STANDING_POSE's
+# lifter when facing the camera
+HALF_WIDTHS = {
+    (3, 4): 10,
+    (1, 2): 5,
+    (LEFT_SHOULDER, RIGHT_SHOULDER): 65,
+    (LEFT_ELBOW, RIGHT_ELBOW): 75,
+    (LEFT_WRIST, RIGHT_WRIST): 70,
+    (LEFT_HIP, RIGHT_HIP): 50,
+    (LEFT_KNEE, RIGHT_KNEE): 45,
+    (LEFT_ANKLE, RIGHT_ANKLE): 40,
+}
+
+
+def turn(keypoints, degrees):
+    # Side-on keypoints of `make_keypoints` as filmed from `degrees` around
+    # the lifter, 90 being straight in front of them
+    turned = np.array(keypoints)
+    spread = np.sin(np.radians(degrees))
+    for (left, right), half_width in HALF_WIDTHS.items():
+        turned[..., left, 0] += half_width * spread
+        turned[..., right, 0] -= half_width * spread
+    return turned
+
+
+def make_gym_scene(frames, reps=3, seed=0):
+    """Synthetic detections of a busy gym: (frames, 3, 17, 3) keypoints.
+
+    Besides someone squatting (see `make_keypoints`) there's a spotter standing
+    behind them and a passer-by walking across in front of them. Like a real
+    detector, the people found in a frame are listed in no particular order
+    and empty slots come last. Also returns the lifter's slot in every frame.
+    """
+    rng = np.random.default_rng(seed)
+    lifter = make_keypoints(frames, reps=reps, seed=seed)
+    spotter = make_keypoints(frames, reps=0, seed=seed + 1)
+    passer = make_keypoints(frames, reps=0, seed=seed + 2)
+    # Further away people look smaller
+    centre = np.array([330, 320])
+    spotter[..., :2] = (spotter[..., :2] - centre) * 0.8 + centre + (90, -40)
+    passer[..., :2] = (passer[..., :2] - centre) * 0.6 + centre
+    passer[..., 0] += np.linspace(-400, 400, frames)[:, None]
+    # The passer-by is only in shot for the middle of the clip
+    passer[np.abs(passer[:, 0, 0] - 330) > 300] = np.nan
+
+    everyone = np.stack([lifter, spotter, passer], axis=1)
+    order = rng.permuted(np.tile(np.arange(3), (frames, 1)), axis=1)
+    missing = np.isnan(everyone[np.arange(frames)[:, None], order, 0, 0])
+    order = np.take_along_axis(order, np.argsort(missing, axis=1, kind="stable"), 1)
+    people = everyone[np.arange(frames)[:, None], order]
+    return people, (order == 0).argmax(axis=1)
+
+
+def add_glitches(keypoints, rate=0.05, jump=40.0, seed=0):
+    # Knock a fraction of keypoints off course with low confidence, like the
+    # occluded or misdetected joints of a real clip
+    rng = np.random.default_rng(seed)
+    keypoints = np.array(keypoints)
+    glitched = rng.random(keypoints.shape[:2]) < rate
+    keypoints[glitched, :2] += rng.normal(0, jump, size=(glitched.sum(), 2))
+    keypoints[glitched, 2] = rng.uniform(0.05, 0.3, size=glitched.sum())
+    return keypoints
+
+
+def write_video(path, frames, size=(320, 240), fps=30):
+    # A small generated clip (a bar sweeping across the frame) for decode tests
+    import cv2
+
+    width, height = size
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+    for i in range(frames):
+        frame = np.zeros((height, width, 3), dtype=np.uint8)
+        x = i * 4 % width
+        frame[:, x : x + 8] = 255
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+class FakeTensor:
+    # Just enough of torch.Tensor for code reading Ultralytics outputs
+    def __init__(self, array):
+        self.array = array
+
+    def __len__(self):
+        return len(self.array)
+
+    def __getitem__(self, index):
+        return FakeTensor(self.array[index])
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.array
+
+
+class FakeKeypoints:
+    def __init__(self, data):
+        self.data = FakeTensor(data)
+        self.xy = FakeTensor(data[..., :2])
+        self.conf = FakeTensor(data[..., 2])
+
+
+class FakeResult:
+    def __init__(self, orig_img, keypoints):
+        self.orig_img = orig_img
+        self.keypoints = FakeKeypoints(keypoints)
+
+
+class FakePoseModel:
+    """Stands in for an Ultralytics pose model without needing weights.
+
+    Frames are really decoded from `source`, but the keypoints come from
+    `make_keypoints` rather than a network.
+    """
+
+    def __init__(self, keypoints=None):
+        self.keypoints = keypoints
+
+    def _results(self, source, vid_stride=1):
+        import cv2
+
+        capture = cv2.VideoCapture(source)
+        frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        keypoints = self.keypoints
+        if keypoints is None:
+            keypoints = make_keypoints(max(frames, 1))
+        # Like Ultralytics' vid_stride, grab `vid_stride` frames and decode
+        # the last, so source frames vid_stride - 1, 2 * vid_stride - 1, ...
+        i = vid_stride - 1
+        while all(capture.grab() for _ in range(vid_stride)):
+            ok, frame = capture.retrieve()
+            if not ok:
+                break
+            people = keypoints[i % len(keypoints)]
+            # Keypoints for several people per frame are passed as 4D arrays
+            if people.ndim == 2:
+                people = people[None]
+            yield FakeResult(frame, people[~np.isnan(people[:, 0, 0])])
+            i += vid_stride
+        capture.release()
+
+    def __call__(self, source=None, stream=False, vid_stride=1, **kwargs):
+        if isinstance(source, np.ndarray):
+            return [FakeResult(source, make_keypoints(1)[0][None])]
+        if isinstance(source, list):
+            # A batch of decoded frames, one result each
+            return [self(frame)[0] for frame in source]
+        results = self._results(source, vid_stride)
+        return results if stream else list(results)
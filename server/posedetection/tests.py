@@ -1,3 +1,2585 @@
-from django.test import TestCase
+import asyncio
+import importlib
+import json
+import math
+import os
+import pstats
+import runpy
+import sys
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import warnings
+from collections import defaultdict
+from concurrent.futures import Future
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest import mock
+import boto3
+import cv2
+import numpy as np
+import requests
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile, TemporaryUploadedFile
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from gunicorn.util import load_class
+from moto import mock_aws
+from . import (
+    batching,
+    camera,
+    features,
+    filters,
+    jobs,
+    live,
+    metrics,
+    pipeline,
+    render,
+    reps,
+    rules,
+    tracking,
+    transcode,
+    util,
+    views,
+)
+from .backends import (
+    ExportedPoseModel,
+    export_model,
+    fetch_weights,
+    letterbox,
+    load_model,
+)
+from .batching import MicroBatcher
+from .benchmarks import (
+    PER_FRAME_CHECKERS,
+    bench_microbatch,
+    bench_pipeline,
+    bench_reps,
+    bench_rules,
+    bench_smoothing,
+    bench_streaming_checkers,
+    bench_streaming_memory,
+    bench_suppress_warnings,
+    bench_tracking,
+    compare_reports,
+    measure_peak_memory,
+    per_frame_bench,
+    per_frame_deadlift,
+    per_frame_squat,
+    suppress_nearby_warnings_quadratic,
+    warning_agreement,
+)
+from .cache import PoseCache
+from .headers import *
+from .jobs import JobQueue
+from .loadtest import run_load, serve
+from .middleware import ServerTimingMiddleware
+from .models import Job
+from .pool import ModelPool
+from .render import Renderer, render_video
+from .streaming import StreamingChecker
+from .tracks import find_tracks, read_track, write_track
+from .synthetic import (
+    FakePoseModel,
+    FakeResult,
+    add_glitches,
+    make_gym_scene,
+    make_keypoints,
+    turn,
+    write_video,
+)
 
-# Create your tests here.
+
+class FakeModel:
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+
+    def __call__(self, *args, **kwargs):
+        self.calls += 1
+        return []
+
+
+class ModelPoolTests(SimpleTestCase):
+    def setUp(self):
+        self.loaded = []
+
+    def loader(self, name):
+        model = FakeModel(name)
+        self.loaded.append(model)
+        return model
+
+    def test_model_is_loaded_once_and_reused(self):
+        pool = ModelPool("pose.pt", size=1, loader=self.loader)
+        for _ in range(3):
+            with pool.timed() as model:
+                model()
+
+        self.assertEqual(len(self.loaded), 1)
+        self.assertEqual(self.loaded[0].calls, 3)
+        metrics = pool.metrics()
+        self.assertEqual(metrics["loads"], 1)
+        self.assertEqual(metrics["inferences"], 3)
+
+    def test_pool_never_exceeds_size(self):
+        pool = ModelPool("pose.pt", size=2, loader=self.loader)
+        in_use = []
+        peak = []
+        lock = threading.Lock()
+        barrier = threading.Barrier(4)
+
+        def worker():
+            barrier.wait()
+            with pool.acquire() as model:
+                with lock:
+                    in_use.append(model)
+                    peak.append(len(in_use))
+                with lock:
+                    in_use.remove(model)
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertLessEqual(len(self.loaded), 2)
+        self.assertLessEqual(max(peak), 2)
+
+    def test_warm_up_loads_every_instance(self):
+        pool = ModelPool("pose.pt", size=3, loader=self.loader)
+        pool.warm_up()
+
+        self.assertEqual(len(self.loaded), 3)
+        self.assertTrue(all(model.calls == 1 for model in self.loaded))
+        self.assertEqual(pool.metrics()["idle"], 3)
+
+    def test_failed_load_frees_slot(self):
+        attempts = []
+
+        def loader(name):
+            attempts.append(name)
+            if len(attempts) == 1:
+                raise OSError("weights missing")
+            return FakeModel(name)
+
+        pool = ModelPool("pose.pt", size=1, loader=loader)
+        with self.assertRaises(OSError):
+            with pool.acquire():
+                pass
+        with pool.acquire() as model:
+            self.assertEqual(model.name, "pose.pt")
+
+
+def per_frame_angle(a, b, c):
+    # util.calculate_angle, except that the cosine is clipped: in float32 it
+    # can round past 1 for a straight joint, where math.acos used to raise
+    AB = [a[0] - b[0], a[1] - b[1]]
+    BC = [c[0] - b[0], c[1] - b[1]]
+    dot_product = AB[0] * BC[0] + AB[1] * BC[1]
+    magnitude_AB = math.sqrt(AB[0] ** 2 + AB[1] ** 2)
+    magnitude_BC = math.sqrt(BC[0] ** 2 + BC[1] ** 2)
+    cosine = dot_product / (magnitude_AB * magnitude_BC)
+    return math.degrees(math.acos(min(max(cosine, -1.0), 1.0)))
+
+
+def per_frame_features(xy):
+    # The original per-frame loop from views.check_form, kept as a reference.
+    # It read float32 tensors one keypoint at a time, so midpoints, vector
+    # differences and the cosine stayed in float32; float32 NumPy scalars
+    # follow the same promotion rules
+    angles = defaultdict(list)
+    coords = defaultdict(list)
+    indiv_coords = defaultdict(list)
+    for frame in np.asarray(xy, dtype=np.float32):
+        indiv_coords["left_shoulder"].append(frame[LEFT_SHOULDER])
+        indiv_coords["right_shoulder"].append(frame[RIGHT_SHOULDER])
+        indiv_coords["left_elbow"].append(frame[LEFT_ELBOW])
+        indiv_coords["right_elbow"].append(frame[RIGHT_ELBOW])
+
+        shoulder = util.get_average_xy(frame[LEFT_SHOULDER], frame[RIGHT_SHOULDER])
+        elbow = util.get_average_xy(frame[LEFT_ELBOW], frame[RIGHT_ELBOW])
+        wrist = util.get_average_xy(frame[LEFT_WRIST], frame[RIGHT_WRIST])
+        hip = util.get_average_xy(frame[LEFT_HIP], frame[RIGHT_HIP])
+        knee = util.get_average_xy(frame[LEFT_KNEE], frame[RIGHT_KNEE])
+        ankle = util.get_average_xy(frame[RIGHT_ANKLE], frame[RIGHT_ANKLE])
+        for name, value in [
+            ("shoulder", shoulder),
+            ("elbow", elbow),
+            ("wrist", wrist),
+            ("hip", hip),
+            ("knee", knee),
+            ("ankle", ankle),
+        ]:
+            coords[name].append(value)
+
+        angles["hip"].append(per_frame_angle(shoulder, hip, knee))
+        angles["shoulder"].append(per_frame_angle(hip, shoulder, elbow))
+        angles["knee"].append(per_frame_angle(hip, knee, ankle))
+        angles["arm"].append(per_frame_angle(shoulder, elbow, wrist))
+    return coords, angles, indiv_coords
+
+
+class FeatureExtractionTests(SimpleTestCase):
+    def setUp(self):
+        self.xy = make_keypoints(300, seed=1)[..., :2]
+
+    def test_matches_per_frame_path(self):
+        # The vectorised path works in float64, so it agrees with the float32
+        # loop to float32 rounding rather than bit for bit: midpoints to half a
+        # float32 step, angles to a few hundredths of a degree (rounding in the
+        # cosine is magnified near straight joints)
+        coords, angles, indiv_coords = features.extract_features(self.xy)
+        ref_coords, ref_angles, ref_indiv = per_frame_features(self.xy)
+
+        for name in ref_coords:
+            np.testing.assert_allclose(
+                coords[name],
+                np.array(ref_coords[name], dtype=np.float64),
+                rtol=np.finfo(np.float32).eps,
+                atol=0,
+            )
+        for name in ref_indiv:
+            np.testing.assert_array_equal(indiv_coords[name], np.array(ref_indiv[name]))
+        for name in ref_angles:
+            np.testing.assert_allclose(
+                angles[name], np.array(ref_angles[name]), rtol=0, atol=0.05
+            )
+
+    def test_checkers_give_identical_warnings(self):
+        # Differences that small don't move any warning
+        for seed in range(4):
+            xy = make_keypoints(300, seed=seed)[..., :2]
+            coords, angles, indiv_coords = features.extract_features(xy)
+            ref_coords, ref_angles, ref_indiv = per_frame_features(xy)
+            with self.subTest(seed=seed):
+                self.assertEqual(
+                    per_frame_squat(coords, angles),
+                    per_frame_squat(ref_coords, ref_angles),
+                )
+                self.assertEqual(
+                    per_frame_deadlift(coords, angles),
+                    per_frame_deadlift(ref_coords, ref_angles),
+                )
+                self.assertEqual(
+                    per_frame_bench(angles, coords, indiv_coords),
+                    per_frame_bench(ref_angles, ref_coords, ref_indiv),
+                )
+
+    def test_empty_clip(self):
+        coords, angles, _ = features.extract_features(np.empty((0, 17, 2)))
+        self.assertEqual(len(angles["hip"]), 0)
+        self.assertEqual(coords["shoulder"].shape, (0, 2))
+
+
+class SuppressWarningsTests(SimpleTestCase):
+    def test_matches_quadratic_loop(self):
+        rng = np.random.default_rng(2)
+        for _ in range(50):
+            frames = sorted(rng.choice(500, size=60, replace=False).tolist())
+            messages = [f"warning {frame}" for frame in frames]
+            self.assertEqual(
+                util.suppress_nearby_warnings(frames, messages),
+                suppress_nearby_warnings_quadratic(frames, messages),
+            )
+
+    def test_window_follows_fps(self):
+        frames = [0, 10, 20, 30, 45, 60]
+        messages = ["a", "b", "c", "d", "e", "f"]
+        self.assertEqual(
+            util.suppress_nearby_warnings(frames, messages, fps=50),
+            ([0, 30, 60], ["a", "d", "f"]),
+        )
+        self.assertEqual(
+            util.suppress_nearby_warnings(frames, messages, fps=30),
+            ([0, 20, 45, 60], ["a", "c", "e", "f"]),
+        )
+
+    def test_benchmark_reports_identical_output(self):
+        results = bench_suppress_warnings(sizes=(500,), repeat=1)
+        self.assertTrue(results[0]["identical"])
+
+
+class InlineExecutor:
+    def __init__(self):
+        self.calls = []
+
+    def submit(self, fn, *args):
+        self.calls.append((fn, args))
+
+    def run_all(self):
+        for fn, args in self.calls:
+            fn(*args)
+        self.calls = []
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        if cancel_futures:
+            self.calls = []
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        media = override_settings(MEDIA_ROOT=self.media)
+        media.enable()
+        self.addCleanup(media.disable)
+
+        self.executor = InlineExecutor()
+        self.queue = JobQueue(
+            workers=1, capacity=2, run=self.analyze, executor=self.executor
+        )
+        patcher = mock.patch("posedetection.views.get_queue", return_value=self.queue)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def analyze(self, file_path, movement):
+        if movement == "bench":
+            raise RuntimeError("inference failed")
+        return {"url": "u", "warning_frames": [3], "warning_messages": ["m"]}
+
+    def submit(self, movement="squat"):
+        video = SimpleUploadedFile("lift.mp4", b"not really a video")
+        return self.client.post(
+            "/check-form/jobs", {"video-upload": video, "movement": movement}
+        )
+
+    def test_submit_poll_and_fetch_result(self):
+        response = self.submit()
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json()["job_id"]
+        self.assertEqual(response.json()["status"], Job.QUEUED)
+
+        response = self.client.get(f"/check-form/jobs/{job_id}/result")
+        self.assertEqual(response.status_code, 202)
+
+        self.executor.run_all()
+        response = self.client.get(f"/check-form/jobs/{job_id}")
+        self.assertEqual(response.json()["status"], Job.DONE)
+        response = self.client.get(f"/check-form/jobs/{job_id}/result")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["warning_frames"], [3])
+
+    def test_failed_job_reports_error(self):
+        job_id = self.submit("bench").json()["job_id"]
+        self.executor.run_all()
+
+        response = self.client.get(f"/check-form/jobs/{job_id}/result")
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.json()["error"], "inference failed")
+
+    def test_full_queue_applies_backpressure(self):
+        self.assertEqual(self.submit().status_code, 202)
+        self.assertEqual(self.submit().status_code, 202)
+
+        response = self.submit()
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("Retry-After", response)
+        self.assertEqual(Job.objects.count(), 2)
+
+        self.executor.run_all()
+        self.assertEqual(self.queue.pending(), 0)
+        self.assertEqual(self.submit().status_code, 202)
+
+    def test_jobs_lost_with_their_process_fail(self):
+        job_id = self.submit().json()["job_id"]
+        # The process holding it stopped sending heartbeats
+        Job.objects.filter(pk=job_id).update(
+            heartbeat_at=timezone.now() - timedelta(minutes=5)
+        )
+
+        response = self.client.get(f"/check-form/jobs/{job_id}/result")
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.json()["error"], jobs.STALE_ERROR)
+        # A late worker doesn't revive it
+        self.executor.run_all()
+        self.assertEqual(Job.objects.get(pk=job_id).status, Job.FAILED)
+
+    def test_heartbeat_keeps_held_jobs_alive(self):
+        held = self.submit().json()["job_id"]
+        orphan = Job.objects.create(movement="squat", upload="lost.mp4")
+        Job.objects.update(heartbeat_at=timezone.now() - timedelta(minutes=5))
+
+        self.queue.beat()
+        self.assertEqual(Job.objects.get(pk=held).status, Job.QUEUED)
+        self.assertEqual(Job.objects.get(pk=orphan.pk).status, Job.FAILED)
+
+        self.executor.run_all()
+        self.assertEqual(Job.objects.get(pk=held).status, Job.DONE)
+
+    def test_shutdown_fails_unfinished_jobs(self):
+        done = self.submit().json()["job_id"]
+        self.executor.run_all()
+        self.assertTrue(self.queue.shutdown(0))
+
+        self.queue = JobQueue(workers=1, capacity=2, executor=self.executor)
+        with mock.patch("posedetection.views.get_queue", return_value=self.queue):
+            unfinished = self.submit().json()["job_id"]
+        self.assertFalse(self.queue.shutdown(0))
+
+        self.assertEqual(Job.objects.get(pk=done).status, Job.DONE)
+        job = Job.objects.get(pk=unfinished)
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.error, jobs.STALE_ERROR)
+        self.assertEqual(self.executor.calls, [])
+
+    def test_process_queue_is_shared(self):
+        # The real queue runs a heartbeat thread, so it's stopped afterwards
+        with mock.patch.object(jobs, "_queue", None):
+            queue = jobs.get_queue()
+            self.addCleanup(queue.shutdown, 0)
+            self.assertIs(jobs.get_queue(), queue)
+
+    def test_rejects_invalid_movement(self):
+        self.assertEqual(self.submit("curl").status_code, 400)
+        self.assertEqual(Job.objects.count(), 0)
+
+    def test_unknown_job(self):
+        response = self.client.get(
+            "/check-form/jobs/00000000-0000-0000-0000-000000000000"
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class StreamingInferenceTests(SimpleTestCase):
+    def test_streams_compact_keypoints(self):
+        keypoints = make_keypoints(40, seed=3)
+        with tempfile.TemporaryDirectory() as directory:
+            path = write_video(f"{directory}/clip.mp4", 40)
+            frames = util.iter_keypoints(FakePoseModel(keypoints), path)
+            collected = util.collect_keypoints(frames)
+
+        self.assertEqual(collected.shape, (40, 17, 3))
+        self.assertEqual(collected.dtype, np.float32)
+        np.testing.assert_array_equal(collected, keypoints)
+
+    def test_collect_grows_past_initial_buffer(self):
+        keypoints = make_keypoints(1000, seed=4)
+        np.testing.assert_array_equal(
+            util.collect_keypoints(iter(keypoints)), keypoints
+        )
+
+    def test_frame_without_person_is_nan(self):
+        result = FakeResult(None, np.empty((0, 17, 3), dtype=np.float32))
+        self.assertTrue(np.isnan(util.compact_keypoints(result)).all())
+
+    def test_peak_memory_stays_bounded(self):
+        short, long = bench_streaming_memory(lengths=(30, 240), size=(160, 120))
+        self.assertLess(
+            long["streamed_peak_bytes"], long["materialized_peak_bytes"] / 4
+        )
+        # Growing the clip 8x must not grow streamed memory anywhere near 8x
+        self.assertLess(long["streamed_peak_bytes"], short["streamed_peak_bytes"] * 3)
+
+
+class PoseCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_round_trip_and_counters(self):
+        cache = PoseCache(self.directory, max_bytes=10 * 2**20)
+        key = cache.key("abc", "yolo11n-pose.pt", 0.7)
+        keypoints = make_keypoints(20)
+
+        self.assertIsNone(cache.get(key))
+        cache.put(key, keypoints, {"url": "u", "fps": 30})
+        cached, meta = cache.get(key)
+
+        np.testing.assert_array_equal(cached, keypoints)
+        self.assertEqual(meta, {"url": "u", "fps": 30})
+        self.assertEqual(cache.metrics(), {"hits": 1, "misses": 1, "evictions": 0})
+
+    def test_key_depends_on_model_and_conf(self):
+        cache = PoseCache(self.directory, max_bytes=0)
+        key = cache.key("abc", "yolo11n-pose.pt", 0.7)
+        self.assertNotEqual(key, cache.key("abc", "yolo11s-pose.pt", 0.7))
+        self.assertNotEqual(key, cache.key("abc", "yolo11n-pose.pt", 0.5))
+
+    def test_evicts_least_recently_used(self):
+        keypoints = make_keypoints(100)
+        entry_size = keypoints.nbytes + 200
+        cache = PoseCache(self.directory, max_bytes=int(entry_size * 2.5))
+
+        cache.put("a", keypoints, {})
+        cache.put("b", keypoints, {})
+        # Make "a" the most recently used before a third entry forces eviction
+        os.utime(f"{self.directory}/b.npy", (1, 1))
+        cache.get("a")
+        cache.put("c", keypoints, {})
+
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("c"))
+        self.assertEqual(cache.metrics()["evictions"], 1)
+
+    def test_tolerates_entries_evicted_concurrently(self):
+        cache = PoseCache(self.directory, max_bytes=10 * 2**20)
+        cache.put("a", make_keypoints(10), {})
+
+        with mock.patch("os.utime", side_effect=FileNotFoundError):
+            self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.metrics()["misses"], 1)
+
+        # An entry removed between listing the directory and reading its size
+        vanished = mock.Mock(stat=mock.Mock(side_effect=FileNotFoundError))
+        vanished.name = "gone.npy"
+        scandir = os.scandir
+        with mock.patch("os.scandir", lambda path: [vanished, *scandir(path)]):
+            cache.put("b", make_keypoints(10), {})
+        self.assertIsNotNone(cache.get("b"))
+
+    def test_pipeline_key_covers_backend_and_quantization(self):
+        cache = PoseCache(self.directory, max_bytes=10 * 2**20)
+        video = write_video(f"{self.directory}/clip.mp4", 6)
+        keys = set()
+        with mock.patch("posedetection.pipeline.get_cache", return_value=cache):
+            with mock.patch.object(
+                util, "get_pose_estimation", return_value=make_keypoints(6)
+            ):
+                for backend, int8 in (
+                    ("torch", False),
+                    ("onnx", False),
+                    ("openvino", True),
+                ):
+                    with override_settings(POSE_BACKEND=backend, POSE_INT8=int8):
+                        keys.add(pipeline.estimate_pose(video, digest="abc")[0])
+        self.assertEqual(len(keys), 3)
+
+    def test_pipeline_key_covers_tracking(self):
+        # Each of these can change which person's track is cached
+        cache = PoseCache(self.directory, max_bytes=10 * 2**20)
+        video = write_video(f"{self.directory}/clip.mp4", 6)
+        keys = set()
+        with mock.patch("posedetection.pipeline.get_cache", return_value=cache):
+            with mock.patch.object(
+                util, "get_pose_estimation", return_value=make_keypoints(6)
+            ):
+                for overrides in (
+                    {},
+                    {"POSE_TRACKING": False},
+                    {"POSE_MAX_PEOPLE": 2},
+                    {"POSE_TRACK_IOU": 0.5},
+                    {"POSE_TRACK_MAX_AGE_SECONDS": 2},
+                    {"POSE_MIN_KEYPOINT_CONF": 0.3},
+                ):
+                    with override_settings(**overrides):
+                        keys.add(pipeline.estimate_pose(video, digest="abc")[0])
+        self.assertEqual(len(keys), 6)
+
+    def test_cache_hit_skips_inference(self):
+        cache = PoseCache(self.directory, max_bytes=10 * 2**20)
+        video = f"{self.directory}/clip.mp4"
+        with open(video, "wb") as f:
+            f.write(b"same bytes")
+
+        estimation = make_keypoints(120, seed=1)
+        with mock.patch("posedetection.pipeline.get_cache", return_value=cache):
+            with mock.patch.object(
+                util, "get_pose_estimation", return_value=estimation
+            ) as estimate:
+                first = pipeline.analyze_video(video, "squat")
+                second = pipeline.analyze_video(video, "deadlift")
+                third = pipeline.analyze_video(video, "squat")
+
+        self.assertEqual(estimate.call_count, 1)
+        self.assertEqual(first, third)
+        self.assertEqual(second["video_url"], first["video_url"])
+        self.assertEqual(cache.metrics()["hits"], 2)
+
+
+class SubsamplingTests(SimpleTestCase):
+    def test_analysis_stride(self):
+        self.assertEqual(util.get_analysis_stride(60, None), 1)
+        self.assertEqual(util.get_analysis_stride(60, 0), 1)
+        self.assertEqual(util.get_analysis_stride(30, 60), 1)
+        self.assertEqual(util.get_analysis_stride(60, 15), 4)
+        self.assertEqual(util.get_analysis_stride(59.94, 30), 2)
+
+    def test_warning_frames_map_to_source_timeline(self):
+        keypoints = make_keypoints(1200, reps=10, seed=6)
+        full = pipeline.check_keypoints(keypoints, "squat", 60)
+        frames, messages = pipeline.check_keypoints(keypoints[3::4], "squat", 60, 4)
+
+        self.assertTrue(frames)
+        self.assertTrue(all(frame % 4 == 3 for frame in frames))
+        self.assertLess(max(frames), 1200)
+        # Every full-rate warning is still given within half a second, and
+        # subsampling only adds the odd one from a noisy frame it landed on
+        self.assertEqual(warning_agreement(full, (frames, messages), 30), 1.0)
+        self.assertGreaterEqual(warning_agreement((frames, messages), full, 30), 0.9)
+
+    def test_fake_model_honours_vid_stride(self):
+        keypoints = make_keypoints(30, seed=7)
+        with tempfile.TemporaryDirectory() as directory:
+            path = write_video(f"{directory}/clip.mp4", 30)
+            frames = util.iter_keypoints(FakePoseModel(keypoints), path, vid_stride=3)
+            collected = util.collect_keypoints(frames)
+
+        np.testing.assert_array_equal(collected, keypoints[2::3])
+
+    def test_every_decoder_reads_the_frames_ultralytics_does(self):
+        from ultralytics.data.loaders import LoadImagesAndVideos
+
+        # Each frame's brightness is ten times its number
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        video = f"{directory}/numbered.mp4"
+        writer = cv2.VideoWriter(video, cv2.VideoWriter_fourcc(*"mp4v"), 30, (64, 48))
+        for i in range(25):
+            writer.write(np.full((48, 64, 3), i * 10, dtype=np.uint8))
+        writer.release()
+        keypoints = make_keypoints(25, seed=7)
+        keypoints[:, 0, 0] = np.arange(25)
+        batcher = MicroBatcher(
+            ModelPool("pose.pt", loader=lambda name: FrameValueModel()), 4, 0.001
+        )
+
+        for stride in (1, 2, 3, 4):
+            with self.subTest(stride=stride):
+                loader = LoadImagesAndVideos(video, vid_stride=stride)
+                ultralytics = [round(images[0].mean() / 10) for _, images, _ in loader]
+                fake = util.collect_keypoints(
+                    util.iter_keypoints(
+                        FakePoseModel(keypoints), video, vid_stride=stride
+                    )
+                )[:, 0, 0]
+                batched = util.collect_keypoints(batcher.iter_keypoints(video, stride))[
+                    :, 0, 0
+                ]
+
+                expected = [util.source_frame(i, stride) for i in range(25 // stride)]
+                self.assertEqual(ultralytics, expected)
+                self.assertEqual(fake.tolist(), expected)
+                self.assertEqual(np.round(batched / 10).tolist(), expected)
+
+    def test_analysed_index_inverts_source_frame(self):
+        for stride in (1, 2, 3, 4):
+            for frame in range(stride - 1, 40):
+                index = util.analysed_index(frame, stride)
+                self.assertLessEqual(util.source_frame(index, stride), frame)
+                self.assertGreater(util.source_frame(index + 1, stride), frame)
+            self.assertEqual(util.analysed_index(stride - 2, stride), -1)
+
+
+@override_settings(
+    R2_MULTIPART_CHUNKSIZE=5 * 2**20, R2_MAX_CONCURRENCY=4, R2_UPLOAD_WORKERS=2
+)
+class UploadVideoTests(SimpleTestCase):
+    def setUp(self):
+        env = mock.patch.dict(
+            os.environ,
+            {
+                "AWS_DEFAULT_REGION": "us-east-1",
+                "R2_ACCESS_KEY_ID": "testing",
+                "R2_SECRET_ACCESS_KEY": "testing",
+                "R2_PUBLIC_ENDPOINT": "https://media.example.com",
+            },
+        )
+        env.start()
+        self.addCleanup(env.stop)
+        os.environ.pop("R2_CONNECTION_URL", None)
+
+        aws = mock_aws()
+        aws.start()
+        self.addCleanup(aws.stop)
+
+        # Start every test with a fresh shared client and upload pool
+        for name in ("_s3_client", "_upload_executor"):
+            patcher = mock.patch.object(util, name, None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.s3 = boto3.client("s3")
+        self.s3.create_bucket(Bucket="howsmyform")
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write(self, name, size):
+        path = f"{self.directory}/{name}"
+        with open(path, "wb") as f:
+            f.write(os.urandom(size))
+        return path
+
+    def test_client_is_shared(self):
+        self.assertIs(util.get_s3_client(), util.get_s3_client())
+
+    def test_multipart_upload(self):
+        path = self.write("big.mp4", 12 * 2**20)
+        url = util.upload_video(path, "howsmyform")
+
+        self.assertEqual(url, "https://media.example.com/howsmyform/big.mp4")
+        head = self.s3.head_object(Bucket="howsmyform", Key="big.mp4")
+        self.assertEqual(head["ContentLength"], 12 * 2**20)
+        # Multipart uploads get an ETag of the form "<md5>-<parts>"
+        self.assertTrue(head["ETag"].strip('"').endswith("-3"))
+
+    def test_background_upload(self):
+        path = self.write("clip.mp4", 1024)
+        url = util.upload_video(path, "howsmyform", "renamed.mp4", background=True)
+
+        self.assertEqual(url, "https://media.example.com/howsmyform/renamed.mp4")
+        util.get_upload_executor().shutdown(wait=True)
+        head = self.s3.head_object(Bucket="howsmyform", Key="renamed.mp4")
+        self.assertEqual(head["ContentType"], "video/mp4")
+
+    def test_shutdown_waits_for_background_uploads(self):
+        path = self.write("clip.mp4", 1024)
+        client = util.get_s3_client()
+        upload_file = client.upload_file
+
+        def slow_upload(*args, **kwargs):
+            time.sleep(0.2)
+            upload_file(*args, **kwargs)
+
+        with mock.patch.object(client, "upload_file", side_effect=slow_upload):
+            util.upload_video(path, "howsmyform", background=True)
+            self.assertFalse(util.shutdown_uploads(0))
+            self.assertTrue(util.shutdown_uploads(5))
+        self.s3.head_object(Bucket="howsmyform", Key="clip.mp4")
+
+
+class UploadHandlingTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        media = override_settings(MEDIA_ROOT=self.media)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def temporary_upload(self, size):
+        upload = TemporaryUploadedFile("lift.mp4", "video/mp4", size, None)
+        chunk = os.urandom(2**20)
+        for _ in range(size // len(chunk)):
+            upload.write(chunk)
+        upload.seek(0)
+        return upload
+
+    def test_peak_memory_is_flat_in_upload_size(self):
+        peaks = []
+        for size in (2**20, 32 * 2**20):
+            upload = self.temporary_upload(size)
+            peak, path = measure_peak_memory(lambda: views.save_upload(upload))
+            # Django closes uploads at the end of a request, as it does here
+            upload.close()
+            self.assertEqual(os.path.getsize(path), size)
+            peaks.append(peak)
+
+        self.assertLess(peaks[1], 2**20)
+        self.assertLess(peaks[1], peaks[0] * 4 + 64 * 1024)
+
+    def test_in_memory_upload_is_saved(self):
+        upload = SimpleUploadedFile("lift.mp4", b"video bytes")
+        with open(views.save_upload(upload), "rb") as f:
+            self.assertEqual(f.read(), b"video bytes")
+
+    @override_settings(POSE_MAX_UPLOAD_BYTES=1024)
+    def test_rejects_oversized_upload(self):
+        video = SimpleUploadedFile("lift.mp4", b"x" * 4096)
+        for url in ("/check-form", "/check-form/jobs"):
+            response = self.client.post(
+                url, {"video-upload": video, "movement": "squat"}
+            )
+            self.assertEqual(response.status_code, 413)
+            video.seek(0)
+        self.assertFalse(os.path.exists(f"{self.media}/posedetection/uploads"))
+
+    @override_settings(POSE_MAX_UPLOAD_BYTES=1024)
+    def test_stops_reading_upload_past_limit(self):
+        # A Content-Length that understates the body (or is missing) doesn't
+        # get the upload past the limit
+        request = RequestFactory().post(
+            "/check-form",
+            {"video-upload": SimpleUploadedFile("lift.mp4", b"x" * 4096)},
+        )
+        request.META["CONTENT_LENGTH"] = "512"
+        self.assertTrue(views.upload_too_large(request))
+        self.assertNotIn("video-upload", request.FILES)
+
+        request = RequestFactory().post(
+            "/check-form",
+            {"video-upload": SimpleUploadedFile("lift.mp4", b"x" * 512)},
+        )
+        self.assertFalse(views.upload_too_large(request))
+        self.assertEqual(request.FILES["video-upload"].read(), b"x" * 512)
+
+    @override_settings(POSE_MAX_UPLOAD_BYTES=1024)
+    def test_asgi_refuses_chunked_upload_past_limit(self):
+        from server.asgi import application
+
+        chunks = [b"x" * 600] * 4
+        sent = []
+
+        async def receive():
+            return {
+                "type": "http.request",
+                "body": chunks.pop(0),
+                "more_body": bool(chunks),
+            }
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {
+            "type": "http",
+            "method": "POST",
+            "path": "/check-form",
+            "query_string": b"",
+            "headers": [(b"content-type", b"multipart/form-data; boundary=x")],
+        }
+        asyncio.run(application(scope, receive, send))
+        self.assertEqual(sent[0]["status"], 413)
+        self.assertEqual(json.loads(sent[1]["body"]), {"message": "Video is too large"})
+        self.assertEqual(len(sent), 2)
+        # Only enough of the body to tell was read
+        self.assertEqual(len(chunks), 2)
+        self.assertFalse(os.path.exists(f"{self.media}/posedetection/uploads"))
+
+
+class FrameValueModel:
+    # Reports each frame's mean pixel value as its nose x, so batched results
+    # can be traced back to the frame they came from
+    def __init__(self):
+        self.batch_sizes = []
+
+    def __call__(self, source=None, **kwargs):
+        self.batch_sizes.append(len(source))
+        results = []
+        for frame in source:
+            keypoints = np.zeros((1, 17, 3), dtype=np.float32)
+            keypoints[0, 0, 0] = frame.mean()
+            results.append(FakeResult(frame, keypoints))
+        return results
+
+
+class MicroBatcherTests(SimpleTestCase):
+    def batcher(self, model, max_batch=4, max_wait=0.05):
+        pool = ModelPool("pose.pt", loader=lambda name: model)
+        return MicroBatcher(pool, max_batch, max_wait)
+
+    def test_groups_concurrent_frames_and_splits_results(self):
+        model = FrameValueModel()
+        batcher = self.batcher(model, max_batch=4, max_wait=0.2)
+        results = {}
+        start = threading.Barrier(3)
+
+        def submit(caller):
+            start.wait()
+            futures = [
+                batcher.submit(np.full((8, 8, 3), caller * 10 + i, dtype=np.uint8))
+                for i in range(5)
+            ]
+            results[caller] = [future.result(timeout=5)[0, 0] for future in futures]
+
+        threads = [threading.Thread(target=submit, args=(i,)) for i in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for caller in range(3):
+            self.assertEqual(results[caller], [caller * 10 + i for i in range(5)])
+        self.assertEqual(sum(model.batch_sizes), 15)
+        self.assertLessEqual(max(model.batch_sizes), 4)
+        self.assertLess(len(model.batch_sizes), 15)
+
+    def test_partial_batch_runs_after_max_wait(self):
+        model = FrameValueModel()
+        batcher = self.batcher(model, max_batch=8, max_wait=0.01)
+        future = batcher.submit(np.full((8, 8, 3), 7, dtype=np.uint8))
+        self.assertEqual(future.result(timeout=5)[0, 0], 7)
+        self.assertEqual(model.batch_sizes, [1])
+
+    def test_model_errors_reach_every_caller(self):
+        def broken(source=None, **kwargs):
+            raise RuntimeError("inference failed")
+
+        batcher = self.batcher(broken)
+        futures = [batcher.submit(np.zeros((8, 8, 3), np.uint8)) for _ in range(2)]
+        for future in futures:
+            with self.assertRaises(RuntimeError):
+                future.result(timeout=5)
+
+    def test_default_size_shares_one_batcher(self):
+        # POSE_MAX_IMGSZ is 0 by default, meaning the model's own size
+        pool = ModelPool("pose.pt", loader=lambda name: FrameValueModel())
+        with mock.patch.dict(batching._batchers, clear=True), mock.patch(
+            "posedetection.batching.get_pool", return_value=pool
+        ):
+            self.assertIs(batching.get_batcher(0), batching.get_batcher(None))
+            self.assertIsNot(batching.get_batcher(320), batching.get_batcher(0))
+            self.assertEqual(list(batching._batchers), [None, 320])
+
+    def test_video_keypoints_follow_stride(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        video = write_video(f"{directory}/lift.mp4", 25)
+        batcher = self.batcher(FakePoseModel(), max_batch=4, max_wait=0.001)
+
+        keypoints = util.collect_keypoints(batcher.iter_keypoints(video, stride=3))
+        self.assertEqual(keypoints.shape, (8, 17, 3))
+
+
+class BatchEndpointTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        media = override_settings(MEDIA_ROOT=self.media)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def videos(self, count):
+        return [
+            SimpleUploadedFile(f"lift{i}.mp4", b"video bytes") for i in range(count)
+        ]
+
+    def test_analyses_every_video_batched(self):
+        def analyze(file_path, movement, **kwargs):
+            return {"movement": movement, "batched": kwargs["batched"]}
+
+        with mock.patch("posedetection.views.pipeline.analyze_video", analyze):
+            response = self.client.post(
+                "/check-form/batch",
+                {"video-upload": self.videos(2), "movement": ["squat", "bench"]},
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json()["results"],
+            [
+                {"movement": "squat", "batched": True, "name": "lift0.mp4"},
+                {"movement": "bench", "batched": True, "name": "lift1.mp4"},
+            ],
+        )
+
+    def test_one_movement_applies_to_every_video(self):
+        analyze = mock.Mock(return_value={})
+        with mock.patch("posedetection.views.pipeline.analyze_video", analyze):
+            response = self.client.post(
+                "/check-form/batch",
+                {"video-upload": self.videos(3), "movement": "deadlift"},
+            )
+
+        self.assertEqual(response.status_code, 200)
+        movements = [call.args[1] for call in analyze.call_args_list]
+        self.assertEqual(movements, ["deadlift"] * 3)
+
+    def test_per_rep_summaries_can_replace_frame_warnings(self):
+        analyze = mock.Mock(return_value={})
+        with mock.patch("posedetection.views.pipeline.analyze_video", analyze):
+            self.client.post(
+                "/check-form/batch",
+                {"video-upload": self.videos(1), "movement": "squat", "per_rep": 1},
+            )
+            self.client.post(
+                "/check-form/batch",
+                {"video-upload": self.videos(1), "movement": "squat"},
+            )
+        self.assertEqual(
+            [call.kwargs["per_rep"] for call in analyze.call_args_list], [True, False]
+        )
+
+    def test_videos_filmed_from_the_wrong_view(self):
+        def analyze(file_path, movement, **kwargs):
+            if movement == "bench":
+                raise camera.UnsupportedView("bench", "side", {"front"})
+            return {"movement": movement}
+
+        with mock.patch("posedetection.views.pipeline.analyze_video", analyze):
+            batch = self.client.post(
+                "/check-form/batch",
+                {"video-upload": self.videos(2), "movement": ["squat", "bench"]},
+            )
+            single = self.client.post(
+                "/check-form",
+                {"video-upload": self.videos(1)[0], "movement": "bench"},
+            )
+
+        rejected = {
+            "message": "A bench can't be checked when filmed from the side, "
+            "try filming from the front",
+            "view": "side",
+            "supported_views": ["front"],
+        }
+        self.assertEqual(batch.status_code, 200)
+        self.assertEqual(
+            batch.json()["results"],
+            [
+                {"movement": "squat", "name": "lift0.mp4"},
+                {**rejected, "name": "lift1.mp4"},
+            ],
+        )
+        self.assertEqual(single.status_code, 422)
+        self.assertEqual(single.json(), rejected)
+
+    @override_settings(POSE_SERVER_TIMING=True)
+    def test_server_timing_covers_every_video(self):
+        def analyze(file_path, movement, **kwargs):
+            for stage in ("inference", "features", "checks"):
+                with metrics.span(stage):
+                    pass
+            return {}
+
+        with mock.patch("posedetection.views.pipeline.analyze_video", analyze):
+            response = self.client.post(
+                "/check-form/batch",
+                {"video-upload": self.videos(2), "movement": "squat"},
+            )
+
+        stages = [
+            timing.split(";")[0] for timing in response["Server-Timing"].split(", ")
+        ]
+        self.assertEqual(stages.count("save_upload"), 1)
+        for stage in ("inference", "features", "checks"):
+            self.assertEqual(stages.count(stage), 2, stage)
+
+    @override_settings(POSE_BATCH_MAX_VIDEOS=2)
+    def test_rejects_invalid_batches(self):
+        for data in (
+            {"video-upload": self.videos(3), "movement": "squat"},
+            {"video-upload": self.videos(2), "movement": ["squat"] * 3},
+            {"video-upload": self.videos(2), "movement": "curl"},
+            {"movement": "squat"},
+        ):
+            response = self.client.post("/check-form/batch", data)
+            self.assertEqual(response.status_code, 400)
+        self.assertFalse(os.path.exists(f"{self.media}/posedetection/uploads"))
+
+
+class PersonRunner:
+    # Stands in for an exported model: every image in the batch holds one
+    # person, plus a weaker duplicate detection and a background anchor
+    def __init__(self, keypoints):
+        self.keypoints = keypoints
+        self.batch_sizes = []
+
+    def __call__(self, batch):
+        self.batch_sizes.append(len(batch))
+        prediction = np.zeros((len(batch), 56, 3), dtype=np.float32)
+        for anchor, score in enumerate((0.9, 0.8, 0.1)):
+            prediction[:, :4, anchor] = (320, 300, 200, 400)
+            prediction[:, 4, anchor] = score
+            prediction[:, 5:, anchor] = self.keypoints.reshape(-1)
+        return prediction
+
+
+class ExportedBackendTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_letterbox_pads_to_a_centred_square(self):
+        frame = np.zeros((240, 320, 3), dtype=np.uint8)
+        padded, scale, padding = letterbox(frame, 640)
+        self.assertEqual(padded.shape, (640, 640, 3))
+        self.assertEqual((scale, padding), (2, (0, 80)))
+        self.assertEqual(padded[0, 0].tolist(), [114, 114, 114])
+        self.assertEqual(padded[320, 320].tolist(), [0, 0, 0])
+
+    def test_keypoints_map_back_to_the_original_frame(self):
+        # Scaled down to fit inside a 320x240 frame
+        original = make_keypoints(1, seed=11)[0]
+        original[:, :2] /= 3
+        letterboxed = original.copy()
+        letterboxed[:, :2] = letterboxed[:, :2] * 2 + (0, 80)
+        model = ExportedPoseModel(PersonRunner(letterboxed))
+
+        results = model(np.zeros((240, 320, 3), dtype=np.uint8), conf=0.5)
+        self.assertEqual(len(results[0].keypoints.data), 1)
+        np.testing.assert_allclose(
+            util.compact_keypoints(results[0]), original, atol=1e-3
+        )
+
+    def test_called_like_an_ultralytics_model(self):
+        runner = PersonRunner(make_keypoints(1, seed=12)[0])
+        model = ExportedPoseModel(runner, imgsz=320)
+        video = write_video(f"{self.directory}/lift.mp4", 10)
+
+        keypoints = util.collect_keypoints(
+            util.iter_keypoints(model, video, vid_stride=2)
+        )
+        self.assertEqual(keypoints.shape, (5, 17, 3))
+        frames = [np.zeros((240, 320, 3), dtype=np.uint8)] * 3
+        self.assertEqual(len(model(source=frames, conf=0.5)), 3)
+        self.assertEqual(runner.batch_sizes, [1] * 5 + [3])
+
+    def test_nobody_found_below_confidence(self):
+        model = ExportedPoseModel(PersonRunner(make_keypoints(1)[0]))
+        result = model(np.zeros((240, 320, 3), dtype=np.uint8), conf=0.95)[0]
+        self.assertTrue(np.isnan(util.compact_keypoints(result)).all())
+
+    def test_export_is_cached(self):
+        calls = []
+
+        def exporter(model_name, backend, imgsz, int8):
+            calls.append((model_name, backend, imgsz, int8))
+            path = f"{self.directory}/{len(calls)}.onnx"
+            with open(path, "w") as f:
+                f.write("model")
+            return path
+
+        with override_settings(POSE_EXPORT_DIR=f"{self.directory}/exports"):
+            paths = [
+                export_model("weights/pose.pt", "onnx", 640, exporter=exporter)
+                for _ in range(2)
+            ]
+
+        self.assertEqual(calls, [("weights/pose.pt", "onnx", 640, False)])
+        self.assertEqual(paths[0], paths[1])
+        self.assertEqual(os.path.basename(paths[0]), "pose-640.onnx")
+        with open(paths[0]) as f:
+            self.assertEqual(f.read(), "model")
+
+    @override_settings(POSE_BACKEND="tensorrt")
+    def test_unknown_backend(self):
+        with self.assertRaises(ImproperlyConfigured):
+            load_model("pose.pt")
+
+    def test_onnx_keypoints_match_torch(self):
+        try:
+            import onnxruntime
+        except ImportError:
+            self.skipTest("onnxruntime is not installed")
+        weights = fetch_weights(settings.POSE_MODEL)
+        if weights is None:
+            self.skipTest(f"{settings.POSE_MODEL} not found")
+        from ultralytics.utils import ASSETS
+
+        image = cv2.imread(str(ASSETS / "bus.jpg"))
+        keypoints = {}
+        for backend in ("torch", "onnx"):
+            with override_settings(
+                POSE_BACKEND=backend, POSE_EXPORT_DIR=f"{self.directory}/exports"
+            ):
+                model = load_model(weights)
+            result = model(image, conf=settings.POSE_CONF, verbose=False)[0]
+            keypoints[backend] = util.compact_keypoints(result)
+
+        torch_keypoints, onnx_keypoints = keypoints["torch"], keypoints["onnx"]
+        self.assertFalse(np.isnan(torch_keypoints).any())
+        np.testing.assert_allclose(
+            onnx_keypoints[:, :2], torch_keypoints[:, :2], atol=3
+        )
+        np.testing.assert_allclose(
+            onnx_keypoints[:, 2], torch_keypoints[:, 2], atol=0.05
+        )
+
+
+class BenchmarkSuiteTests(SimpleTestCase):
+    def test_pipeline_benchmark_covers_every_stage(self):
+        stages = bench_pipeline(frames=120, video_frames=20)
+        for stage in (
+            "decode",
+            "model_load",
+            "inference",
+            "upload_video",
+            "features",
+            "rules_squat",
+            "rules_bench",
+            "rules_deadlift",
+        ):
+            self.assertIn(stage, stages)
+        self.assertEqual(stages["inference"]["frames"], 20)
+        self.assertGreater(stages["upload_video"]["bytes"], 0)
+
+    def test_microbatch_benchmark_batches_across_videos(self):
+        results = bench_microbatch(videos=3, video_frames=8, batch_sizes=(1, 3))
+        self.assertEqual([row["frames"] for row in results], [24, 24])
+        self.assertEqual(results[0]["mean_batch_size"], 1)
+        self.assertGreater(results[1]["mean_batch_size"], 1)
+
+    def test_smoothing_benchmark_reduces_spurious_warnings(self):
+        results = bench_smoothing(frames=300, noise=(8.0,))
+        self.assertEqual(len(results), len(pipeline.MOVEMENTS))
+        for row in results:
+            self.assertLess(row["smoothed_warnings"], row["noisy_warnings"])
+
+    def test_tracking_benchmark_follows_the_lifter(self):
+        results = bench_tracking(frames=(120,))
+        self.assertEqual(results[0]["tracked_lifter_frames"], 1.0)
+        self.assertLess(results[0]["first_detection_lifter_frames"], 1.0)
+
+    def test_reps_benchmark_shrinks_responses(self):
+        # Per-frame warnings grow with the clip, per-rep summaries don't
+        results = bench_reps(frames=(3000,), reps_per_clip=4)
+        self.assertEqual(results[0]["reps_found"], 4)
+        self.assertLess(results[0]["per_rep_bytes"], results[0]["per_frame_bytes"])
+
+    def test_rules_benchmark_matches_per_frame_checkers(self):
+        results = bench_rules(frames=(1500,))
+        self.assertEqual(len(results), len(pipeline.MOVEMENTS))
+        for row in results:
+            self.assertTrue(row["identical"], row["movement"])
+            self.assertGreater(row["warnings"], 0)
+            self.assertLess(row["rules_seconds"], row["per_frame_seconds"])
+
+    def test_compare_reports_flags_slowdowns(self):
+        baseline = {"pipeline": {"decode": {"seconds": 1.0, "frames": 10}}}
+        report = {"pipeline": {"decode": {"seconds": 1.5, "frames": 20}}}
+        self.assertEqual(
+            compare_reports(baseline, report, 0.25),
+            [("pipeline.decode.seconds", 1.0, 1.5)],
+        )
+        self.assertEqual(compare_reports(baseline, report, 0.6), [])
+
+    def test_command_writes_json(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = f"{directory}/report.json"
+            call_command(
+                "benchmark", "suppress_warnings", output=output, stdout=StringIO()
+            )
+            with open(output) as f:
+                report = json.load(f)
+        self.assertIn("environment", report)
+        self.assertTrue(all(row["identical"] for row in report["suppress_warnings"]))
+
+
+class MetricsTests(SimpleTestCase):
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+
+    def test_render_prometheus_text(self):
+        metrics.observe("posedetection_stage_seconds", 0.5, stage="inference")
+        metrics.observe("posedetection_stage_seconds", 1.5, stage="inference")
+        metrics.inc("posedetection_uploaded_bytes_total", 2048)
+        text = metrics.render([("posedetection_model_idle", "gauge", {}, 1)])
+
+        self.assertIn("# TYPE posedetection_stage_seconds summary", text)
+        self.assertIn('posedetection_stage_seconds_count{stage="inference"} 2', text)
+        self.assertIn('posedetection_stage_seconds_sum{stage="inference"} 2.0', text)
+        self.assertIn('posedetection_stage_seconds_max{stage="inference"} 1.5', text)
+        self.assertIn("posedetection_uploaded_bytes_total 2048", text)
+        self.assertIn("posedetection_model_idle 1", text)
+
+    def test_spans_are_collected_per_request(self):
+        with metrics.span("outside"):
+            pass
+        token = metrics.start_request()
+        with metrics.span("features"):
+            pass
+        with metrics.span("checks"):
+            pass
+        timings = metrics.finish_request(token)
+
+        self.assertEqual([stage for stage, _ in timings], ["features", "checks"])
+        self.assertIn('stage="outside"', metrics.render())
+
+    def test_metrics_endpoint(self):
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        self.assertIn(b"posedetection_cache_hits_total", response.content)
+        self.assertIn(b"posedetection_model_loads_total", response.content)
+
+    def test_pending_jobs_gauge_does_not_start_the_queue(self):
+        with mock.patch.object(jobs, "_queue", None):
+            response = self.client.get("/metrics")
+            self.assertIsNone(jobs._queue)
+        self.assertIn(b"posedetection_job_queue_pending 0", response.content)
+
+        queue = JobQueue(workers=1, capacity=2, executor=InlineExecutor())
+        queue._pending = 1
+        with mock.patch.object(jobs, "_queue", queue):
+            response = self.client.get("/metrics")
+        self.assertIn(b"posedetection_job_queue_pending 1", response.content)
+
+
+class ServerTimingMiddlewareTests(SimpleTestCase):
+    def view(self, request):
+        with metrics.span("inference"):
+            pass
+        return HttpResponse("ok")
+
+    def test_header_only_when_enabled(self):
+        middleware = ServerTimingMiddleware(self.view)
+        request = RequestFactory().post("/check-form")
+
+        with override_settings(POSE_SERVER_TIMING=False):
+            self.assertNotIn("Server-Timing", middleware(request))
+        with override_settings(POSE_SERVER_TIMING=True):
+            header = middleware(request)["Server-Timing"]
+        self.assertRegex(header, r"^inference;dur=\d+\.\d$")
+
+    def test_sampled_requests_are_profiled(self):
+        middleware = ServerTimingMiddleware(self.view)
+        request = RequestFactory().post("/check-form")
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(
+                POSE_PROFILE_SAMPLE_RATE=1.0, POSE_PROFILE_DIR=directory
+            ):
+                middleware(request)
+            profiles = os.listdir(directory)
+            self.assertEqual(len(profiles), 1)
+            self.assertTrue(profiles[0].endswith("-check-form.prof"))
+            pstats.Stats(os.path.join(directory, profiles[0]))
+
+
+class RenderTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.cache = PoseCache(f"{self.directory}/cache", max_bytes=10 * 2**20)
+        for target in ("pipeline", "render", "views"):
+            patcher = mock.patch(
+                f"posedetection.{target}.get_cache", return_value=self.cache
+            )
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.executor = InlineExecutor()
+        self.renderer = Renderer(1, executor=self.executor)
+        for target in ("render", "views"):
+            patcher = mock.patch(
+                f"posedetection.{target}.get_renderer", return_value=self.renderer
+            )
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        settings = override_settings(POSE_RENDER_DIR=f"{self.directory}/predict")
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.video = write_video(f"{self.directory}/clip.mp4", 30)
+        self.keypoints = make_keypoints(30, seed=8)
+
+    def analyze(self, **kwargs):
+        with mock.patch.object(
+            util, "get_pose_estimation", return_value=self.keypoints
+        ) as estimate:
+            data = pipeline.analyze_video(self.video, "squat", **kwargs)
+        return data, estimate
+
+    def test_render_video_keeps_every_frame(self):
+        output = render_video(
+            self.video, self.keypoints[1::2], f"{self.directory}/out.mp4", stride=2
+        )
+        capture = cv2.VideoCapture(output)
+        self.assertEqual(int(capture.get(cv2.CAP_PROP_FRAME_COUNT)), 30)
+        self.assertEqual(int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)), 320)
+        capture.release()
+
+    def test_warnings_do_not_wait_for_rendering(self):
+        with mock.patch.object(util, "upload_video") as upload:
+            data, _ = self.analyze()
+        upload.assert_not_called()
+        self.assertIsNone(data["url"])
+        self.assertNotIn("keypoints", data)
+
+        response = self.client.get(data["video_url"])
+        self.assertEqual(response.status_code, 202)
+
+        with mock.patch.object(
+            util, "upload_video", return_value="https://r2/rendered.mp4"
+        ) as upload:
+            self.executor.run_all()
+        self.assertTrue(upload.call_args[0][0].endswith(".mp4"))
+
+        response = self.client.get(data["video_url"])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["url"], "https://r2/rendered.mp4")
+
+        # A re-upload of the same clip gets the rendered URL straight away
+        data, estimate = self.analyze()
+        estimate.assert_not_called()
+        self.assertEqual(data["url"], "https://r2/rendered.mp4")
+
+    def test_failed_render_is_not_retried_on_every_poll(self):
+        data, _ = self.analyze()
+        self.assertEqual(self.client.get(data["video_url"]).status_code, 202)
+
+        with mock.patch.object(
+            util, "upload_video", side_effect=RuntimeError("R2 is down")
+        ):
+            with self.assertLogs("posedetection.render", "ERROR"):
+                with self.assertRaises(RuntimeError):
+                    self.executor.run_all()
+        self.executor.calls = []
+
+        response = self.client.get(data["video_url"])
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(self.executor.calls, [])
+
+        # Uploading the clip again gives it another try
+        self.analyze()
+        self.assertEqual(self.client.get(data["video_url"]).status_code, 202)
+        self.assertEqual(len(self.executor.calls), 1)
+
+    @override_settings(POSE_RENDER_EAGER=True)
+    def test_eager_rendering(self):
+        # Rendering starts on the pool without waiting for a poll
+        data, _ = self.analyze()
+        self.assertIsNone(data["url"])
+        self.assertEqual(len(self.executor.calls), 1)
+
+        with mock.patch.object(
+            util, "upload_video", return_value="https://r2/eager.mp4"
+        ):
+            self.executor.run_all()
+        response = self.client.get(data["video_url"])
+        self.assertEqual(response.json()["url"], "https://r2/eager.mp4")
+
+    def test_renders_on_the_pool_without_a_cache(self):
+        # There's no entry to poll for, so the response waits for the pool
+        self.cache.max_bytes = 0
+        threads = []
+
+        def upload(*args, **kwargs):
+            threads.append(threading.current_thread().name)
+            return "https://r2/uncached.mp4"
+
+        renderer = Renderer(1)
+        self.addCleanup(renderer.executor.shutdown)
+        with mock.patch.object(util, "upload_video", side_effect=upload):
+            with mock.patch.object(render, "get_renderer", return_value=renderer):
+                data, _ = self.analyze()
+        self.assertEqual(data["url"], "https://r2/uncached.mp4")
+        self.assertTrue(threads[0].startswith("posedetection-render"))
+
+    def test_raw_keypoints(self):
+        self.keypoints[3, 5] = np.nan
+        data, _ = self.analyze(include_keypoints=True)
+        self.assertEqual(len(data["keypoints"]), 30)
+        self.assertEqual(data["keypoints"][3][5], [None, None, None])
+        json.dumps(data)
+
+    def test_rep_summaries(self):
+        self.keypoints = make_keypoints(300, reps=3, seed=8)
+        data, _ = self.analyze()
+        self.assertEqual(len(data["reps"]), 3)
+        self.assertEqual(
+            sum(rep["warning_count"] for rep in data["reps"]),
+            len(data["warning_frames"]),
+        )
+
+        data, _ = self.analyze(per_rep=True)
+        self.assertNotIn("warning_frames", data)
+        self.assertEqual(len(data["reps"]), 3)
+        json.dumps(data)
+
+    def test_shutdown_waits_for_renders_in_flight(self):
+        renderer = Renderer(1)
+        started = threading.Event()
+
+        def render_and_upload(key, entry, background):
+            started.set()
+            time.sleep(0.2)
+            return "https://r2/rendered.mp4"
+
+        with mock.patch.object(render, "render_and_upload", render_and_upload):
+            future = renderer.request("a")
+            started.wait(5)
+            with self.assertLogs("posedetection.render", "WARNING"):
+                self.assertFalse(renderer.shutdown(0))
+            self.assertTrue(renderer.shutdown(5))
+        self.assertEqual(future.result(), "https://r2/rendered.mp4")
+
+    def test_unknown_video(self):
+        self.assertEqual(self.client.get("/check-form/video/nope").status_code, 404)
+        response = self.client.get(f"/check-form/video/{'0' * 64}")
+        self.assertEqual(response.status_code, 404)
+
+
+# ffprobe's packets for six frames in decode order, B-frames shown after the
+# frames they depend on
+PROBED_PACKETS = [
+    (0.0, 48, "K__"),
+    (0.1, 900, "___"),
+    (0.05, 1200, "___"),
+    (0.15, 1300, "___"),
+    (0.2, 1400, "K__"),
+    (0.25, 2100, "___"),
+]
+
+
+def fake_index(path, fps):
+    # What keyframe_index gives for PROBED_PACKETS
+    return {
+        "fps": fps,
+        "frames": 6,
+        "bytes": 2400,
+        "header_bytes": 48,
+        "keyframes": {"frame": [0, 4], "time": [0.0, 0.2], "byte": [48, 1400]},
+    }
+
+
+class TranscodeTests(SimpleTestCase):
+    def test_keyframe_index(self):
+        probed = {
+            "packets": [
+                {"pts_time": str(time), "pos": str(pos), "flags": flags}
+                for time, pos, flags in PROBED_PACKETS
+            ]
+        }
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(b"\0" * 2400)
+            f.flush()
+            with mock.patch.object(transcode, "run", return_value=json.dumps(probed)):
+                index = transcode.keyframe_index(f.name, 20)
+        self.assertEqual(index, fake_index(f.name, 20))
+
+    def test_seek_points(self):
+        points = transcode.seek_points(fake_index("", 20), [0, 3, 5])
+        self.assertEqual(
+            points,
+            {
+                0: {"keyframe": 0, "time": 0.0, "byte_range": [48, 1399]},
+                3: {"keyframe": 0, "time": 0.0, "byte_range": [48, 1399]},
+                5: {"keyframe": 4, "time": 0.2, "byte_range": [1400, 2399]},
+            },
+        )
+
+    def test_disabled_without_ffmpeg(self):
+        with override_settings(POSE_FFMPEG="/nonexistent/ffmpeg"):
+            self.assertFalse(transcode.enabled())
+        with override_settings(POSE_TRANSCODE=False):
+            self.assertFalse(transcode.enabled())
+
+    def test_with_ffmpeg(self):
+        if not shutil.which(settings.POSE_FFMPEG) or not shutil.which(
+            settings.POSE_FFPROBE
+        ):
+            self.skipTest("ffmpeg is not installed")
+        with tempfile.TemporaryDirectory() as directory:
+            source = write_video(f"{directory}/source.mp4", 180, fps=30)
+            output = transcode.transcode(source, f"{directory}/web.mp4", 30)
+            with open(output, "rb") as f:
+                data = f.read()
+            # Faststart puts the index before the frames
+            self.assertLess(data.index(b"moov"), data.index(b"mdat"))
+
+            index = transcode.keyframe_index(output, 30)
+            self.assertEqual(index["frames"], 180)
+            self.assertEqual(index["keyframes"]["frame"], [0, 30, 60, 90, 120, 150])
+            self.assertEqual(index["keyframes"]["time"], [0, 1, 2, 3, 4, 5])
+            offsets = index["keyframes"]["byte"]
+            self.assertEqual(offsets, sorted(offsets))
+            self.assertEqual(index["header_bytes"], data.index(b"mdat") + 4)
+
+            # Frame 100 with POSE_CLIP_SECONDS either side, from the keyframe
+            # before 100 - 45
+            clip = transcode.cut_clip(output, f"{directory}/clip.mp4", 100, 30)
+            capture = cv2.VideoCapture(clip)
+            frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+            capture.release()
+            self.assertGreaterEqual(frames, 90)
+            self.assertLess(frames, 180)
+
+
+class TranscodeRenderTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.cache = PoseCache(f"{self.directory}/cache", max_bytes=10 * 2**20)
+        self.executor = InlineExecutor()
+        env = mock.patch.dict(
+            os.environ,
+            {
+                "AWS_DEFAULT_REGION": "us-east-1",
+                "R2_ACCESS_KEY_ID": "testing",
+                "R2_SECRET_ACCESS_KEY": "testing",
+                "R2_PUBLIC_ENDPOINT": "https://media.example.com",
+            },
+        )
+        env.start()
+        self.addCleanup(env.stop)
+        os.environ.pop("R2_CONNECTION_URL", None)
+        aws = mock_aws()
+        aws.start()
+        self.addCleanup(aws.stop)
+        self.s3 = boto3.client("s3")
+        self.s3.create_bucket(Bucket="howsmyform")
+
+        # ffmpeg stand-ins, so the flow is tested whether or not it's installed
+        self.cut = mock.Mock(side_effect=self.cut_clip)
+        for target, name, value in (
+            ("pipeline", "get_cache", mock.Mock(return_value=self.cache)),
+            ("render", "get_cache", mock.Mock(return_value=self.cache)),
+            ("views", "get_cache", mock.Mock(return_value=self.cache)),
+            (
+                "render",
+                "get_renderer",
+                mock.Mock(return_value=Renderer(1, executor=self.executor)),
+            ),
+            ("util", "_s3_client", None),
+            ("transcode", "enabled", mock.Mock(return_value=True)),
+            ("transcode", "transcode", mock.Mock(side_effect=self.transcode)),
+            ("transcode", "keyframe_index", mock.Mock(side_effect=fake_index)),
+            ("transcode", "cut_clip", self.cut),
+        ):
+            patcher = mock.patch(f"posedetection.{target}.{name}", value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch("posedetection.views.get_renderer", render.get_renderer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        settings = override_settings(POSE_RENDER_DIR=f"{self.directory}/predict")
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.video = write_video(f"{self.directory}/clip.mp4", 6)
+
+    def transcode(self, source_path, output_path, fps):
+        shutil.copy(source_path, output_path)
+        return output_path
+
+    def cut_clip(self, source_path, output_path, frame, fps):
+        with open(output_path, "wb") as f:
+            f.write(b"clip")
+        return output_path
+
+    def analyze(self, warning_frames):
+        with mock.patch.object(
+            util, "get_pose_estimation", return_value=make_keypoints(6)
+        ), mock.patch.object(
+            pipeline,
+            "check_features",
+            return_value=(warning_frames, ["Back too bent"] * len(warning_frames)),
+        ):
+            return pipeline.analyze_video(self.video, "squat")
+
+    def test_renders_web_rendition_sidecar_and_clips(self):
+        data = self.analyze([1, 5])
+        key = data["video_url"].split("/")[-1]
+        self.assertEqual(self.client.get(data["video_url"]).status_code, 202)
+        self.executor.run_all()
+
+        media = self.client.get(data["video_url"]).json()
+        base = "https://media.example.com/howsmyform"
+        self.assertEqual(media["url"], f"{base}/{key}.mp4")
+        self.assertEqual(media["index_url"], f"{base}/{key}.index.json")
+        self.assertEqual(
+            media["clips"], {"1": f"{base}/{key}-1.mp4", "5": f"{base}/{key}-5.mp4"}
+        )
+        self.assertEqual(media["seek"]["5"]["byte_range"], [1400, 2399])
+        head = self.s3.head_object(Bucket="howsmyform", Key=f"{key}.index.json")
+        self.assertEqual(head["ContentType"], "application/json")
+        self.s3.head_object(Bucket="howsmyform", Key=f"{key}-5.mp4")
+
+        # Another analysis of the same clip only needs its new warnings cut
+        self.cut.reset_mock()
+        self.analyze([1, 3])
+        self.executor.run_all()
+        self.assertEqual([call.args[2] for call in self.cut.call_args_list], [3])
+        media = self.client.get(data["video_url"]).json()
+        self.assertEqual(sorted(media["clips"]), ["1", "3", "5"])
+
+    def test_failed_clip_keeps_the_video_and_other_clips(self):
+        def cut_clip(source_path, output_path, frame, fps):
+            if frame == 1:
+                raise subprocess.CalledProcessError(1, "ffmpeg")
+            return self.cut_clip(source_path, output_path, frame, fps)
+
+        self.cut.side_effect = cut_clip
+        data = self.analyze([1, 5])
+        self.client.get(data["video_url"])
+        with self.assertLogs("posedetection.render", "ERROR"):
+            self.executor.run_all()
+
+        media = self.client.get(data["video_url"]).json()
+        self.assertTrue(media["url"].endswith(".mp4"))
+        self.assertEqual(sorted(media["clips"]), ["5"])
+        # Polls don't retry the clip, but uploading the video again does
+        self.assertEqual(self.executor.calls, [])
+        self.cut.side_effect = self.cut_clip
+        self.analyze([1, 5])
+        self.client.get(data["video_url"])
+        self.executor.run_all()
+        media = self.client.get(data["video_url"]).json()
+        self.assertEqual(sorted(media["clips"]), ["1", "5"])
+
+
+class TrackTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_round_trip_memory_mapped(self):
+        keypoints = make_keypoints(50, seed=9)
+        write_track(f"{self.directory}/clip", keypoints, {"fps": 30, "stride": 2})
+        loaded, meta = read_track(f"{self.directory}/clip", mmap_mode="r")
+
+        self.assertIsInstance(loaded, np.memmap)
+        self.assertEqual(loaded.dtype, np.float32)
+        np.testing.assert_array_equal(loaded, keypoints)
+        self.assertEqual(meta, {"fps": 30, "stride": 2})
+
+    def test_pose_estimation_writes_track(self):
+        video = write_video(f"{self.directory}/lift.mp4", 12, fps=24)
+        keypoints = make_keypoints(12, seed=10)
+        pool = ModelPool("pose.pt", loader=lambda name: FakePoseModel(keypoints))
+        tracks = f"{self.directory}/tracks"
+        with override_settings(POSE_TRACK_DIR=tracks):
+            with mock.patch("posedetection.util.get_pool", return_value=pool):
+                util.get_pose_estimation(video)
+
+        self.assertEqual(find_tracks(tracks), [f"{tracks}/lift"])
+        stored, meta = read_track(f"{tracks}/lift")
+        np.testing.assert_array_equal(stored, keypoints)
+        self.assertEqual(meta["fps"], 24)
+        self.assertEqual(meta["stride"], 1)
+
+    def test_tracks_of_dotted_names_are_kept_apart(self):
+        pool = ModelPool("pose.pt", loader=lambda name: FakePoseModel())
+        tracks = f"{self.directory}/tracks"
+        with override_settings(POSE_TRACK_DIR=tracks):
+            with mock.patch("posedetection.util.get_pool", return_value=pool):
+                for name in ("IMG.2024.01.mp4", "IMG.2024.02.mp4"):
+                    video = write_video(f"{self.directory}/{name}", 6)
+                    util.get_pose_estimation(video)
+                # The pipeline names tracks by the upload's digest
+                cache = PoseCache(f"{self.directory}/cache", 0)
+                with mock.patch("posedetection.pipeline.get_cache", return_value=cache):
+                    pipeline.estimate_pose(video, digest="abc123")
+
+        self.assertEqual(
+            find_tracks(tracks),
+            [f"{tracks}/{name}" for name in ("IMG.2024.01", "IMG.2024.02", "abc123")],
+        )
+
+    def test_reanalyze_command_matches_check_form(self):
+        tracks = {f"side{seed}": make_keypoints(300, seed=seed) for seed in range(2)}
+        tracks["front"] = turn(make_keypoints(300, seed=2), 90)
+        for name, keypoints in tracks.items():
+            write_track(f"{self.directory}/{name}", keypoints, {"fps": 50})
+
+        output = f"{self.directory}/results.jsonl"
+        call_command(
+            "reanalyze",
+            self.directory,
+            movement=["squat", "bench"],
+            workers=2,
+            output=output,
+            stderr=StringIO(),
+        )
+        with open(output) as f:
+            results = [json.loads(line) for line in f]
+
+        self.assertEqual(len(results), 6)
+        for result in results:
+            movement = result["movement"]
+            view = "front" if result["track"] == "front" else "side"
+            self.assertEqual(result["view"], view)
+            # Squats are checked from the side and bench presses from the
+            # front; check-form answers 422 for the others
+            if (movement == "squat") != (view == "side"):
+                self.assertCountEqual(
+                    result["supported_views"], rules.MOVEMENTS[movement].views
+                )
+                self.assertNotIn("warning_frames", result)
+                continue
+            frames, messages = pipeline.check_keypoints(
+                tracks[result["track"]], movement, 50, view=view
+            )
+            self.assertEqual(result["warning_frames"], frames)
+            self.assertEqual(result["warning_messages"], messages)
+
+
+class KeypointBatcher:
+    # Hands out the rows of a keypoint sequence, one per submitted frame
+    def __init__(self, keypoints):
+        self.rows = iter(keypoints)
+
+    def submit(self, frame):
+        future = Future()
+        future.set_result(next(self.rows))
+        return future
+
+
+class FilterTests(SimpleTestCase):
+    def linear_motion(self, frames=20):
+        t = np.arange(frames, dtype=np.float32)[:, None]
+        keypoints = np.ones((frames, 17, 3), dtype=np.float32)
+        keypoints[..., 0] = 100 + 3 * t
+        keypoints[..., 1] = 200 - 2 * t
+        return keypoints
+
+    def test_gaps_are_interpolated(self):
+        expected = self.linear_motion()
+        keypoints = expected.copy()
+        keypoints[5:8, LEFT_KNEE] = np.nan
+        keypoints[10, RIGHT_HIP, 2] = 0.0
+
+        filled = filters.fill_gaps(keypoints)
+        np.testing.assert_allclose(filled[..., :2], expected[..., :2], rtol=1e-6)
+        self.assertTrue((filled[5:8, LEFT_KNEE, 2] == 1).all())
+        # Unlike the input, which is left untouched
+        self.assertTrue(np.isnan(keypoints[5:8, LEFT_KNEE]).all())
+
+    def test_long_and_trailing_gaps_stay_missing(self):
+        keypoints = self.linear_motion()
+        keypoints[2:8, LEFT_KNEE] = np.nan
+        keypoints[17:, LEFT_ANKLE] = np.nan
+
+        filled = filters.fill_gaps(keypoints, max_gap=5)
+        self.assertTrue(np.isnan(filled[2:8, LEFT_KNEE, :2]).all())
+        self.assertTrue(np.isnan(filled[17:, LEFT_ANKLE, :2]).all())
+
+    def test_unsure_detections_are_blended(self):
+        keypoints = self.linear_motion()
+        keypoints[4, LEFT_KNEE] = (0, 0, 0.25)
+
+        filled = filters.fill_gaps(keypoints, min_confidence=0.5)
+        # Halfway between the detection and the interpolated (112, 192)
+        np.testing.assert_allclose(filled[4, LEFT_KNEE, :2], (56, 96))
+
+    def test_savgol_keeps_quadratics_and_removes_noise(self):
+        t = np.arange(60, dtype=np.float64)
+        curve = 0.05 * t**2 - t + 10
+        # Away from the padded ends
+        np.testing.assert_allclose(
+            filters.savgol_smooth(curve, 7)[3:-3], curve[3:-3], atol=1e-9
+        )
+
+        noise = np.random.default_rng(0).normal(0, 1, size=(60, 4))
+        smoothed = filters.savgol_smooth(curve[:, None] + noise, 7)
+        self.assertLess((smoothed - curve[:, None]).std(), noise.std() * 0.7)
+
+    def test_short_or_missing_series_are_left_alone(self):
+        values = np.array([1.0, 5.0, 2.0])
+        np.testing.assert_array_equal(filters.savgol_smooth(values, 7), values)
+        values = np.array([1.0, np.nan, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0])
+        smoothed = filters.savgol_smooth(values, 3, polyorder=1)
+        self.assertTrue(np.isnan(smoothed[1]))
+        self.assertEqual(smoothed[5], 5.0)
+
+    def test_smoothing_window_is_odd(self):
+        with override_settings(POSE_SMOOTHING_WINDOW_SECONDS=0.2):
+            self.assertEqual(filters.smoothing_window(30), 7)
+            self.assertEqual(filters.smoothing_window(25), 5)
+            self.assertEqual(filters.smoothing_window(2), 1)
+
+    def test_checkers_smooth_when_enabled(self):
+        keypoints = add_glitches(make_keypoints(300, reps=2, noise=8, seed=3))
+        with override_settings(POSE_SMOOTHING=False):
+            raw = pipeline.check_keypoints(keypoints, "squat", 30)
+        with override_settings(POSE_SMOOTHING=True):
+            smoothed = pipeline.check_keypoints(keypoints, "squat", 30)
+        self.assertEqual(
+            raw, pipeline.check_keypoints(keypoints, "squat", 30, smooth=False)
+        )
+        self.assertLess(len(smoothed[0]), len(raw[0]))
+
+
+class TrackingTests(SimpleTestCase):
+    def test_box_iou(self):
+        a = np.array([[0, 0, 10, 10], [np.nan] * 4])
+        b = np.array([[0, 0, 10, 10], [5, 0, 15, 10], [20, 20, 30, 30]])
+        np.testing.assert_allclose(
+            tracking.box_iou(a, b), [[1, 1 / 3, 0], [0, 0, 0]], atol=1e-9
+        )
+
+    def test_ids_follow_people_whatever_the_detection_order(self):
+        people, lifter_slot = make_gym_scene(300, seed=1)
+        boxes = tracking.keypoint_boxes(people)
+        ids = tracking.assign_tracks(boxes)
+
+        self.assertEqual(ids.max(), 2)
+        self.assertEqual(len(set(ids[np.arange(300), lifter_slot])), 1)
+        # Empty slots get no ID
+        np.testing.assert_array_equal(ids < 0, np.isnan(boxes).any(axis=2))
+
+    def test_selects_the_lifter(self):
+        for seed in range(3):
+            people, lifter_slot = make_gym_scene(300, seed=seed)
+            keypoints = tracking.lifter_keypoints(people, 30)
+            np.testing.assert_array_equal(
+                keypoints, people[np.arange(300), lifter_slot]
+            )
+
+    def test_lost_tracks_expire(self):
+        boxes = np.array([[[0, 0, 10, 10]], [[np.nan] * 4], [[0, 0, 10, 10]]])
+        np.testing.assert_array_equal(
+            tracking.assign_tracks(boxes, max_age=2).ravel(), [0, -1, 0]
+        )
+        np.testing.assert_array_equal(
+            tracking.assign_tracks(boxes, max_age=1).ravel(), [0, -1, 1]
+        )
+
+    def test_nobody_detected(self):
+        people = np.full((5, 2, 17, 3), np.nan, dtype=np.float32)
+        self.assertTrue(np.isnan(tracking.lifter_keypoints(people, 30)).all())
+
+    def test_pose_estimation_checks_only_the_lifter(self):
+        people, lifter_slot = make_gym_scene(30, seed=4)
+        pool = ModelPool("pose.pt", loader=lambda name: FakePoseModel(people))
+        with tempfile.TemporaryDirectory() as directory:
+            video = write_video(f"{directory}/gym.mp4", 30)
+            with override_settings(POSE_TRACK_DIR=""), mock.patch(
+                "posedetection.util.get_pool", return_value=pool
+            ):
+                with override_settings(POSE_TRACKING=True):
+                    tracked = util.get_pose_estimation(video)
+                with override_settings(POSE_TRACKING=False):
+                    first = util.get_pose_estimation(video)
+
+        np.testing.assert_array_equal(tracked, people[np.arange(30), lifter_slot])
+        np.testing.assert_array_equal(first, people[:, 0])
+
+    def test_batcher_keeps_everyone_when_asked(self):
+        pool = ModelPool("pose.pt", loader=lambda name: FrameValueModel())
+        batcher = MicroBatcher(pool, 4, 0.001)
+        frame = np.full((8, 8, 3), 7, dtype=np.uint8)
+
+        people = batcher.submit(frame, util.compact_everyone).result(timeout=5)
+        self.assertEqual(people.shape, (settings.POSE_MAX_PEOPLE, 17, 3))
+        self.assertEqual(people[0, 0, 0], 7)
+        self.assertTrue(np.isnan(people[1:]).all())
+        self.assertEqual(batcher.submit(frame).result(timeout=5).shape, (17, 3))
+
+
+class RepTests(SimpleTestCase):
+    def angle(self, frames=600, count=5, noise=4.0, seed=0):
+        # Like a hip angle: open at rest, closing at the bottom of every rep
+        t = np.arange(frames)
+        jitter = np.random.default_rng(seed).normal(0, noise, frames)
+        return 120 + 50 * np.cos(2 * np.pi * count * t / frames) + jitter
+
+    def test_finds_every_rep_despite_jitter(self):
+        starts, peaks, ends = reps.find_reps(self.angle())
+        self.assertEqual(len(starts), 5)
+        # Reps tile the clip, meeting at the tops between them
+        self.assertEqual(starts[0], 0)
+        self.assertEqual(ends[-1], 600)
+        np.testing.assert_array_equal(starts[1:], ends[:-1])
+        # Each bottom is near the middle of a cosine period
+        np.testing.assert_allclose(peaks, 60 + 120 * np.arange(5), atol=15)
+        self.assertTrue(((starts < peaks) & (peaks < ends)).all())
+
+    def test_missing_angles_are_tolerated(self):
+        angle = self.angle()
+        angle[100:140] = np.nan
+        starts, peaks, _ = reps.find_reps(angle)
+        self.assertEqual(len(starts), 5)
+        self.assertFalse(np.isnan(angle[peaks]).any())
+
+    def test_clip_without_reps_is_one_segment(self):
+        for angle in (self.angle(count=0), np.full(50, np.nan)):
+            starts, peaks, ends = reps.find_reps(angle)
+            np.testing.assert_array_equal(starts, [0])
+            np.testing.assert_array_equal(ends, [len(angle)])
+        for part in reps.find_reps([]):
+            self.assertEqual(len(part), 0)
+
+    def test_single_rep(self):
+        starts, peaks, ends = reps.find_reps(self.angle(frames=120, count=1))
+        np.testing.assert_array_equal(starts, [0])
+        np.testing.assert_array_equal(ends, [120])
+        self.assertTrue(50 <= peaks[0] <= 70)
+
+    def test_segment_argmin(self):
+        values = np.array([5.0, 1, 3, 0, 2, 2, 9, 4])
+        np.testing.assert_array_equal(
+            reps.segment_argmin(values, [0, 4, 6], [3, 6, 8]), [1, 4, 7]
+        )
+
+    def test_deadlift_reps_start_from_the_floor(self):
+        # The hip angle is closed at rest and opens at lockout
+        angle = 240 - self.angle(count=3)
+        summaries = reps.summarize_reps("deadlift", {"hip": angle}, [], [], 30)
+        self.assertEqual(len(summaries), 3)
+        self.assertGreater(summaries[0]["peak_angle"], 150)
+
+    def test_summaries_group_warnings_by_rep(self):
+        angles = {"arm": self.angle(count=2, noise=0)}
+        summaries = reps.summarize_reps(
+            "bench",
+            angles,
+            [20, 40, 200, 500],
+            ["Flare", "Flare", "Bounce", "Flare"],
+            fps=25,
+            stride=2,
+        )
+        self.assertEqual(
+            [(s["start_frame"], s["end_frame"]) for s in summaries],
+            [(1, 599), (601, 1199)],
+        )
+        self.assertEqual(summaries[0]["seconds"], 24)
+        self.assertEqual(summaries[0]["peak_angle"], 70)
+        self.assertEqual(summaries[0]["range_of_motion"], 100)
+        self.assertEqual(
+            summaries[0]["warnings"],
+            [
+                {"message": "Flare", "count": 3, "first_frame": 20},
+                {"message": "Bounce", "count": 1, "first_frame": 200},
+            ],
+        )
+        self.assertEqual(summaries[1]["warning_count"], 0)
+
+
+class UploadHandler(BaseHTTPRequestHandler):
+    # Stands in for /check-form, failing uploads of the "bench" movement
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        with self.server.lock:
+            self.server.bodies.append(body)
+        self.send_response(400 if b"bench" in body else 200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ProductionServerTests(SimpleTestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), UploadHandler)
+        self.server.bodies = []
+        self.server.lock = threading.Lock()
+        threading.Thread(
+            target=self.server.serve_forever, args=(0.05,), daemon=True
+        ).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/check-form"
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.video = os.path.join(directory, "clip.mp4")
+        with open(self.video, "wb") as f:
+            f.write(b"video")
+
+    def test_run_load(self):
+        report = run_load(
+            self.url, self.video, "squat", concurrency=3, requests_count=7
+        )
+        self.assertEqual(report["requests"], 7)
+        self.assertEqual(report["errors"], 0)
+        latency = report["latency"]
+        self.assertTrue(0 <= latency["p50"] <= latency["p95"] <= latency["max"])
+        # Every upload is distinct, so none would be answered from the cache
+        self.assertEqual(len(set(self.server.bodies)), 7)
+        self.assertTrue(all(b"video" in body for body in self.server.bodies))
+
+    def test_run_load_counts_errors(self):
+        report = run_load(
+            self.url, self.video, "bench", concurrency=2, requests_count=4
+        )
+        self.assertEqual(report["errors"], 4)
+
+    def test_serve_runs_the_production_settings(self):
+        # As manage.py leaves it by the time loadtest runs
+        environ = mock.patch.dict(os.environ, DJANGO_SETTINGS_MODULE="server.settings")
+        with tempfile.TemporaryFile() as log, environ:
+            process, url = serve(1, 2, log=log)
+            try:
+                response = requests.get(f"{url}/no-such-page", timeout=60)
+            finally:
+                process.terminate()
+                process.wait(60)
+        self.assertEqual(response.status_code, 404)
+        # Rather than DEBUG's page listing every URL pattern
+        self.assertNotIn("URLconf", response.text)
+
+    def gunicorn_config(self, **env):
+        path = os.path.join(settings.BASE_DIR, "gunicorn.conf.py")
+        with mock.patch.dict(os.environ, env):
+            for name in ("POSE_INTRA_OP_THREADS", "OMP_NUM_THREADS"):
+                os.environ.pop(name, None)
+            config = runpy.run_path(path)
+            config["environ"] = dict(os.environ)
+        return config
+
+    def test_gunicorn_config(self):
+        config = self.gunicorn_config(WEB_CONCURRENCY="3")
+        self.assertEqual(config["workers"], 3)
+        self.assertEqual(config["wsgi_app"], "server.asgi:application")
+        # The worker class gunicorn will load, without uvicorn.workers'
+        # deprecation warning
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", DeprecationWarning)
+            worker = load_class(config["worker_class"])
+        self.assertEqual(worker.__module__.split(".")[0], "uvicorn_worker")
+        self.assertTrue(config["preload_app"])
+        threads = config["intra_op_threads"](config["available_cpus"](), 3)
+        self.assertEqual(config["environ"]["POSE_INTRA_OP_THREADS"], str(threads))
+        self.assertEqual(config["environ"]["OMP_NUM_THREADS"], str(threads))
+
+        config = self.gunicorn_config(
+            GUNICORN_WORKER_CLASS="gthread", GUNICORN_THREADS="2"
+        )
+        self.assertEqual(config["wsgi_app"], "server.wsgi:application")
+        self.assertEqual(config["threads"], 2)
+
+    def test_worker_exit_finishes_background_work(self):
+        config = self.gunicorn_config()
+        worker = mock.Mock()
+        worker.cfg.graceful_timeout = config["graceful_timeout"]
+        with mock.patch.object(jobs, "shutdown", return_value=False) as shutdown:
+            config["worker_exit"](mock.Mock(), worker)
+        shutdown.assert_called_once_with(config["graceful_timeout"] - 5)
+        worker.log.warning.assert_called_once()
+
+    def test_intra_op_threads(self):
+        config = self.gunicorn_config()
+        self.assertEqual(config["intra_op_threads"](8, 2), 4)
+        self.assertEqual(config["intra_op_threads"](8, 3), 2)
+        self.assertEqual(config["intra_op_threads"](1, 4), 1)
+
+    def test_production_settings_need_a_secret_key(self):
+        self.addCleanup(sys.modules.pop, "server.production", None)
+        with mock.patch.dict(os.environ):
+            os.environ.pop("SECRET_KEY", None)
+            with self.assertRaises(ImproperlyConfigured):
+                importlib.import_module("server.production")
+
+        sys.modules.pop("server.production", None)
+        with mock.patch.dict(
+            os.environ, SECRET_KEY="secret", DJANGO_ALLOWED_HOSTS="a.com,b.com"
+        ):
+            production = importlib.import_module("server.production")
+        self.assertFalse(production.DEBUG)
+        self.assertEqual(production.ALLOWED_HOSTS, ["a.com", "b.com"])
+        self.assertFalse(production.POSE_MODEL_WARMUP)
+
+
+class CountingPoseModel(FakePoseModel):
+    # Counts the frames it has produced keypoints for
+    def __init__(self, keypoints):
+        super().__init__(keypoints)
+        self.frames = 0
+
+    def _results(self, source, vid_stride=1):
+        for result in super()._results(source, vid_stride):
+            self.frames += 1
+            yield result
+
+
+class CameraViewTests(SimpleTestCase):
+    def test_classifies_views(self):
+        for degrees, view in (
+            (0, "side"),
+            (10, "side"),
+            (30, "oblique"),
+            (45, "oblique"),
+            (70, "front"),
+            (90, "front"),
+        ):
+            with self.subTest(degrees=degrees):
+                keypoints = turn(make_keypoints(60, reps=1, seed=1), degrees)
+                self.assertEqual(camera.classify_view(keypoints), view)
+
+    def test_mirrored_and_lying_down(self):
+        keypoints = make_keypoints(60, reps=1, seed=2)
+        mirrored = keypoints.copy()
+        mirrored[..., 0] = 640 - mirrored[..., 0]
+        self.assertEqual(camera.classify_view(mirrored), "side")
+        # A bench press seen from the side has the torso across the frame
+        lying = keypoints[..., [1, 0, 2]]
+        self.assertEqual(camera.classify_view(lying), "side")
+        self.assertEqual(
+            camera.classify_view(turn(keypoints, 90)[..., [1, 0, 2]]), "front"
+        )
+
+    def test_ignores_glitches_and_unsure_frames(self):
+        keypoints = make_keypoints(60, reps=1, seed=3)
+        keypoints[::10] = turn(keypoints[::10], 90)
+        keypoints[5::10, :, 2] = 0.1
+        keypoints[7::10] = np.nan
+        self.assertEqual(camera.classify_view(keypoints), "side")
+
+    def test_nobody_seen(self):
+        self.assertIsNone(camera.classify_view(np.empty((0, 17, 3))))
+        unsure = make_keypoints(30)
+        unsure[..., 2] = 0.1
+        self.assertIsNone(camera.classify_view(unsure))
+
+    @override_settings(POSE_VIEW_SECONDS=1)
+    def test_detects_from_the_start_of_the_clip(self):
+        keypoints = np.concatenate(
+            [make_keypoints(30, reps=1), turn(make_keypoints(90, seed=1), 90)]
+        )
+        self.assertEqual(camera.detect_view(keypoints, 30), "side")
+        self.assertEqual(camera.detect_view(keypoints[30:], 30), "front")
+
+    def test_rules_are_skipped_for_views_they_dont_apply_to(self):
+        keypoints = make_keypoints(300, reps=2, seed=4)
+        # Leaning back at the top of the first rep
+        keypoints[140:160, [LEFT_SHOULDER, RIGHT_SHOULDER], 0] -= 80
+        features_ = features.extract_features(keypoints[..., :2])
+        _, messages = rules.check("deadlift", *features_)
+        self.assertIn("Make sure not to lean back too much", messages)
+        _, messages = rules.check("deadlift", *features_, view="oblique")
+        self.assertNotIn("Make sure not to lean back too much", messages)
+        self.assertTrue(messages)
+        self.assertEqual(rules.check("squat", *features_, view="front"), ([], []))
+
+    def test_supported_views(self):
+        self.assertEqual(rules.MOVEMENTS["squat"].views, {"side", "oblique"})
+        self.assertEqual(rules.MOVEMENTS["bench"].views, {"front", "oblique"})
+        error = camera.UnsupportedView("bench", "side", {"oblique", "front"})
+        self.assertEqual(error.supported, ["front", "oblique"])
+        self.assertEqual(
+            str(error),
+            "A bench can't be checked when filmed from the side, "
+            "try filming from the front or an angle",
+        )
+
+    def analyze(self, keypoints, movement, frames=150):
+        model = CountingPoseModel(keypoints)
+        pool = ModelPool("pose.pt", loader=lambda name: model)
+        with tempfile.TemporaryDirectory() as directory:
+            video = write_video(f"{directory}/lift.mp4", frames)
+            cache = PoseCache(f"{directory}/cache", max_bytes=10 * 2**20)
+            with override_settings(
+                POSE_VIEW_SECONDS=1, POSE_TRACK_DIR="", POSE_RENDER_EAGER=False
+            ), mock.patch("posedetection.util.get_pool", return_value=pool), mock.patch(
+                "posedetection.pipeline.get_cache", return_value=cache
+            ):
+                try:
+                    return pipeline.analyze_video(video, movement, batched=False)
+                finally:
+                    self.frames = model.frames
+
+    def test_unsupported_view_is_rejected_early(self):
+        with self.assertRaises(camera.UnsupportedView) as raised:
+            self.analyze(make_keypoints(150, seed=5), "bench")
+        self.assertEqual(raised.exception.view, "side")
+        # Only the first second was analysed
+        self.assertLessEqual(self.frames, 31)
+
+    def test_supported_view_is_analysed(self):
+        keypoints = turn(make_keypoints(150, seed=6), 30)
+        data = self.analyze(keypoints, "deadlift")
+        self.assertEqual(self.frames, 150)
+        self.assertEqual(data["view"], "oblique")
+        self.assertNotIn(
+            "Make sure not to lean back too much", data["warning_messages"]
+        )
+
+        with override_settings(POSE_VIEW_DETECTION=False):
+            data = self.analyze(make_keypoints(150, seed=5), "bench")
+        self.assertIsNone(data["view"])
+
+
+class RuleEngineTests(SimpleTestCase):
+    def clips(self):
+        for seed in range(4):
+            for noise in (2.0, 25.0):
+                keypoints = make_keypoints(300, reps=4, noise=noise, seed=seed)
+                yield f"seed {seed} noise {noise}", keypoints
+        mirrored = make_keypoints(300, seed=4)
+        mirrored[..., 0] = 640 - mirrored[..., 0]
+        yield "facing left", mirrored
+        missing = make_keypoints(300, seed=5)
+        missing[::7] = np.nan
+        yield "missing people", missing
+        yield "nobody first", np.concatenate([missing[7:8], missing])
+        yield "one frame", make_keypoints(1, seed=6)
+
+    def test_matches_per_frame_checkers(self):
+        for name, keypoints in self.clips():
+            features_ = features.extract_features(keypoints[..., :2])
+            for movement in pipeline.MOVEMENTS:
+                for fps in (30, 50):
+                    with self.subTest(name, movement=movement, fps=fps):
+                        self.assertEqual(
+                            rules.check(movement, *features_, fps),
+                            PER_FRAME_CHECKERS[movement](*features_, fps),
+                        )
+
+    def test_empty_clip(self):
+        features_ = features.extract_features(np.empty((0, 17, 2)))
+        for movement in pipeline.MOVEMENTS:
+            self.assertEqual(rules.check(movement, *features_), ([], []))
+
+    def test_reference_frame(self):
+        self.assertEqual(rules.reference_frame(np.array([100.0, 150, 120, 170])), 3)
+        # Nothing beats a missing first angle
+        self.assertEqual(rules.reference_frame(np.array([np.nan, 150, 170])), 0)
+
+    def test_new_movement(self):
+        # A curl with the elbows drifting forward of where they started
+        keypoints = np.repeat(make_keypoints(1, noise=0), 90, axis=0)
+        keypoints[60:, [LEFT_ELBOW, RIGHT_ELBOW], 0] += 50
+        curl = rules.Movement(
+            "arm_angle",
+            [
+                rules.Rule(
+                    "Keep your elbows still",
+                    rules.Measure("elbow_drift") > rules.Reference("back_length") / 4,
+                )
+            ],
+        )
+        measurements = {
+            "elbow_drift": lambda context: np.abs(
+                context.measure("elbow_x") - context.measure("elbow_x")[0]
+            )
+        }
+        with mock.patch.dict(rules.MOVEMENTS, curl=curl), mock.patch.dict(
+            rules.MEASUREMENTS, measurements
+        ):
+            features_ = features.extract_features(keypoints[..., :2])
+            self.assertEqual(
+                rules.check("curl", *features_),
+                ([60, 85], ["Keep your elbows still"] * 2),
+            )
+
+    def test_unknown_names(self):
+        features_ = features.extract_features(make_keypoints(10)[..., :2])
+        with self.assertRaises(ValueError):
+            rules.check("curl", *features_)
+        movement = rules.Movement(
+            "hip_angle", [rules.Rule("Never", rules.Measure("grip_width") > 0)]
+        )
+        with self.assertRaises(KeyError):
+            movement.check(*features_)
+
+
+class StreamingCheckerTests(SimpleTestCase):
+    def sequences(self):
+        for seed in range(4):
+            for noise in (2.0, 25.0):
+                keypoints = make_keypoints(300, reps=4, noise=noise, seed=seed)
+                yield f"seed {seed} noise {noise}", keypoints
+        mirrored = make_keypoints(300, seed=4)
+        mirrored[..., 0] = 640 - mirrored[..., 0]
+        yield "facing left", mirrored
+        missing = make_keypoints(300, seed=5)
+        missing[::7] = np.nan
+        yield "missing people", missing
+        yield "nobody first", np.concatenate([missing[7:8], missing])
+        yield "one frame", make_keypoints(1, seed=6)
+
+    def online(self, keypoints, movement, fps):
+        checker = StreamingChecker(movement, fps)
+        provisional = []
+        for row in keypoints:
+            provisional.extend(checker.push(row))
+        return checker.finalize(), provisional
+
+    def test_finalize_matches_batch_checkers(self):
+        for name, keypoints in self.sequences():
+            for movement in pipeline.MOVEMENTS:
+                for fps in (30, 50):
+                    with self.subTest(name, movement=movement, fps=fps):
+                        final, _ = self.online(keypoints, movement, fps)
+                        expected = pipeline.check_keypoints(
+                            keypoints, movement, fps, smooth=False
+                        )
+                        self.assertEqual(final, expected)
+
+    def test_finalize_mid_set(self):
+        keypoints = make_keypoints(400, seed=7)
+        checker = StreamingChecker("deadlift", 30)
+        for i, row in enumerate(keypoints):
+            checker.push(row)
+            if i in (99, 249):
+                self.assertEqual(
+                    checker.finalize(),
+                    pipeline.check_keypoints(
+                        keypoints[: i + 1], "deadlift", 30, smooth=False
+                    ),
+                )
+        self.assertEqual(
+            checker.finalize(),
+            pipeline.check_keypoints(keypoints, "deadlift", 30, smooth=False),
+        )
+
+    def test_provisional_warnings_come_before_the_end(self):
+        keypoints = make_keypoints(300, reps=4, seed=8)
+        for movement in pipeline.MOVEMENTS:
+            (final_frames, _), provisional = self.online(keypoints, movement, 30)
+            self.assertTrue(final_frames, movement)
+            self.assertTrue(provisional, movement)
+            self.assertLess(provisional[0][0], 150, movement)
+
+    def test_finalize_matches_batch_checkers_for_each_view(self):
+        keypoints = make_keypoints(300, reps=2, seed=4)
+        keypoints[140:160, [LEFT_SHOULDER, RIGHT_SHOULDER], 0] -= 80
+        features_ = features.extract_features(keypoints[..., :2])
+        for movement in pipeline.MOVEMENTS:
+            for view in camera.VIEWS:
+                with self.subTest(movement=movement, view=view):
+                    checker = StreamingChecker(movement, 30, view)
+                    provisional = []
+                    for row in keypoints:
+                        provisional.extend(checker.push(row))
+                    final = checker.finalize()
+                    self.assertEqual(final, rules.check(movement, *features_, 30, view))
+                    allowed = {
+                        rule.message
+                        for rule in rules.MOVEMENTS[movement].applicable(view)
+                    }
+                    self.assertTrue(
+                        allowed.issuperset(message for _, message in provisional)
+                    )
+
+    def test_new_movement(self):
+        # Lifts added to rules.MOVEMENTS stream without any code of their own
+        keypoints = np.repeat(make_keypoints(1, noise=0), 90, axis=0)
+        keypoints[60:, [LEFT_ELBOW, RIGHT_ELBOW], 0] += 50
+        curl = rules.Movement(
+            "arm_angle",
+            [
+                rules.Rule(
+                    "Keep your elbows still",
+                    abs(rules.Measure("elbow_x") - rules.Reference("elbow_x"))
+                    > rules.Reference("back_length") / 4,
+                )
+            ],
+        )
+        with mock.patch.dict(rules.MOVEMENTS, curl=curl):
+            final, provisional = self.online(keypoints, "curl", 30)
+            features_ = features.extract_features(keypoints[..., :2])
+            self.assertEqual(final, rules.check("curl", *features_, 30))
+        self.assertTrue(final[0])
+        # Live, elbows are judged against where they were at the straightest
+        # frame so far
+        self.assertEqual(provisional[0], (60, "Keep your elbows still"))
+
+    def test_nothing_pushed(self):
+        for movement in rules.MOVEMENTS:
+            self.assertEqual(StreamingChecker(movement).finalize(), ([], []))
+
+    def test_benchmark_uses_less_memory_than_batch(self):
+        for row in bench_streaming_checkers(frames=(1000,)):
+            self.assertTrue(row["identical"])
+            self.assertLess(row["online_peak_bytes"], row["batch_peak_bytes"])
+
+
+class LiveAnalysisTests(SimpleTestCase):
+    def run_socket(self, query, messages, keypoints=()):
+        events = [{"type": "websocket.connect"}] + messages
+        events.append({"type": "websocket.disconnect"})
+        events = iter(events)
+        sent = []
+
+        async def receive():
+            return next(events)
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {"type": "websocket", "path": live.PATH, "query_string": query}
+        batcher = KeypointBatcher(keypoints)
+        with mock.patch("posedetection.live.get_batcher", return_value=batcher):
+            asyncio.run(live.websocket_application(scope, receive, send))
+        return sent
+
+    def frame_message(self):
+        ok, data = cv2.imencode(".png", np.zeros((16, 16, 3), dtype=np.uint8))
+        return {"type": "websocket.receive", "bytes": data.tobytes()}
+
+    def test_pushes_warnings_during_the_set(self):
+        keypoints = make_keypoints(150, seed=13)
+        messages = [self.frame_message() for _ in keypoints]
+        messages.append({"type": "websocket.receive", "text": '{"type": "end"}'})
+        sent = self.run_socket(b"movement=squat&fps=30", messages, keypoints)
+
+        self.assertEqual(sent[0], {"type": "websocket.accept"})
+        replies = [json.loads(message["text"]) for message in sent[1:-1]]
+        frames, summary = replies[:-1], replies[-1]
+        self.assertEqual([reply["frame"] for reply in frames], list(range(150)))
+        warned = [reply for reply in frames if reply["warnings"]]
+        self.assertTrue(warned)
+        self.assertLess(warned[0]["frame"], 75)
+
+        expected = pipeline.check_keypoints(keypoints, "squat", 30, smooth=False)
+        self.assertEqual(summary["frames"], 150)
+        self.assertEqual(
+            (summary["warning_frames"], summary["warning_messages"]),
+            expected,
+        )
+        self.assertEqual(sent[-1], {"type": "websocket.close", "code": 1000})
+
+    @override_settings(POSE_VIEW_SECONDS=1)
+    def test_skips_rules_for_the_view(self):
+        keypoints = turn(make_keypoints(150, reps=2, seed=4), 30)
+        keypoints[70:80, [LEFT_SHOULDER, RIGHT_SHOULDER], 0] -= 80
+        messages = [self.frame_message() for _ in keypoints]
+        messages.append({"type": "websocket.receive", "text": '{"type": "end"}'})
+        sent = self.run_socket(b"movement=deadlift&fps=30", messages, keypoints)
+
+        replies = [json.loads(message["text"]) for message in sent[1:-1]]
+        summary = replies[-1]
+        self.assertEqual(summary["view"], "oblique")
+        features_ = features.extract_features(keypoints[..., :2])
+        expected = rules.check("deadlift", *features_, 30, "oblique")
+        self.assertEqual(
+            (summary["warning_frames"], summary["warning_messages"]), expected
+        )
+        # Leaning back can only be judged side-on, live or not
+        warned = [
+            warning["message"]
+            for reply in replies[:-1]
+            for warning in reply["warnings"]
+        ]
+        self.assertNotIn("Make sure not to lean back too much", warned)
+        self.assertIn(
+            "Make sure not to lean back too much",
+            rules.check("deadlift", *features_, 30)[1],
+        )
+
+    @override_settings(POSE_VIEW_SECONDS=1)
+    def test_closes_when_the_view_cant_be_checked(self):
+        keypoints = turn(make_keypoints(60, seed=1), 90)
+        messages = [self.frame_message() for _ in keypoints]
+        sent = self.run_socket(b"movement=squat&fps=30", messages, keypoints)
+
+        # Frames are answered until a second of them has told the view
+        self.assertEqual(len(sent), 1 + 29 + 2)
+        error = json.loads(sent[-2]["text"])
+        self.assertEqual(error["type"], "error")
+        self.assertEqual(error["view"], "front")
+        self.assertEqual(sent[-1], {"type": "websocket.close", "code": 4422})
+
+    def test_rejects_unknown_movement(self):
+        sent = self.run_socket(b"movement=curl", [])
+        self.assertEqual(sent, [{"type": "websocket.close", "code": 4400}])
+
+    def test_reports_undecodable_frames(self):
+        messages = [{"type": "websocket.receive", "bytes": b"not an image"}]
+        sent = self.run_socket(b"movement=bench", messages)
+        self.assertEqual(
+            json.loads(sent[1]["text"]), {"type": "error", "message": "Invalid frame"}
+        )
+
+    def test_frames_are_decoded_off_the_event_loop(self):
+        threads = []
+        imdecode = cv2.imdecode
+
+        def decode(*args):
+            threads.append(threading.current_thread())
+            return imdecode(*args)
+
+        with mock.patch("posedetection.live.cv2.imdecode", decode):
+            self.run_socket(
+                b"movement=squat", [self.frame_message()], make_keypoints(1)
+            )
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.main_thread())
+
+    def test_provisional_warnings_are_spaced_by_the_window(self):
+        keypoints = make_keypoints(400, seed=14)
+        for movement in rules.MOVEMENTS:
+            checker = StreamingChecker(movement, fps=30)
+            frames = [frame for row in keypoints for frame, _ in checker.push(row)]
+            self.assertTrue(frames, movement)
+            self.assertTrue(
+                all(
+                    b - a >= util.get_warning_window(30)
+                    for a, b in zip(frames, frames[1:])
+                )
+            )
+
+    def test_asgi_routes_websockets(self):
+        from server.asgi import application
+
+        sent = []
+
+        async def receive():
+            return {"type": "websocket.connect"}
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {"type": "websocket", "path": "/ws/other", "query_string": b""}
+        asyncio.run(application(scope, receive, send))
+        self.assertEqual(sent, [{"type": "websocket.close"}])
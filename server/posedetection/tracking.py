@@ -0,0 +1,155 @@
+import numpy as np
+from django.conf import settings
+
+# Following people across frames. Detections arrive as a (frames, people,
+# 17, 3) array, NaN-padded where fewer people were found; every step works on
+# a whole frame's (or the whole clip's) detections at once.
+
+
+def keypoint_boxes(people, min_confidence=0.5):
+    # (..., 17, 3) keypoints to (..., 4) x1, y1, x2, y2 boxes around the
+    # confident keypoints, NaN for empty slots
+    confident = people[..., 2:] >= min_confidence
+    xy = np.where(confident, people[..., :2], np.nan)
+    # fmin/fmax skip NaNs, so only slots without any keypoint stay NaN
+    return np.concatenate(
+        [np.fmin.reduce(xy, axis=-2), np.fmax.reduce(xy, axis=-2)], -1
+    )
+
+
+def box_areas(boxes):
+    return np.prod(boxes[..., 2:] - boxes[..., :2], axis=-1)
+
+
+def box_iou(a, b):
+    # Pairwise IoU of (n, 4) and (m, 4) boxes; NaN boxes overlap nothing
+    top_left = np.maximum(a[:, None, :2], b[None, :, :2])
+    bottom_right = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        overlap = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+        union = box_areas(a)[:, None] + box_areas(b)[None] - overlap
+        return np.nan_to_num(overlap / union)
+
+
+def centre_closeness(a, b):
+    # Pairwise 1 - (distance between box centres / height of the `a` box),
+    # 0 when further apart than that or for NaN boxes
+    centres_a = (a[:, :2] + a[:, 2:]) / 2
+    centres_b = (b[:, :2] + b[:, 2:]) / 2
+    distance = np.linalg.norm(centres_a[:, None] - centres_b[None], axis=2)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        closeness = 1 - distance / (a[:, 3] - a[:, 1])[:, None]
+    return np.clip(np.nan_to_num(closeness), 0, None)
+
+
+def match(iou, threshold):
+    # Pair tracks (rows) and detections (columns) that are each other's best
+    # overlap, returning each detection's track or -1
+    detections = np.arange(iou.shape[1])
+    if not len(iou):
+        return np.full(len(detections), -1)
+    best_track = iou.argmax(axis=0)
+    best_detection = iou.argmax(axis=1)
+    overlap = iou[best_track, detections]
+    matched = (best_detection[best_track] == detections) & (overlap >= threshold)
+    return np.where(matched & (overlap > 0), best_track, -1)
+
+
+class IouTracker:
+    """Gives each detected person an ID that follows them between frames.
+
+    A detection continues the track whose last box it overlaps most (and vice
+    versa) by at least `iou_threshold`. Someone moving too fast to overlap
+    their last box continues the closest leftover track instead, if they're
+    within half its height of it; anyone else starts a new track. Tracks
+    unseen for more than `max_age` frames can't be continued.
+    """
+
+    def __init__(self, iou_threshold=0.3, max_age=30):
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.frame = 0
+        self.boxes = np.empty((0, 4))
+        self.last_seen = np.empty(0, dtype=int)
+
+    def update(self, boxes):
+        # One frame's (people, 4) boxes to (people,) track IDs, -1 for empty
+        # slots
+        present = ~np.isnan(boxes).any(axis=1)
+        stale = self.frame - self.last_seen > self.max_age
+        iou = box_iou(self.boxes, boxes)
+        iou[stale] = 0
+        iou[:, ~present] = 0
+        ids = match(iou, self.iou_threshold)
+
+        closeness = centre_closeness(self.boxes, boxes)
+        closeness[stale | np.isin(np.arange(len(self.boxes)), ids)] = 0
+        closeness[:, ~present | (ids >= 0)] = 0
+        ids = np.where(ids >= 0, ids, match(closeness, 0.5))
+
+        new = present & (ids < 0)
+        ids[new] = np.arange(len(self.boxes), len(self.boxes) + new.sum())
+        self.boxes = np.concatenate([self.boxes, boxes[new]])
+        self.last_seen = np.concatenate([self.last_seen, np.zeros(new.sum(), int)])
+        self.boxes[ids[present]] = boxes[present]
+        self.last_seen[ids[present]] = self.frame
+        self.frame += 1
+        return ids
+
+
+def assign_tracks(boxes, iou_threshold=0.3, max_age=30):
+    # (frames, people, 4) boxes to (frames, people) track IDs
+    tracker = IouTracker(iou_threshold, max_age)
+    ids = np.full(boxes.shape[:2], -1)
+    for frame, frame_boxes in enumerate(boxes):
+        ids[frame] = tracker.update(frame_boxes)
+    return ids
+
+
+def select_lifter(ids, boxes):
+    """The track ID of the person doing the lift, or -1 if nobody was seen.
+
+    The lifter is usually the largest person on screen for the longest, and
+    moves up and down far more than spotters or passers-by, so tracks are
+    scored by their summed box area times how much their box's centre moves
+    vertically relative to its height.
+    """
+    seen = ids >= 0
+    if not seen.any():
+        return -1
+    track = ids[seen]
+    boxes = boxes[seen]
+    count = np.bincount(track)
+    present = count > 0
+    count = np.maximum(count, 1)
+
+    area = np.bincount(track, weights=box_areas(boxes))
+    height = np.bincount(track, weights=boxes[:, 3] - boxes[:, 1]) / count
+    centre = (boxes[:, 1] + boxes[:, 3]) / 2
+    mean = np.bincount(track, weights=centre) / count
+    variance = np.bincount(track, weights=centre**2) / count - mean**2
+    with np.errstate(invalid="ignore", divide="ignore"):
+        motion = np.sqrt(np.maximum(variance, 0)) / height
+    score = np.where(present, area * np.nan_to_num(motion), -np.inf)
+    return int(score.argmax())
+
+
+def track_keypoints(people, ids, track):
+    # (frames, 17, 3) keypoints of one track, NaN in frames it wasn't seen in
+    in_track = ids == track
+    slot = in_track.argmax(axis=1)
+    keypoints = people[np.arange(len(people)), slot]
+    keypoints[~in_track.any(axis=1)] = np.nan
+    return keypoints
+
+
+def lifter_keypoints(people, fps):
+    # Follow everyone in the clip and keep only the lifter's keypoints, so
+    # spotters and passers-by never reach the feature and checker stages
+    boxes = keypoint_boxes(people, settings.POSE_MIN_KEYPOINT_CONF)
+    ids = assign_tracks(
+        boxes,
+        settings.POSE_TRACK_IOU,
+        max(1, round(settings.POSE_TRACK_MAX_AGE_SECONDS * fps)),
+    )
+    return track_keypoints(people, ids, select_lifter(ids, boxes))
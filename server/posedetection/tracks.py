@@ -0,0 +1,49 @@
+import json
+import os
+import threading
+import numpy as np
+
+# A keypoint track is a float32 (frames, 17, 3) array of x, y and confidence
+# for the analysed person, stored as `<name>.npy` so it can be memory-mapped,
+# next to `<name>.json` holding at least the source `fps` and the analysis
+# `stride` (keypoints cover every stride-th source frame, starting from frame
+# stride - 1 like Ultralytics' vid_stride).
+
+
+def _temporary(path):
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def write_track_meta(base_path, meta):
+    meta_path = f"{base_path}.json"
+    with open(_temporary(meta_path), "w") as f:
+        json.dump(meta, f)
+    os.replace(_temporary(meta_path), meta_path)
+
+
+def write_track(base_path, keypoints, meta):
+    # Write to temporary names first so readers never see half a track
+    array_path = f"{base_path}.npy"
+    with open(_temporary(array_path), "wb") as f:
+        np.save(f, np.asarray(keypoints, dtype=np.float32))
+    os.replace(_temporary(array_path), array_path)
+    write_track_meta(base_path, meta)
+
+
+def read_track(base_path, mmap_mode=None):
+    with open(f"{base_path}.json") as f:
+        meta = json.load(f)
+    keypoints = np.load(f"{base_path}.npy", mmap_mode=mmap_mode)
+    return keypoints, meta
+
+
+def find_tracks(directory):
+    # Base paths of every complete track in `directory`, in name order
+    tracks = []
+    for name in sorted(os.listdir(directory)):
+        base, extension = os.path.splitext(name)
+        if extension == ".npy" and os.path.exists(
+            os.path.join(directory, f"{base}.json")
+        ):
+            tracks.append(os.path.join(directory, base))
+    return tracks
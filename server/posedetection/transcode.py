@@ -0,0 +1,161 @@
+import json
+import os
+import shutil
+import subprocess
+import numpy as np
+from django.conf import settings
+
+# Web renditions of annotated videos. The rendered MP4 is re-encoded with
+# ffmpeg into H.264 with the index at the front, a keyframe every
+# POSE_KEYFRAME_SECONDS and at most POSE_TRANSCODE_MAX_HEIGHT lines, so phones
+# can start playing and seek without downloading the whole file. A sidecar
+# lists every keyframe's frame, time and byte offset, and short clips are cut
+# around warning frames so clients can fetch just those seconds.
+
+
+def enabled():
+    return bool(
+        settings.POSE_TRANSCODE
+        and shutil.which(settings.POSE_FFMPEG)
+        and shutil.which(settings.POSE_FFPROBE)
+    )
+
+
+def run(args):
+    return subprocess.run(args, check=True, capture_output=True, text=True).stdout
+
+
+def transcode(source_path, output_path, fps):
+    keyint = str(max(1, round(fps * settings.POSE_KEYFRAME_SECONDS)))
+    max_height = settings.POSE_TRANSCODE_MAX_HEIGHT
+    run(
+        [
+            settings.POSE_FFMPEG,
+            "-y",
+            "-v",
+            "error",
+            "-i",
+            source_path,
+            "-vf",
+            f"scale=-2:'min({max_height},ih)'",
+            "-c:v",
+            "libx264",
+            "-preset",
+            "veryfast",
+            "-crf",
+            str(settings.POSE_TRANSCODE_CRF),
+            "-pix_fmt",
+            "yuv420p",
+            # Fixed keyframe spacing so every frame is at most one interval
+            # from a seek point and clips can be cut without re-encoding
+            "-g",
+            keyint,
+            "-keyint_min",
+            keyint,
+            "-sc_threshold",
+            "0",
+            "-threads",
+            str(settings.POSE_TRANSCODE_THREADS),
+            "-movflags",
+            "+faststart",
+            "-an",
+            output_path,
+        ]
+    )
+    return output_path
+
+
+def keyframe_index(path, fps):
+    """The frame index sidecar of a transcoded video.
+
+    Frame numbers are in presentation order. Playing from keyframe i needs
+    the header (bytes [0, header_bytes)) and bytes from keyframe i's offset.
+    """
+    output = run(
+        [
+            settings.POSE_FFPROBE,
+            "-v",
+            "error",
+            "-select_streams",
+            "v:0",
+            "-show_entries",
+            "packet=pts_time,pos,flags",
+            "-of",
+            "json",
+            path,
+        ]
+    )
+    packets = json.loads(output).get("packets", [])
+    times = np.array([float(packet["pts_time"]) for packet in packets])
+    offsets = np.array([int(packet["pos"]) for packet in packets], dtype=np.int64)
+    keyframe = np.array(["K" in packet["flags"] for packet in packets], dtype=bool)
+
+    # Packets are in decode order; a frame's number is its rank by time
+    frames = np.empty(len(times), dtype=np.int64)
+    frames[np.argsort(times, kind="stable")] = np.arange(len(times))
+    order = np.argsort(frames[keyframe])
+    return {
+        "fps": fps,
+        "frames": len(times),
+        "bytes": os.path.getsize(path),
+        "header_bytes": int(offsets.min()) if len(offsets) else 0,
+        "keyframes": {
+            "frame": frames[keyframe][order].tolist(),
+            "time": np.round(times[keyframe][order], 3).tolist(),
+            "byte": offsets[keyframe][order].tolist(),
+        },
+    }
+
+
+def seek_points(index, frames):
+    # The keyframe to start from for each of `frames`, and the byte range
+    # from it up to the next keyframe
+    keyframes = index["keyframes"]
+    if not keyframes["frame"]:
+        return {}
+    position = np.searchsorted(keyframes["frame"], frames, side="right") - 1
+    position = np.maximum(position, 0)
+    ends = keyframes["byte"][1:] + [index["bytes"]]
+    return {
+        int(frame): {
+            "keyframe": keyframes["frame"][i],
+            "time": keyframes["time"][i],
+            "byte_range": [keyframes["byte"][i], ends[i] - 1],
+        }
+        for frame, i in zip(frames, position.tolist())
+    }
+
+
+def cut_clip(source_path, output_path, frame, fps):
+    # Copy the few seconds around `frame` without re-encoding. The clip starts
+    # at the keyframe before the requested start, so it always plays
+    start = max(0.0, frame / fps - settings.POSE_CLIP_SECONDS)
+    run(
+        [
+            settings.POSE_FFMPEG,
+            "-y",
+            "-v",
+            "error",
+            "-ss",
+            f"{start:.3f}",
+            "-i",
+            source_path,
+            "-t",
+            f"{settings.POSE_CLIP_SECONDS * 2:.3f}",
+            "-c",
+            "copy",
+            "-movflags",
+            "+faststart",
+            "-an",
+            output_path,
+        ]
+    )
+    return output_path
+
+
+def clip_path(directory, key, frame):
+    return os.path.join(directory, f"{key}-{frame}.mp4")
+
+
+def index_path(directory, key):
+    return os.path.join(directory, f"{key}.index.json")
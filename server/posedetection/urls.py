@@ -3,4 +3,16 @@ from . import views
 
 urlpatterns = [
     path("check-form", views.check_form),
+    path("check-form/batch", views.check_form_batch),
+    path(
+        "check-form/video/<str:key>",
+        views.check_form_video,
+        name="check-form-video",
+    ),
+    path("check-form/jobs", views.submit_job),
+    path("check-form/jobs/<uuid:job_id>", views.job_status),
+    path("check-form/jobs/<uuid:job_id>/result", views.job_result),
+    path("model-metrics", views.model_metrics),
+    path("cache-metrics", views.cache_metrics),
+    path("metrics", views.prometheus_metrics),
 ]
@@ -1,13 +1,32 @@
 import os
+import logging
 import math
-from ultralytics import YOLO
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import closing
+from itertools import islice
+import cv2
 import numpy as np
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from django.conf import settings
 from dotenv import load_dotenv
+from . import metrics
 from .headers import *
+from .pool import get_pool
+from .tracks import write_track
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Frame rate assumed when a video doesn't report one
+DEFAULT_FPS = 50
+# Warnings closer together than this are reported once
+WARNING_WINDOW_SECONDS = 0.5
+
 
 def calculate_angle(a, b, c):
     A, B, C = a, b, c
@@ -36,222 +55,270 @@ def get_average_xy(a, b):
     return [(a[0] + b[0]) / 2, (a[1] + b[1]) / 2]
 
 
-def upload_video(file_path, bucket_name, object_name=None):
-    # Create a session using the R2 credentials
-    s3_client = boto3.Session().client(
-        service_name="s3",
-        aws_access_key_id=os.environ.get("R2_ACCESS_KEY_ID"),
-        aws_secret_access_key=os.environ.get("R2_SECRET_ACCESS_KEY"),
-        endpoint_url=os.environ.get("R2_CONNECTION_URL"),
+def get_video_fps(file):
+    capture = cv2.VideoCapture(file)
+    fps = capture.get(cv2.CAP_PROP_FPS)
+    capture.release()
+    return fps if fps and fps > 0 else DEFAULT_FPS
+
+
+def get_analysis_stride(fps, target_fps=None):
+    # Analyse every n-th frame so roughly target_fps frames per second are used
+    if not target_fps or target_fps >= fps:
+        return 1
+    return max(1, round(fps / target_fps))
+
+
+def source_frame(index, stride=1):
+    # Source frame of the index-th analysed frame. Ultralytics' vid_stride
+    # grabs `stride` frames before decoding one, as read_strided does
+    return index * stride + stride - 1
+
+
+def analysed_index(frame, stride=1):
+    # The last analysed frame at or before source frame `frame`, or -1
+    return (frame + 1) // stride - 1
+
+
+def get_warning_window(fps):
+    return max(1, round(fps * WARNING_WINDOW_SECONDS))
+
+
+def suppress_nearby_warnings(warning_frames, warning_messages, fps=DEFAULT_FPS):
+    # Keep a warning only if it is at least one window after the last kept one
+    window = get_warning_window(fps)
+    kept_frames = []
+    kept_messages = []
+    for frame, message in zip(warning_frames, warning_messages):
+        if not kept_frames or frame - kept_frames[-1] >= window:
+            kept_frames.append(frame)
+            kept_messages.append(message)
+    return kept_frames, kept_messages
+
+
+_s3_client = None
+_s3_lock = threading.Lock()
+_upload_executor = None
+# Background uploads not yet finished
+_uploads = set()
+
+
+def get_s3_client():
+    # boto3 clients are thread-safe, so one pooled client serves every request
+    # and credentials/TLS are only set up once per process
+    global _s3_client
+    if _s3_client is None:
+        with _s3_lock:
+            if _s3_client is None:
+                _s3_client = boto3.session.Session().client(
+                    service_name="s3",
+                    aws_access_key_id=os.environ.get("R2_ACCESS_KEY_ID"),
+                    aws_secret_access_key=os.environ.get("R2_SECRET_ACCESS_KEY"),
+                    endpoint_url=os.environ.get("R2_CONNECTION_URL"),
+                    config=Config(
+                        max_pool_connections=settings.R2_MAX_POOL_CONNECTIONS,
+                        retries={"max_attempts": 3, "mode": "standard"},
+                    ),
+                )
+    return _s3_client
+
+
+def get_transfer_config():
+    return TransferConfig(
+        multipart_threshold=settings.R2_MULTIPART_CHUNKSIZE,
+        multipart_chunksize=settings.R2_MULTIPART_CHUNKSIZE,
+        max_concurrency=settings.R2_MAX_CONCURRENCY,
+        use_threads=True,
     )
 
-    # If no object name is specified, use the file name
-    if object_name is None:
-        object_name = file_path.split("/")[-1]
-
-    s3_client.upload_file(file_path, bucket_name, object_name)
-    return f"{os.environ.get('R2_PUBLIC_ENDPOINT')}/{bucket_name}/{object_name}"
-
 
-def get_pose_estimation(file):
-    # Load the YOLOv8 pose model (pre-trained model from Ultralytics)
-    model = YOLO("yolo11n-pose.pt")
+def get_upload_executor():
+    global _upload_executor
+    if _upload_executor is None:
+        with _s3_lock:
+            if _upload_executor is None:
+                _upload_executor = ThreadPoolExecutor(
+                    max_workers=settings.R2_UPLOAD_WORKERS,
+                    thread_name_prefix="r2-upload",
+                )
+    return _upload_executor
 
-    # Run inference on a video file
-    results = model(
-        source=file,
-        task="pose",
-        conf=0.7,
-        save=True,
-        project="posedetection",
-        boxes=False,
-        exist_ok=True,
-    )
-    file_name = file.split("/")[-1]
-    file_stem = file_name.split(".")[0]
-    url = upload_video(f"posedetection/predict/{file_stem}.mp4", "howsmyform")
 
-    # Process the results
-    keypoints = []
-    for result in results:
-        keypoints.append(result.keypoints)  # Keypoints object for pose outputs
-    return url, keypoints
+def get_video_url(bucket_name, object_name):
+    return f"{os.environ.get('R2_PUBLIC_ENDPOINT')}/{bucket_name}/{object_name}"
 
 
-def check_squat(coords, angles):
-    warning_frames = []
-    warning_messages = []
+def log_upload_failure(future):
+    _uploads.discard(future)
+    if future.exception() is not None:
+        logger.error("Background video upload failed", exc_info=future.exception())
 
-    straight_angle = angles["hip"][0]
-    straight_i = 0
 
-    for i in range(len(angles["hip"])):
-        angle = angles["hip"][i]
-        if 180 - angle < straight_angle:
-            straight_angle = angle
-            straight_i = i
+def shutdown_uploads(timeout=None):
+    # Wait up to `timeout` seconds for background uploads, returning whether
+    # they all finished
+    _, not_done = wait(list(_uploads), timeout)
+    if not_done:
+        logger.error("%d background uploads were unfinished at shutdown", len(not_done))
+    return not not_done
 
-    straight_back_length = np.linalg.norm(
-        [
-            (coords["shoulder"][straight_i][0]) - coords["hip"][straight_i][0],
-            (coords["shoulder"][straight_i][1]) - coords["hip"][straight_i][1],
-        ]
-    )
 
-    for frame_i in range(len(angles["hip"])):
-        hip_angle = angles["hip"][frame_i]
-        knee_angle = angles["knee"][frame_i]
+def upload_video(
+    file_path,
+    bucket_name,
+    object_name=None,
+    background=False,
+    content_type="video/mp4",
+):
+    # If no object name is specified, use the file name
+    if object_name is None:
+        object_name = file_path.split("/")[-1]
 
-        ratio = knee_angle / hip_angle
-        back_length = np.linalg.norm(
-            [
-                (coords["shoulder"][frame_i][0]) - coords["hip"][frame_i][0],
-                (coords["shoulder"][frame_i][1]) - coords["hip"][frame_i][1],
-            ]
+    # Large files are split into parts that are uploaded concurrently
+    def upload():
+        get_s3_client().upload_file(
+            file_path,
+            bucket_name,
+            object_name,
+            ExtraArgs={"ContentType": content_type},
+            Config=get_transfer_config(),
         )
-        if ratio > 1:
-            warning_messages.append("Knees too far forward")
-            warning_frames.append(frame_i)
-        elif back_length < straight_back_length * 0.7:
-            warning_messages.append("Back too bent")
-            warning_frames.append(frame_i)
-
-    # Remove warning frames within 0.5 seconds of one another
-    while True:
-        popped = False
-        for i in range(len(warning_frames) - 1):
-            if warning_frames[i + 1] - warning_frames[i] < 25:
-                warning_frames.pop(i + 1)
-                warning_messages.pop(i + 1)
-                popped = True
-                break
-
-        if not popped:
-            return warning_frames, warning_messages
-
-
-def check_bench(angles, coords, indiv_coords):
-    warning_frames = []
-    warning_messages = []
-
-    start_angle = angles["arm"][0]
-    start_index = 0
-
-    frame = 0
-    for i in range(len(angles["arm"])):
-        angle = angles["arm"][i]
-        if 180 - angle < start_angle:
-            start_angle = angle
-            start_index = i
-            frame = i
-
-    shoulder_width = abs(
-        indiv_coords["right_shoulder"][start_index][0]
-        - indiv_coords["left_shoulder"][start_index][0]
-    )
-
-    frames = []
-    for i in range(len(coords["elbow"])):
-        if coords["elbow"][i][1] >= coords["shoulder"][i][1]:
-            frames.append(i)
-
-    for frame in frames:
-        if abs(
-            indiv_coords["left_shoulder"][frame][0]
-            - indiv_coords["left_elbow"][frame][0]
-        ) > shoulder_width * 0.8 or (
-            abs(
-                indiv_coords["right_shoulder"][frame][0]
-                - indiv_coords["right_elbow"][frame][0]
-            )
-            > shoulder_width * 0.8
-        ):
-            warning_messages.append(
-                "Elbows too far from body, try keeping them 45 degrees from torso"
-            )
-            warning_frames.append(frame)
-
-    # Remove warning frames within 0.5 seconds of one another
-    while True:
-        popped = False
-        for i in range(len(warning_frames) - 1):
-            if warning_frames[i + 1] - warning_frames[i] < 25:
-                warning_frames.pop(i + 1)
-                warning_messages.pop(i + 1)
-                popped = True
-                break
-
-        if not popped:
-            return warning_frames, warning_messages
-
-
-def check_deadlift(coords, angles):
-    warning_frames = []
-    warning_messages = []
-
-    straight_angle = angles["hip"][0]
-    straight_i = 0
-
-    for i in range(len(angles["hip"])):
-        angle = angles["hip"][i]
-        if 180 - angle < straight_angle:
-            straight_angle = angle
-            straight_i = i
-
-    initial_back_length = np.linalg.norm(
-        [
-            coords["shoulder"][straight_i][0] - coords["hip"][straight_i][0],
-            coords["shoulder"][straight_i][1] - coords["hip"][straight_i][1],
-        ]
+        metrics.inc("posedetection_uploaded_bytes_total", os.path.getsize(file_path))
+
+    # The public URL is known up front, so a background upload lets the caller
+    # respond before the video has finished uploading
+    if background:
+        future = get_upload_executor().submit(upload)
+        _uploads.add(future)
+        future.add_done_callback(log_upload_failure)
+    else:
+        upload()
+    return get_video_url(bucket_name, object_name)
+
+
+def compact_keypoints(result):
+    # The first detected person's (17, 3) keypoints, or NaNs if nobody was found
+    keypoints = result.keypoints
+    if keypoints is None or len(keypoints.data) == 0:
+        return np.full((17, 3), np.nan, dtype=np.float32)
+    return np.asarray(keypoints.data[0].cpu().numpy(), dtype=np.float32)
+
+
+def compact_people(result, max_people):
+    # (max_people, 17, 3) keypoints of everyone detected, NaN-padded
+    people = np.full((max_people, 17, 3), np.nan, dtype=np.float32)
+    keypoints = result.keypoints
+    if keypoints is not None and len(keypoints.data):
+        data = keypoints.data.cpu().numpy()[:max_people]
+        people[: len(data)] = data
+    return people
+
+
+def compact_everyone(result):
+    return compact_people(result, settings.POSE_MAX_PEOPLE)
+
+
+def collect_keypoints(frames, shape=(17, 3)):
+    # Pack per-frame keypoint arrays into one (frames, *shape) array, growing
+    # the buffer geometrically so only compact arrays are ever held in memory
+    buffer = np.empty((256, *shape), dtype=np.float32)
+    count = 0
+    for keypoints in frames:
+        if count == len(buffer):
+            buffer = np.concatenate([buffer, np.empty_like(buffer)])
+        buffer[count] = keypoints
+        count += 1
+    return buffer[:count].copy()
+
+
+def iter_keypoints(model, file, compact=compact_keypoints, **kwargs):
+    # stream=True makes Ultralytics decode and infer one frame at a time, so each
+    # Results object (and its decoded image) can be dropped as soon as it's read
+    results = model(
+        source=file,
+        task="pose",
+        conf=settings.POSE_CONF,
+        stream=True,
+        verbose=False,
+        **kwargs,
     )
-
-    # Determine facing direction of user
-    facing_left = 0
-    if coords["knee"][straight_i][0] < coords["ankle"][straight_i][0]:
-        facing_left = 1
-
-    for frame in range(len(angles["hip"])):
-        hip_angle = angles["hip"][frame]
-        knee_angle = angles["knee"][frame]
-
-        ratio = knee_angle / hip_angle
-
-        back_length = np.linalg.norm(
-            [
-                coords["shoulder"][frame][0] - coords["hip"][frame][0],
-                coords["shoulder"][frame][1] - coords["hip"][frame][1],
-            ]
+    for result in results:
+        yield compact(result)
+
+
+def get_pose_estimation(
+    file,
+    stride=1,
+    imgsz=None,
+    batched=False,
+    check_start=None,
+    start_frames=0,
+    name=None,
+):
+    # Only pass imgsz when capped so the model's own default applies otherwise
+    options = {"imgsz": imgsz} if imgsz else {}
+    # With tracking, keep everyone detected until the lifter has been picked
+    tracking = settings.POSE_TRACKING
+    compact = compact_everyone if tracking else compact_keypoints
+    shape = (settings.POSE_MAX_PEOPLE, 17, 3) if tracking else (17, 3)
+
+    def checked(frames):
+        # Hand the lifter's keypoints in the first `start_frames` to
+        # check_start, which can raise to stop before the rest is decoded
+        head = collect_keypoints(islice(frames, start_frames), shape)
+        if tracking:
+            from .tracking import lifter_keypoints
+
+            check_start(lifter_keypoints(head, get_video_fps(file) / stride))
+        else:
+            check_start(head)
+        yield from head
+        yield from frames
+
+    if batched:
+        from .batching import get_batcher
+
+        # Frames share model calls with other videos being analysed right now
+        with metrics.span("inference"):
+            start = time.perf_counter()
+            with closing(
+                get_batcher(imgsz).iter_keypoints(file, stride, compact)
+            ) as frames:
+                if check_start is not None:
+                    frames = checked(frames)
+                keypoints = collect_keypoints(frames, shape)
+            elapsed = time.perf_counter() - start
+    else:
+        # Borrow a preloaded pose model from the process-wide pool
+        with get_pool().timed() as model, metrics.span("inference"):
+            start = time.perf_counter()
+            # Run inference on every `stride`-th frame of the video file. Only
+            # keypoints are extracted; the annotated video is rendered separately
+            with closing(
+                iter_keypoints(model, file, compact, vid_stride=stride, **options)
+            ) as frames:
+                if check_start is not None:
+                    frames = checked(frames)
+                keypoints = collect_keypoints(frames, shape)
+            elapsed = time.perf_counter() - start
+    if elapsed > 0:
+        metrics.observe("posedetection_inference_fps", len(keypoints) / elapsed)
+
+    if tracking:
+        from .tracking import lifter_keypoints
+
+        with metrics.span("tracking"):
+            keypoints = lifter_keypoints(keypoints, get_video_fps(file) / stride)
+
+    # Archive the track so checker changes can be re-validated without
+    # inference, under `name` (the upload's digest) or the file's name
+    if settings.POSE_TRACK_DIR:
+        os.makedirs(settings.POSE_TRACK_DIR, exist_ok=True)
+        name = name or os.path.splitext(os.path.basename(file))[0]
+        write_track(
+            os.path.join(settings.POSE_TRACK_DIR, name),
+            keypoints,
+            {"fps": get_video_fps(file), "stride": stride, "source": file},
         )
 
-        margin_error = back_length / 5
-        if back_length < initial_back_length * 0.7:
-            warning_messages.append("Make sure to keep your back straight")
-            warning_frames.append(frame)
-        elif (ratio > 3 or ratio < 0.7) and coords["hip"][frame][1] < coords["knee"][
-            frame
-        ][1] - margin_error:
-            warning_messages.append(
-                "Lift with your entire body, not just your legs or back"
-            )
-            warning_frames.append(frame)
-        elif (
-            coords["shoulder"][frame][0] < (coords["hip"][frame][0] - margin_error)
-            and facing_left == 0
-            or coords["shoulder"][frame][0] > (coords["hip"][frame][0] + margin_error)
-            and facing_left == 1
-        ):
-            warning_messages.append("Make sure not to lean back too much")
-            warning_frames.append(frame)
-
-    # Remove warning frames within 0.5 seconds of one another
-    while True:
-        popped = False
-        for i in range(len(warning_frames) - 1):
-            if warning_frames[i + 1] - warning_frames[i] < 25:
-                warning_frames.pop(i + 1)
-                warning_messages.pop(i + 1)
-                popped = True
-                break
-
-        if not popped:
-            return warning_frames, warning_messages
+    return keypoints
@@ -1,106 +1,321 @@
-from collections import defaultdict
+import contextvars
+import re
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
 from django.core.files.storage import default_storage
-from django.core.files.base import ContentFile
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+from django.http import HttpResponse
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.decorators import api_view
-from . import util
-from .headers import *
+from . import metrics, pipeline, render
+from .cache import get_cache
+from .camera import UnsupportedView
+from .jobs import fail_stale_jobs, get_queue, pending_jobs
+from .models import Job
+from .pool import get_pool, pool_samples
+from .render import get_renderer
+
+
+def save_upload(file):
+    # Save the file and return its path on disk. Storage copies the upload in
+    # chunks, or just moves it when Django already spooled it to a temp file,
+    # so the video is never held in memory as a whole
+    file_name = default_storage.save(f"posedetection/uploads/{file.name}", file)
+    return default_storage.path(file_name)
+
+
+class UploadLimitHandler(FileUploadHandler):
+    """Stops parsing a request once its files pass POSE_MAX_UPLOAD_BYTES.
+
+    Registered ahead of Django's own handlers, so an upload whose length
+    isn't known up front is never written out past the limit.
+    """
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding):
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > settings.POSE_MAX_UPLOAD_BYTES:
+            self.request.upload_too_large = True
+            raise StopUpload(connection_reset=True)
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
+
+def upload_too_large(request):
+    # Checked against Content-Length before the body is parsed, so most
+    # oversized uploads are refused without being read at all. Otherwise
+    # parsing stops at the limit (see UploadLimitHandler)
+    try:
+        length = int(request.META.get("CONTENT_LENGTH") or 0)
+    except ValueError:
+        length = 0
+    if length > settings.POSE_MAX_UPLOAD_BYTES:
+        return True
+    request.FILES  # Parse the body
+    return getattr(request, "upload_too_large", False)
+
+
+def upload_too_large_response():
+    return Response(
+        {"message": "Video is too large"},
+        status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+    )
 
 
 @api_view(["POST"])
 def check_form(request):
+    if upload_too_large(request):
+        return upload_too_large_response()
+
     # Get file from request body video-upload
     if request.method == "POST":
         # Get the uploaded file
         file = request.FILES.get("video-upload")
 
         if file:
-            # Save the file
-            file_name = default_storage.save(
-                f"posedetection/uploads/{file.name}", ContentFile(file.read())
-            )
-            # get path of file url after saving
-            file_url = "/".join(default_storage.url(file_name).split("/")[1:])
+            with metrics.span("save_upload"):
+                file_path = save_upload(file)
 
             movement = request.data["movement"]
 
-            if movement not in ["bench", "squat", "deadlift"]:
+            if movement not in pipeline.MOVEMENTS:
                 return Response(
                     {"message": "Invalid movement type"},
                     status=status.HTTP_400_BAD_REQUEST,
                 )
 
-            estimation = util.get_pose_estimation(file_url)
-            keypoints = estimation[1]
+            try:
+                data = pipeline.analyze_video(
+                    file_path,
+                    movement,
+                    include_keypoints=wants_keypoints(request),
+                    per_rep=wants_per_rep(request),
+                )
+            except UnsupportedView as e:
+                return unsupported_view_response(e)
+            return Response(status=status.HTTP_200_OK, data=data)
+    return Response(
+        {"message": "No keypoint found"}, status=status.HTTP_400_BAD_REQUEST
+    )
 
-            angles = defaultdict(list)
-            coords = defaultdict(list)
-            indiv_coords = defaultdict(list)
-            for keypoint in keypoints:
-                xy = keypoint.xy[0]
 
-                indiv_coords["left_shoulder"].append(xy[LEFT_SHOULDER])
-                indiv_coords["right_shoulder"].append(xy[RIGHT_SHOULDER])
+@api_view(["POST"])
+def check_form_batch(request):
+    if upload_too_large(request):
+        return upload_too_large_response()
 
-                indiv_coords["left_elbow"].append(xy[LEFT_ELBOW])
-                indiv_coords["right_elbow"].append(xy[RIGHT_ELBOW])
+    files = request.FILES.getlist("video-upload")
+    if not files:
+        return Response(
+            {"message": "No video uploaded"}, status=status.HTTP_400_BAD_REQUEST
+        )
+    if len(files) > settings.POSE_BATCH_MAX_VIDEOS:
+        return Response(
+            {"message": f"At most {settings.POSE_BATCH_MAX_VIDEOS} videos per batch"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
 
-                shoulder = util.get_average_xy(xy[LEFT_SHOULDER], xy[RIGHT_SHOULDER])
-                coords["shoulder"].append(shoulder)
+    # Either one movement for every video or one per video, in upload order
+    movements = request.data.getlist("movement")
+    if len(movements) == 1:
+        movements = movements * len(files)
+    if len(movements) != len(files) or any(
+        movement not in pipeline.MOVEMENTS for movement in movements
+    ):
+        return Response(
+            {"message": "Invalid movement type"}, status=status.HTTP_400_BAD_REQUEST
+        )
 
-                elbow = util.get_average_xy(xy[LEFT_ELBOW], xy[RIGHT_ELBOW])
-                coords["elbow"].append(elbow)
+    with metrics.span("save_upload"):
+        file_paths = [save_upload(file) for file in files]
 
-                wrist = util.get_average_xy(xy[LEFT_WRIST], xy[RIGHT_WRIST])
-                coords["wrist"].append(wrist)
+    # Every video is analysed at once so their frames share model calls
+    include_keypoints = wants_keypoints(request)
+    per_rep = wants_per_rep(request)
 
-                hip = util.get_average_xy(xy[LEFT_HIP], xy[RIGHT_HIP])
-                coords["hip"].append(hip)
+    def analyze(file_path, movement):
+        # A video filmed from the wrong angle doesn't fail the whole batch
+        try:
+            return pipeline.analyze_video(
+                file_path,
+                movement,
+                include_keypoints=include_keypoints,
+                batched=True,
+                per_rep=per_rep,
+            )
+        except UnsupportedView as e:
+            return unsupported_view_data(e)
 
-                knee = util.get_average_xy(xy[LEFT_KNEE], xy[RIGHT_KNEE])
-                coords["knee"].append(knee)
+    # Each video runs in a copy of this request's context, so its stages
+    # still reach the Server-Timing header
+    with ThreadPoolExecutor(max_workers=len(files)) as executor:
+        futures = [
+            executor.submit(contextvars.copy_context().run, analyze, *args)
+            for args in zip(file_paths, movements)
+        ]
+        results = [future.result() for future in futures]
 
-                ankle = util.get_average_xy(xy[RIGHT_ANKLE], xy[RIGHT_ANKLE])
-                coords["ankle"].append(ankle)
+    for file, result in zip(files, results):
+        result["name"] = file.name
+    return Response({"results": results}, status=status.HTTP_200_OK)
 
-                angles["hip"].append(util.calculate_angle(shoulder, hip, knee))
-                angles["shoulder"].append(util.calculate_angle(hip, shoulder, elbow))
-                angles["knee"].append(util.calculate_angle(hip, knee, ankle))
-                angles["arm"].append(util.calculate_angle(shoulder, elbow, wrist))
 
-            if movement == "squat":
-                warning_frames, warning_messages = util.check_squat(coords, angles)
-                return Response(
-                    status=status.HTTP_200_OK,
-                    data={
-                        "url": estimation[0],
-                        "warning_frames": warning_frames,
-                        "warning_messages": warning_messages,
-                    },
-                )
-            if movement == "bench":
-                warning_frames, warning_messages = util.check_bench(
-                    angles, coords, indiv_coords
-                )
-                return Response(
-                    status=status.HTTP_200_OK,
-                    data={
-                        "url": estimation[0],
-                        "warning_frames": warning_frames,
-                        "warning_messages": warning_messages,
-                    },
-                )
-            if movement == "deadlift":
-                warning_frames, warning_messages = util.check_deadlift(coords, angles)
-                return Response(
-                    status=status.HTTP_200_OK,
-                    data={
-                        "url": estimation[0],
-                        "warning_frames": warning_frames,
-                        "warning_messages": warning_messages,
-                    },
-                )
+def unsupported_view_data(error):
+    return {
+        "message": str(error),
+        "view": error.view,
+        "supported_views": error.supported,
+    }
+
+
+def unsupported_view_response(error):
     return Response(
-        {"message": "No keypoint found"}, status=status.HTTP_400_BAD_REQUEST
+        unsupported_view_data(error), status=status.HTTP_422_UNPROCESSABLE_ENTITY
+    )
+
+
+def wants_keypoints(request):
+    # Clients drawing their own overlay can ask for the raw keypoints
+    return str(request.data.get("include_keypoints", "")).lower() in ("1", "true")
+
+
+def wants_per_rep(request):
+    # Only the per-rep summaries, without a warning entry per frame
+    return str(request.data.get("per_rep", "")).lower() in ("1", "true")
+
+
+@api_view(["GET"])
+def check_form_video(request, key):
+    if not re.fullmatch(r"[0-9a-f]{64}", key):
+        return Response(
+            {"message": "Video not found"}, status=status.HTTP_404_NOT_FOUND
+        )
+
+    entry = get_cache().get(key)
+    if entry is None:
+        return Response(
+            {"message": "Video not found, upload it again"},
+            status=status.HTTP_404_NOT_FOUND,
+        )
+
+    _, meta = entry
+    if meta.get("url"):
+        # Clips for warnings found since rendering are cut in the background
+        if render.missing_clips(meta) and meta.get("index_url"):
+            get_renderer().request(key)
+        return Response(render.media_data(key, meta), status=status.HTTP_200_OK)
+
+    if meta.get("render_failed"):
+        return Response(
+            {"message": "The annotated video couldn't be rendered"},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+        )
+
+    # Render on first request; the client polls until the URL is ready
+    get_renderer().request(key)
+    return Response({"status": "rendering"}, status=status.HTTP_202_ACCEPTED)
+
+
+def job_data(job):
+    data = {"job_id": str(job.id), "movement": job.movement, "status": job.status}
+    if job.status == Job.FAILED:
+        data["error"] = job.error
+    return data
+
+
+def queue_full_response():
+    return Response(
+        {"message": "Too many videos are being processed, try again shortly"},
+        status=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={"Retry-After": "5"},
+    )
+
+
+@api_view(["POST"])
+def submit_job(request):
+    if upload_too_large(request):
+        return upload_too_large_response()
+
+    file = request.FILES.get("video-upload")
+    if not file:
+        return Response(
+            {"message": "No video uploaded"}, status=status.HTTP_400_BAD_REQUEST
+        )
+
+    movement = request.data.get("movement")
+    if movement not in pipeline.MOVEMENTS:
+        return Response(
+            {"message": "Invalid movement type"}, status=status.HTTP_400_BAD_REQUEST
+        )
+
+    # Refuse work up front rather than storing uploads we can't process soon
+    queue = get_queue()
+    if queue.full():
+        return queue_full_response()
+
+    with metrics.span("save_upload"):
+        file_path = save_upload(file)
+    job = Job.objects.create(movement=movement, upload=file_path)
+    if not queue.submit(job):
+        job.status = Job.FAILED
+        job.error = "Queue full"
+        job.save(update_fields=["status", "error"])
+        return queue_full_response()
+
+    return Response(job_data(job), status=status.HTTP_202_ACCEPTED)
+
+
+def get_job(job_id):
+    # Jobs lost with the process that held them are failed here, in case no
+    # running process has swept them yet
+    jobs = Job.objects.filter(pk=job_id)
+    fail_stale_jobs(jobs)
+    return jobs.first()
+
+
+@api_view(["GET"])
+def job_status(request, job_id):
+    job = get_job(job_id)
+    if job is None:
+        return Response({"message": "Job not found"}, status=status.HTTP_404_NOT_FOUND)
+    return Response(job_data(job), status=status.HTTP_200_OK)
+
+
+@api_view(["GET"])
+def job_result(request, job_id):
+    job = get_job(job_id)
+    if job is None:
+        return Response({"message": "Job not found"}, status=status.HTTP_404_NOT_FOUND)
+    if job.status == Job.DONE:
+        return Response(job.result, status=status.HTTP_200_OK)
+    if job.status == Job.FAILED:
+        return Response(job_data(job), status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    # Not finished yet, the client should keep polling
+    return Response(job_data(job), status=status.HTTP_202_ACCEPTED)
+
+
+@api_view(["GET"])
+def model_metrics(request):
+    return Response(get_pool().metrics(), status=status.HTTP_200_OK)
+
+
+@api_view(["GET"])
+def cache_metrics(request):
+    return Response(get_cache().metrics(), status=status.HTTP_200_OK)
+
+
+def prometheus_metrics(request):
+    cache = get_cache().metrics()
+    extra = pool_samples(get_pool()) + [
+        (f"posedetection_cache_{name}_total", "counter", {}, value)
+        for name, value in cache.items()
+    ]
+    extra.append(("posedetection_job_queue_pending", "gauge", {}, pending_jobs()))
+    return HttpResponse(
+        metrics.render(extra), content_type="text/plain; version=0.0.4; charset=utf-8"
     )
@@ -13,4 +13,21 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'server.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once Django is set up, since it reads settings and loads models
+from posedetection import live  # noqa: E402
+from posedetection.middleware import RequestBodyLimit  # noqa: E402
+
+django_application = RequestBodyLimit(django_application)
+
+
+async def application(scope, receive, send):
+    # Django serves HTTP; live analysis WebSockets are handled directly
+    if scope['type'] == 'websocket':
+        if scope['path'] == live.PATH:
+            return await live.websocket_application(scope, receive, send)
+        await receive()
+        await send({'type': 'websocket.close'})
+        return
+    return await django_application(scope, receive, send)
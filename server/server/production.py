@@ -0,0 +1,26 @@
+"""
+Production settings, used by gunicorn.conf.py.
+
+Deployment-specific values come from the environment, most of them through
+django_on_heroku in the base settings: SECRET_KEY is required, and
+DATABASE_URL should point at Postgres so that several workers can share it.
+DJANGO_ALLOWED_HOSTS and DJANGO_CSRF_TRUSTED_ORIGINS are comma-separated.
+"""
+
+from django.core.exceptions import ImproperlyConfigured
+from .settings import *
+
+DEBUG = False
+
+if "SECRET_KEY" not in os.environ:
+    raise ImproperlyConfigured("SECRET_KEY must be set in production")
+
+if os.environ.get("DJANGO_ALLOWED_HOSTS"):
+    ALLOWED_HOSTS = os.environ["DJANGO_ALLOWED_HOSTS"].split(",")
+if os.environ.get("DJANGO_CSRF_TRUSTED_ORIGINS"):
+    CSRF_TRUSTED_ORIGINS = os.environ["DJANGO_CSRF_TRUSTED_ORIGINS"].split(",")
+
+# gunicorn.conf.py loads the models in the master and warms them up in each
+# worker after the fork; warming up here would start torch's thread pools
+# before forking
+POSE_MODEL_WARMUP = False
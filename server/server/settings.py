@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 import django_on_heroku
 
@@ -47,6 +48,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "posedetection.middleware.ServerTimingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
@@ -130,3 +132,152 @@ django_on_heroku.settings(locals())
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+
+# Pose detection
+
+POSE_MODEL = os.environ.get("POSE_MODEL", "yolo11n-pose.pt")
+# Run the model with "torch", or export it once into POSE_EXPORT_DIR and run
+# it with "onnx" (ONNX Runtime) or "openvino", which need
+# requirements-backends.txt. POSE_INT8 quantizes the export, calibrating
+# OpenVINO on POSE_INT8_DATA. POSE_INTRA_OP_THREADS caps the
+# threads each model instance uses (0 leaves the library default)
+POSE_BACKEND = os.environ.get("POSE_BACKEND", "torch")
+POSE_INT8 = os.environ.get("POSE_INT8", "0") == "1"
+POSE_INT8_DATA = os.environ.get("POSE_INT8_DATA", "coco8-pose.yaml")
+POSE_INTRA_OP_THREADS = int(os.environ.get("POSE_INTRA_OP_THREADS", "0"))
+POSE_EXPORT_DIR = os.environ.get(
+    "POSE_EXPORT_DIR", str(BASE_DIR / "posedetection" / "exports")
+)
+# Minimum detection confidence for a person to be reported
+POSE_CONF = float(os.environ.get("POSE_CONF", "0.7"))
+# Follow up to POSE_MAX_PEOPLE people per frame and only check the lifter's
+# form. Tracks continue across boxes overlapping by POSE_TRACK_IOU and gaps of
+# up to POSE_TRACK_MAX_AGE_SECONDS
+POSE_TRACKING = os.environ.get("POSE_TRACKING", "1") == "1"
+POSE_MAX_PEOPLE = int(os.environ.get("POSE_MAX_PEOPLE", "5"))
+POSE_TRACK_IOU = float(os.environ.get("POSE_TRACK_IOU", "0.3"))
+POSE_TRACK_MAX_AGE_SECONDS = float(os.environ.get("POSE_TRACK_MAX_AGE_SECONDS", "1"))
+# Tell side, front and oblique camera views apart from the first
+# POSE_VIEW_SECONDS of keypoints. Rules that don't apply to the view are
+# skipped, and clips none of the movement's rules apply to are turned away
+# after inference on just those seconds
+POSE_VIEW_DETECTION = os.environ.get("POSE_VIEW_DETECTION", "1") == "1"
+POSE_VIEW_SECONDS = float(os.environ.get("POSE_VIEW_SECONDS", "2"))
+# Before the checkers run, keypoints below POSE_MIN_KEYPOINT_CONF and frames
+# without a detection are interpolated over gaps of up to POSE_MAX_GAP_SECONDS,
+# then smoothed over windows of POSE_SMOOTHING_WINDOW_SECONDS
+POSE_SMOOTHING = os.environ.get("POSE_SMOOTHING", "1") == "1"
+POSE_MIN_KEYPOINT_CONF = float(os.environ.get("POSE_MIN_KEYPOINT_CONF", "0.5"))
+POSE_MAX_GAP_SECONDS = float(os.environ.get("POSE_MAX_GAP_SECONDS", "0.5"))
+POSE_SMOOTHING_WINDOW_SECONDS = float(
+    os.environ.get("POSE_SMOOTHING_WINDOW_SECONDS", "0.2")
+)
+# Number of model instances shared by the requests handled in one process
+POSE_MODEL_POOL_SIZE = int(os.environ.get("POSE_MODEL_POOL_SIZE", "1"))
+# Load (and run a blank frame through) every pooled model when the app starts
+POSE_MODEL_WARMUP = os.environ.get("POSE_MODEL_WARMUP", "0") == "1"
+# Analyse roughly this many frames per second of video (0 analyses every
+# frame), and cap the model input size (0 keeps the model's default)
+POSE_TARGET_FPS = float(os.environ.get("POSE_TARGET_FPS", "0"))
+POSE_MAX_IMGSZ = int(os.environ.get("POSE_MAX_IMGSZ", "0"))
+# Largest video accepted by check-form. Uploads bigger than
+# FILE_UPLOAD_MAX_MEMORY_SIZE are spooled to a temporary file while parsing
+POSE_MAX_UPLOAD_BYTES = int(os.environ.get("POSE_MAX_UPLOAD_BYTES", str(200 * 2**20)))
+FILE_UPLOAD_MAX_MEMORY_SIZE = int(
+    os.environ.get("FILE_UPLOAD_MAX_MEMORY_SIZE", str(2621440))
+)
+# POSE_MAX_UPLOAD_BYTES is also enforced while the files are read, for
+# requests whose Content-Length doesn't give them away
+FILE_UPLOAD_HANDLERS = [
+    "posedetection.views.UploadLimitHandler",
+    "django.core.files.uploadhandler.MemoryFileUploadHandler",
+    "django.core.files.uploadhandler.TemporaryFileUploadHandler",
+]
+# Worker threads running queued check-form jobs, and how many jobs may be
+# queued or running before new submissions are turned away
+POSE_JOB_WORKERS = int(os.environ.get("POSE_JOB_WORKERS", "2"))
+POSE_JOB_QUEUE_SIZE = int(os.environ.get("POSE_JOB_QUEUE_SIZE", "8"))
+# Jobs only live in the process that accepted them, which marks them alive
+# this often. Unfinished jobs not marked for POSE_JOB_STALE_SECONDS were lost
+# with their process (a restart or crash) and are failed
+POSE_JOB_HEARTBEAT_SECONDS = float(os.environ.get("POSE_JOB_HEARTBEAT_SECONDS", "10"))
+POSE_JOB_STALE_SECONDS = float(os.environ.get("POSE_JOB_STALE_SECONDS", "60"))
+# Pose estimation results are cached here by upload hash, evicting the least
+# recently used entries once the directory outgrows POSE_CACHE_MAX_BYTES
+POSE_CACHE_DIR = os.environ.get(
+    "POSE_CACHE_DIR", str(BASE_DIR / "posedetection" / "cache")
+)
+POSE_CACHE_MAX_BYTES = int(os.environ.get("POSE_CACHE_MAX_BYTES", str(256 * 2**20)))
+# Every analysed clip's keypoint track is archived here for `reanalyze`
+# (empty to disable)
+POSE_TRACK_DIR = os.environ.get(
+    "POSE_TRACK_DIR", str(BASE_DIR / "posedetection" / "tracks")
+)
+# Annotated videos are rendered from cached keypoints on a pool of
+# POSE_RENDER_WORKERS threads when first requested, or as soon as check-form
+# has analysed them with POSE_RENDER_EAGER
+POSE_RENDER_EAGER = os.environ.get("POSE_RENDER_EAGER", "0") == "1"
+POSE_RENDER_WORKERS = int(os.environ.get("POSE_RENDER_WORKERS", "1"))
+POSE_RENDER_DIR = os.environ.get(
+    "POSE_RENDER_DIR", str(BASE_DIR / "posedetection" / "predict")
+)
+# When ffmpeg is available, rendered videos are re-encoded for the web (H.264,
+# faststart, a keyframe every POSE_KEYFRAME_SECONDS, at most
+# POSE_TRANSCODE_MAX_HEIGHT lines) with a keyframe index sidecar, and clips of
+# POSE_CLIP_SECONDS either side of every warning are cut from them
+POSE_TRANSCODE = os.environ.get("POSE_TRANSCODE", "1") == "1"
+POSE_FFMPEG = os.environ.get("POSE_FFMPEG", "ffmpeg")
+POSE_FFPROBE = os.environ.get("POSE_FFPROBE", "ffprobe")
+POSE_TRANSCODE_CRF = int(os.environ.get("POSE_TRANSCODE_CRF", "28"))
+POSE_TRANSCODE_MAX_HEIGHT = int(os.environ.get("POSE_TRANSCODE_MAX_HEIGHT", "720"))
+POSE_TRANSCODE_THREADS = int(os.environ.get("POSE_TRANSCODE_THREADS", "2"))
+POSE_KEYFRAME_SECONDS = float(os.environ.get("POSE_KEYFRAME_SECONDS", "1"))
+POSE_CLIP_SECONDS = float(os.environ.get("POSE_CLIP_SECONDS", "1.5"))
+# Frames from concurrently analysed videos are grouped into shared model calls
+# of up to POSE_BATCH_MAX_SIZE frames, waiting at most POSE_BATCH_MAX_WAIT_MS
+# for a batch to fill. check-form/batch always does this; POSE_MICROBATCH
+# makes check-form and queued jobs do it too
+POSE_MICROBATCH = os.environ.get("POSE_MICROBATCH", "0") == "1"
+POSE_BATCH_MAX_SIZE = int(os.environ.get("POSE_BATCH_MAX_SIZE", "8"))
+POSE_BATCH_MAX_WAIT_MS = float(os.environ.get("POSE_BATCH_MAX_WAIT_MS", "10"))
+# Most videos accepted in one check-form/batch request
+POSE_BATCH_MAX_VIDEOS = int(os.environ.get("POSE_BATCH_MAX_VIDEOS", "8"))
+# Largest encoded frame accepted from a live analysis WebSocket
+POSE_LIVE_MAX_FRAME_BYTES = int(
+    os.environ.get("POSE_LIVE_MAX_FRAME_BYTES", str(2 * 2**20))
+)
+# Return per-stage timings of each request in a Server-Timing header
+POSE_SERVER_TIMING = os.environ.get("POSE_SERVER_TIMING", "0") == "1"
+# Fraction of requests run under cProfile, with stats written to POSE_PROFILE_DIR
+POSE_PROFILE_SAMPLE_RATE = float(os.environ.get("POSE_PROFILE_SAMPLE_RATE", "0"))
+POSE_PROFILE_DIR = os.environ.get(
+    "POSE_PROFILE_DIR", str(BASE_DIR / "posedetection" / "profiles")
+)
+
+
+# Cloudflare R2 uploads
+
+# Connections kept open by the shared S3 client
+R2_MAX_POOL_CONNECTIONS = int(os.environ.get("R2_MAX_POOL_CONNECTIONS", "16"))
+# Files larger than one chunk are uploaded as concurrent multipart parts
+R2_MULTIPART_CHUNKSIZE = int(os.environ.get("R2_MULTIPART_CHUNKSIZE", str(8 * 2**20)))
+R2_MAX_CONCURRENCY = int(os.environ.get("R2_MAX_CONCURRENCY", "8"))
+# Return check-form results without waiting for the annotated video upload
+R2_UPLOAD_IN_BACKGROUND = os.environ.get("R2_UPLOAD_IN_BACKGROUND", "0") == "1"
+R2_UPLOAD_WORKERS = int(os.environ.get("R2_UPLOAD_WORKERS", "4"))
+
+# Chadbot
+
+# Model API calls in flight at once per process, and how long a chat request
+# waits for a free slot before being turned away
+CHADBOT_MAX_CONCURRENCY = int(os.environ.get("CHADBOT_MAX_CONCURRENCY", "8"))
+CHADBOT_QUEUE_TIMEOUT = float(os.environ.get("CHADBOT_QUEUE_TIMEOUT", "5"))
+# Seconds to connect to the model API, and to wait for each part of its answer
+CHADBOT_CONNECT_TIMEOUT = float(os.environ.get("CHADBOT_CONNECT_TIMEOUT", "5"))
+CHADBOT_READ_TIMEOUT = float(os.environ.get("CHADBOT_READ_TIMEOUT", "30"))
+# Answers to repeated conversations are reused for CHADBOT_CACHE_TTL seconds
+CHADBOT_CACHE_SIZE = int(os.environ.get("CHADBOT_CACHE_SIZE", "256"))
+CHADBOT_CACHE_TTL = float(os.environ.get("CHADBOT_CACHE_TTL", "3600"))
+# Model API base URL (empty uses the Cloudflare account in R2_ACCOUNT_ID)
+CHADBOT_API_BASE_URL = os.environ.get("CHADBOT_API_BASE_URL", "")